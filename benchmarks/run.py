@@ -0,0 +1,162 @@
+"""Time the main conversion steps on the test files and on synthetic pages.
+
+Usage:
+
+    python benchmarks/run.py -o results.jsonl
+    python benchmarks/run.py --compare results.jsonl
+
+Each result is written as one JSON object per line. With `--compare`, the
+new timings are compared with earlier results, and the exit status is
+non-zero if any got slower by more than `--threshold`.
+"""
+
+import argparse
+import io
+import json
+import platform
+import sys
+import tempfile
+import time
+from importlib.metadata import version, PackageNotFoundError
+from pathlib import Path
+
+from rmscene import read_tree
+
+from rmc.exporters.blocks import pprint_blocks
+from rmc.exporters.markdown import print_text
+from rmc.exporters.pdf import tree_to_pdf
+from rmc.exporters.points import read_packed_tree
+from rmc.exporters.svg import tree_to_svg
+from rmc.exporters.thumbnail import tree_to_thumbnail
+from rmc.exporters.writing_tools import np
+
+from synthetic import write_synthetic
+
+FIXTURES_DIR = Path(__file__).parent.parent / "tests" / "rm"
+
+# (strokes, points per stroke) for the synthetic pages
+DEFAULT_SIZES = ["10x100", "100x100", "1000x100", "100x1000"]
+
+
+def package_version(name):
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def benchmarks(data: bytes):
+    """Return the functions to time for an input file's `data`."""
+    tree = read_tree(io.BytesIO(data))
+    functions = {
+        "read_tree": lambda: read_tree(io.BytesIO(data)),
+        "tree_to_svg": lambda: tree_to_svg(tree, io.StringIO()),
+        "tree_to_pdf": lambda: tree_to_pdf(tree, io.BytesIO()),
+        "print_text": lambda: print_text(io.BytesIO(data), io.StringIO()),
+        "pprint_blocks": lambda: pprint_blocks(io.BytesIO(data), io.StringIO()),
+    }
+    if np is not None:
+        # Read as the command line does. A 200 pixel thumbnail of
+        # writing_tools_with_text.rm took 5-8ms on a 2026 Linux machine.
+        packed = read_packed_tree(io.BytesIO(data))
+        functions["tree_to_thumbnail"] = lambda: tree_to_thumbnail(packed, io.BytesIO())
+    return functions
+
+
+def time_function(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times), sum(times) / len(times)
+
+
+def inputs(sizes, tmpdir):
+    """Yield (name, params, path) for each file to benchmark."""
+    for path in sorted(FIXTURES_DIR.glob("*.rm")):
+        yield f"fixture:{path.name}", {}, path
+    for size in sizes:
+        strokes, points = (int(n) for n in size.split("x"))
+        path = Path(tmpdir) / f"synthetic-{size}.rm"
+        params = {"strokes": strokes, "points": points}
+        write_synthetic(path, **params)
+        yield f"synthetic:{size}", params, path
+
+
+def run(sizes, repeat, only=None):
+    environment = {
+        "rmc": package_version("rmc"),
+        "rmscene": package_version("rmscene"),
+        "python": platform.python_version(),
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, params, path in inputs(sizes, tmpdir):
+            data = path.read_bytes()
+            for bench, func in benchmarks(data).items():
+                if only and bench not in only:
+                    continue
+                best, mean = time_function(func, repeat)
+                yield {
+                    "benchmark": bench,
+                    "input": name,
+                    "params": params,
+                    "input_bytes": len(data),
+                    "best_s": best,
+                    "mean_s": mean,
+                    "repeat": repeat,
+                    **environment,
+                }
+
+
+def compare(results, baseline_path, threshold):
+    """Print the change from the baseline; return True if none regressed."""
+    baseline = {}
+    for line in Path(baseline_path).read_text().splitlines():
+        r = json.loads(line)
+        baseline[r["benchmark"], r["input"]] = r
+    ok = True
+    for r in results:
+        old = baseline.get((r["benchmark"], r["input"]))
+        if old is None:
+            continue
+        ratio = r["best_s"] / old["best_s"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  SLOWER"
+            ok = False
+        print(f"{r['benchmark']:14} {r['input']:45} {old['best_s'] * 1000:9.2f}ms "
+              f"-> {r['best_s'] * 1000:9.2f}ms  x{ratio:.2f}{flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", help="file to write results to (default: stdout)")
+    parser.add_argument("--sizes", nargs="*", default=DEFAULT_SIZES,
+                        help="synthetic page sizes as STROKESxPOINTS")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="*", help="benchmarks to run")
+    parser.add_argument("--compare", metavar="RESULTS", help="earlier results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slow-down counted as a regression")
+    args = parser.parse_args()
+
+    results = []
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for result in run(args.sizes, args.repeat, args.only):
+            results.append(result)
+            if args.output or not args.compare:
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+    finally:
+        if args.output:
+            out.close()
+
+    if args.compare and not compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
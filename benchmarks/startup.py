@@ -0,0 +1,132 @@
+"""Check that the rmc command starts quickly.
+
+Usage:
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --budget version=0.1 --budget markdown=0.2
+
+Each scenario runs `python -m rmc.cli` in a new process several times, and
+the best wall time is compared with its budget in seconds. The modules each
+scenario imports are also checked, since loading an exporter (or NumPy) that
+the command doesn't need is the usual way startup gets slower. The exit
+status is non-zero if any scenario is over budget or imports a module it
+shouldn't.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+SRC_DIR = Path(__file__).parent.parent / "src"
+FIXTURE = Path(__file__).parent.parent / "tests" / "rm" / "Bold_Heading_Bullet_Normal.rm"
+
+# name: (arguments to rmc, default budget in seconds, modules that must not
+# be imported)
+SCENARIOS = {
+    "version": (["--version"], 0.15, ["rmscene", "numpy", "rmc.exporters"]),
+    "markdown": (["-t", "markdown", str(FIXTURE)], 0.2,
+                 ["numpy", "rmc.exporters.svg", "rmc.exporters.pdf", "rmc.exporters.png"]),
+}
+
+
+def environment():
+    env = dict(os.environ)
+    path = env.get("PYTHONPATH")
+    env["PYTHONPATH"] = str(SRC_DIR) + (os.pathsep + path if path else "")
+    return env
+
+
+def run_rmc(args, extra=()):
+    return subprocess.run([sys.executable, *extra, "-m", "rmc.cli", *args],
+                          env=environment(), capture_output=True, text=True)
+
+
+def time_startup(args, repeat):
+    """Return the best wall time of `repeat` runs, or raise on failure."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run_rmc(args)
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            lines = result.stderr.strip().splitlines() or ["(no output)"]
+            raise RuntimeError(f"rmc exited with code {result.returncode}: {lines[-1]}")
+    return min(times)
+
+
+def imported_modules(args) -> list[str]:
+    """Return the names of the modules imported by running rmc with `args`."""
+    result = run_rmc(args, extra=["-X", "importtime"])
+    modules = []
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and line.count("|") == 2:
+            modules.append(line.rsplit("|", 1)[1].strip())
+    return modules
+
+
+def check(name, budget, repeat, forbidden):
+    args, _, _ = SCENARIOS[name]
+    result = {"scenario": name, "budget_s": budget}
+    try:
+        result["best_s"] = time_startup(args, repeat)
+    except RuntimeError as exc:
+        result["error"] = str(exc)
+        return result
+    modules = imported_modules(args)
+    result["unwanted_imports"] = [
+        f for f in forbidden
+        if any(module == f or module.startswith(f + ".") for module in modules)
+    ]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget", action="append", default=[], metavar="SCENARIO=SECONDS",
+                        help="override the time budget of a scenario")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    args = parser.parse_args()
+
+    budgets = {name: budget for name, (_, budget, _) in SCENARIOS.items()}
+    for item in args.budget:
+        name, _, seconds = item.partition("=")
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}")
+        budgets[name] = float(seconds)
+
+    interpreter_s = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"])
+        interpreter_s = min(interpreter_s, time.perf_counter() - start)
+
+    ok = True
+    for name, (_, _, forbidden) in SCENARIOS.items():
+        result = check(name, budgets[name], args.repeat, forbidden)
+        failed = ("error" in result or result["best_s"] > result["budget_s"]
+                  or result["unwanted_imports"])
+        ok = ok and not failed
+        if args.json:
+            print(json.dumps({**result, "interpreter_s": interpreter_s}))
+        elif "error" in result:
+            print(f"{name:10} FAILED: {result['error']}")
+        else:
+            flag = "  OVER BUDGET" if result["best_s"] > result["budget_s"] else ""
+            print(f"{name:10} {result['best_s'] * 1000:7.1f}ms "
+                  f"(budget {result['budget_s'] * 1000:.0f}ms){flag}")
+            if result["unwanted_imports"]:
+                print(f"{'':10} imports {', '.join(result['unwanted_imports'])}")
+    if not args.json:
+        print(f"{'python':10} {interpreter_s * 1000:7.1f}ms (interpreter startup, for reference)")
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Generate synthetic `.rm` files of any size for benchmarking.
+
+Usage:
+
+    python benchmarks/synthetic.py --strokes 1000 --points 200 \\
+        --tools 2,4,15 --layers 2 --paragraphs 10 -o big.rm
+
+Tools are the pen ids understood by `rmc.exporters.writing_tools.Pen.create`.
+"""
+
+import argparse
+import math
+import random
+from uuid import UUID
+
+from rmscene import (
+    write_blocks,
+    AuthorIdsBlock,
+    MigrationInfoBlock,
+    PageInfoBlock,
+    SceneTreeBlock,
+    RootTextBlock,
+    TreeNodeBlock,
+    SceneGroupItemBlock,
+    SceneLineItemBlock,
+    CrdtId,
+    LwwValue,
+)
+from rmscene import scene_items as si
+from rmscene.crdt_sequence import CrdtSequence, CrdtSequenceItem
+
+# Pen ids accepted by `Pen.create`, other than the erasers
+DEFAULT_TOOLS = (0, 1, 2, 3, 4, 5, 7, 12, 13, 14, 15, 16, 17, 18, 21)
+
+ROOT_ID = CrdtId(0, 1)
+END_ID = CrdtId(0, 0)
+
+
+def synthetic_blocks(strokes=100, points=100, tools=DEFAULT_TOOLS, layers=1,
+                     paragraphs=0, seed=0):
+    """Yield the blocks of a page with random strokes and text.
+
+    `strokes` strokes of `points` points each are spread evenly over
+    `layers` layers, cycling through the pen ids in `tools`.
+    """
+    rng = random.Random(seed)
+    ids = _id_counter()
+
+    yield AuthorIdsBlock(author_uuids={1: UUID(int=rng.getrandbits(128))})
+    yield MigrationInfoBlock(migration_id=CrdtId(1, 1), is_device=True)
+
+    text = "\n".join(
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+        for _ in range(paragraphs)
+    )
+    yield PageInfoBlock(loads_count=1, merges_count=0,
+                        text_chars_count=len(text) + 1,
+                        text_lines_count=text.count("\n") + 1)
+
+    layer_ids = [next(ids) for _ in range(layers)]
+    for layer_id in layer_ids:
+        yield SceneTreeBlock(tree_id=layer_id, node_id=END_ID,
+                             is_update=True, parent_id=ROOT_ID)
+
+    if text:
+        yield RootTextBlock(
+            block_id=END_ID,
+            value=si.Text(
+                items=CrdtSequence([
+                    CrdtSequenceItem(item_id=next(ids), left_id=END_ID, right_id=END_ID,
+                                     deleted_length=0, value=text)
+                ]),
+                formats={},
+                pos_x=-468.0,
+                pos_y=234.0,
+                width=936.0,
+            ),
+        )
+
+    yield TreeNodeBlock(si.Group(node_id=ROOT_ID))
+    for n, layer_id in enumerate(layer_ids, start=1):
+        yield TreeNodeBlock(si.Group(
+            node_id=layer_id,
+            label=LwwValue(timestamp=next(ids), value=f"Layer {n}"),
+        ))
+
+    left_id = END_ID
+    for layer_id in layer_ids:
+        item_id = next(ids)
+        yield SceneGroupItemBlock(
+            parent_id=ROOT_ID,
+            item=CrdtSequenceItem(item_id=item_id, left_id=left_id, right_id=END_ID,
+                                  deleted_length=0, value=layer_id),
+        )
+        left_id = item_id
+
+    last_item = {layer_id: END_ID for layer_id in layer_ids}
+    for n in range(strokes):
+        layer_id = layer_ids[n % layers]
+        item_id = next(ids)
+        line = si.Line(
+            color=si.PenColor(rng.choice((0, 1, 6, 7))),
+            tool=si.Pen(tools[n % len(tools)]),
+            points=_random_points(rng, points),
+            thickness_scale=rng.choice((1.0, 2.0, 3.0)),
+            starting_length=0.0,
+        )
+        yield SceneLineItemBlock(
+            parent_id=layer_id,
+            item=CrdtSequenceItem(item_id=item_id, left_id=last_item[layer_id],
+                                  right_id=END_ID, deleted_length=0, value=line),
+        )
+        last_item[layer_id] = item_id
+
+
+def _id_counter():
+    n = 16
+    while True:
+        yield CrdtId(1, n)
+        n += 1
+
+
+def _random_points(rng, n):
+    """Return `n` points along a random smooth path."""
+    x = rng.uniform(-600, 600)
+    y = rng.uniform(100, 1700)
+    angle = rng.uniform(0, 2 * math.pi)
+    points = []
+    for _ in range(n):
+        angle += rng.gauss(0, 0.2)
+        x += 2 * math.cos(angle)
+        y += 2 * math.sin(angle)
+        points.append(si.Point(
+            x=x,
+            y=y,
+            speed=rng.randint(0, 200),
+            direction=int(angle % (2 * math.pi) * 255 / (2 * math.pi)),
+            width=rng.randint(8, 20),
+            pressure=rng.randint(50, 255),
+        ))
+    return points
+
+
+WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "consectetur",
+         "adipiscing", "elit", "sed", "do", "eiusmod", "tempor")
+
+
+def write_synthetic(path, **kwargs):
+    """Write a synthetic page to `path`; see `synthetic_blocks`."""
+    with open(path, "wb") as f:
+        write_blocks(f, synthetic_blocks(**kwargs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("--strokes", type=int, default=100)
+    parser.add_argument("--points", type=int, default=100)
+    parser.add_argument("--tools", default=",".join(map(str, DEFAULT_TOOLS)),
+                        help="comma-separated pen ids")
+    parser.add_argument("--layers", type=int, default=1)
+    parser.add_argument("--paragraphs", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_synthetic(
+        args.output,
+        strokes=args.strokes,
+        points=args.points,
+        tools=[int(t) for t in args.tools.split(",")],
+        layers=args.layers,
+        paragraphs=args.paragraphs,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,30 @@
-from .exporters.svg import tree_to_svg, rm_to_svg
-from .exporters.pdf import rm_to_pdf
+# The exporters are imported when first used, so that importing rmc (and
+# starting the command line tool) stays fast.
+_EXPORTS = {
+    "tree_to_svg": "rmc.exporters.svg",
+    "trees_to_svg": "rmc.exporters.svg",
+    "rm_to_svg": "rmc.exporters.svg",
+    "rm_to_pdf": "rmc.exporters.pdf",
+    "tree_to_pdf": "rmc.exporters.pdf",
+    "trees_to_pdf": "rmc.exporters.pdf",
+    "rm_to_png": "rmc.exporters.png",
+    "tree_to_png": "rmc.exporters.png",
+    "tree_to_thumbnail": "rmc.exporters.thumbnail",
+    "StrokeIndex": "rmc.spatial",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+
+    value = getattr(import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
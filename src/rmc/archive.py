@@ -0,0 +1,258 @@
+"""Read the pages of notebooks from `.rmdoc` and zip archives.
+
+An `.rmdoc` file, as exported by the reMarkable apps, is a zip archive of a
+notebook's files as xochitl stores them (see `rmc.notebook`): the
+`<uuid>.content` file giving the page order, `<uuid>.metadata`, and a
+`<uuid>/<page>.rm` file for each page with content. Archives without a
+`.content` file are read as their rm files in name order.
+
+Pages are read straight from the archive, without extracting it. Archives
+usually store rm files uncompressed, and those are read through a memory
+map of the archive, so the page's bytes are only copied as they are
+parsed, once each, into the buffer of the reader. Compressed pages are
+decompressed into memory.
+
+Pages are numbered from 1 in page order, counting blank pages, which have
+no rm file. An input can select some of them with `#`, as in
+`notes.rmdoc#3`, `notes.rmdoc#3-10` or `notes.rmdoc#1,5-`.
+"""
+
+import io
+import json
+import logging
+import mmap
+import struct
+import zlib
+from pathlib import Path, PurePosixPath
+from typing import NamedTuple, Optional
+
+_logger = logging.getLogger(__name__)
+
+
+ARCHIVE_SUFFIXES = (".rmdoc", ".zip")
+
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+LOCAL_HEADER_SIZE = 30
+# Offset of the file name and extra field lengths in a local header
+LOCAL_HEADER_LENGTHS = 26
+ENCRYPTED_FLAG = 0x1
+
+
+class ArchivePage(NamedTuple):
+    """A page of a notebook in an archive, used in place of an rm file's path."""
+
+    archive: Path
+    # Counting from 1, in page order
+    number: int
+    page_id: str
+    member: str
+
+    @property
+    def stem(self) -> str:
+        # Outputs are named after the archive and page number
+        return f"{self.archive.stem}-{self.number}"
+
+    @property
+    def name(self) -> str:
+        return self.stem + self.suffix
+
+    @property
+    def suffix(self) -> str:
+        return ".rm"
+
+    def __str__(self):
+        return f"{self.archive}#{self.number}"
+
+    def open(self, mode="rb"):
+        """Open the page's rm file for reading."""
+        if mode != "rb":
+            raise ValueError("Archive pages can only be opened in mode 'rb'")
+        return open_member(self.archive, self.member)
+
+
+def is_archive(path) -> bool:
+    return Path(path).suffix.lower() in ARCHIVE_SUFFIXES
+
+
+def split_selection(spec: str) -> tuple[Path, Optional[str]]:
+    """Split an input into its path and page selection, if it is an archive's."""
+    path, hash, pages = str(spec).rpartition("#")
+    if hash and is_archive(path):
+        return Path(path), pages
+    return Path(spec), None
+
+
+def expand_inputs(specs) -> list:
+    """Return the paths of `specs`, with archives replaced by their selected pages."""
+    result = []
+    for spec in specs:
+        path, pages = split_selection(spec)
+        if is_archive(path):
+            result.extend(archive_pages(path, pages))
+        else:
+            result.append(path)
+    return result
+
+
+def archive_pages(path: Path, pages: Optional[str] = None) -> list[ArchivePage]:
+    """Return the pages of the notebook in the archive at `path`, in order.
+
+    `pages` selects pages by number, as in `"3-10"`. Blank pages are left
+    out. Raises `ValueError` if the archive can't be read or the selection
+    is invalid.
+    """
+    # These take a while to import, and are only needed for archives
+    import zipfile
+    from .notebook import content_page_ids
+
+    path = Path(path)
+    try:
+        with zipfile.ZipFile(path) as archive:
+            names = archive.namelist()
+            content_names = [name for name in names
+                             if name.endswith(".content") and "/" not in name]
+            if len(content_names) > 1:
+                raise ValueError(f"{path} holds {len(content_names)} notebooks, not one")
+            if content_names:
+                page_ids = content_page_ids(json.loads(archive.read(content_names[0])))
+                base = content_names[0][:-len(".content")]
+                members = [f"{base}/{page_id}.rm" for page_id in page_ids]
+            else:
+                members = sorted(name for name in names if name.endswith(".rm"))
+                page_ids = [PurePosixPath(name).stem for name in members]
+    except zipfile.BadZipFile as exc:
+        raise ValueError(f"{path}: {exc}")
+
+    numbers = range(1, len(members) + 1) if pages is None else parse_pages(pages, len(members))
+    present = set(names)
+    result = []
+    for number in numbers:
+        member = members[number - 1]
+        if member in present:
+            result.append(ArchivePage(path, number, page_ids[number - 1], member))
+        else:
+            _logger.info("Page %d of %s is blank", number, path)
+    if not result:
+        raise ValueError(f"{path} has no pages with content" if pages is None
+                         else f"Pages {pages} of {path} are blank")
+    return result
+
+
+def parse_pages(text: str, count: int) -> list[int]:
+    """Return the numbers of the pages selected by `text` out of `count`.
+
+    `text` is a comma-separated list of page numbers and ranges, such as
+    `"1,3-10"`. Ranges may leave out their first or last page.
+    """
+    numbers = []
+    for part in text.split(","):
+        first, dash, last = part.strip().partition("-")
+        try:
+            start = int(first) if first else 1
+            end = (int(last) if last else count) if dash else start
+        except ValueError:
+            raise ValueError(f"Invalid page selection {text!r}")
+        if not 1 <= start <= end <= count:
+            raise ValueError(f"Page selection {part.strip()!r} is not within pages 1-{count}")
+        numbers.extend(range(start, end + 1))
+    return numbers
+
+
+def open_member(path: Path, member: str):
+    """Open the file `member` of the archive at `path` for reading.
+
+    Uncompressed members are read from a memory map of the archive.
+    """
+    import zipfile
+
+    with open(path, "rb") as f, zipfile.ZipFile(f) as archive:
+        info = archive.getinfo(member)
+        if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & ENCRYPTED_FLAG:
+            return io.BytesIO(archive.read(info))
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        start = member_offset(mapping, info)
+        with memoryview(mapping)[start:start + info.file_size] as view:
+            if zlib.crc32(view) != info.CRC:
+                raise zipfile.BadZipFile(f"Bad CRC-32 for file {member!r}")
+        # The small reads of parsing are quicker through a buffer
+        return io.BufferedReader(MappedFile(mapping, start, info.file_size))
+    except BaseException:
+        mapping.close()
+        raise
+
+
+def member_offset(mapping: mmap.mmap, info) -> int:
+    """Return the offset of the data of the archive member `info` in `mapping`."""
+    import zipfile
+
+    offset = info.header_offset
+    if mapping[offset:offset + len(LOCAL_HEADER_SIGNATURE)] != LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f"Bad local header for file {info.filename!r}")
+    name_length, extra_length = struct.unpack_from(
+        "<HH", mapping, offset + LOCAL_HEADER_LENGTHS)
+    return offset + LOCAL_HEADER_SIZE + name_length + extra_length
+
+
+class MappedFile(io.RawIOBase):
+    """A read-only file of `size` bytes from `start` in a memory map.
+
+    `read` returns a copy of the bytes read, as bytes must be: a view of
+    the map would keep it from being closed. `readinto` copies straight
+    from the map into the caller's buffer, so reads through a buffered
+    reader copy each byte once. The memory map is closed with the file.
+    """
+
+    def __init__(self, mapping: mmap.mmap, start: int, size: int):
+        self._mapping = mapping
+        self._view = memoryview(mapping)[start:start + size]
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1) -> bytes:
+        self._checkClosed()
+        end = len(self._view) if size is None or size < 0 else self._position + size
+        data = self._view[self._position:end].tobytes()
+        self._position += len(data)
+        return data
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def readinto(self, buffer) -> int:
+        self._checkClosed()
+        with memoryview(buffer) as view, view.cast("B") as target:
+            size = max(min(len(target), len(self._view) - self._position), 0)
+            target[:size] = self._view[self._position:self._position + size]
+        self._position += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET) -> int:
+        self._checkClosed()
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = len(self._view) + offset
+        else:
+            raise ValueError(f"Invalid whence ({whence})")
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+        self._position = position
+        return position
+
+    def tell(self) -> int:
+        self._checkClosed()
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+            self._mapping.close()
+        super().close()
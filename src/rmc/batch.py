@@ -0,0 +1,117 @@
+"""Convert many rm files in parallel using a pool of worker processes."""
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+
+from .formats import output_suffix
+
+_logger = logging.getLogger(__name__)
+
+# Times the files left when a worker dies are run in a new pool, before
+# running them one at a time to find the one that kills its worker
+POOL_RETRIES = 1
+
+
+class BatchResult(NamedTuple):
+    input: Path
+    output: Path
+    error: Optional[str] = None
+
+
+def output_path(input: Path, to: str, out_dir: Path) -> Path:
+    """Return the path in `out_dir` to write the conversion of `input` to."""
+    return out_dir / (input.stem + output_suffix(to))
+
+
+def output_paths(inputs: list, to: str, out_dir: Path) -> list[Path]:
+    """Return the output path of each of `inputs`.
+
+    Raises `ValueError` if different inputs would be written to the same
+    file, as `a/page.rm` and `b/page.rm` would.
+    """
+    outputs = [output_path(fn, to, out_dir) for fn in inputs]
+    seen = {}
+    for fn, output in zip(inputs, outputs):
+        if seen.setdefault(output, fn) != fn:
+            raise ValueError(f"{seen[output]} and {fn} would both be written to {output}")
+    return outputs
+
+
+def convert_one(input: Path, to: str, output: Path, **options) -> BatchResult:
+    """Convert a single file, catching any error so the batch can continue.
+
+    This runs in the worker processes; the imports happen once per worker
+    and are reused for every file it converts.
+    """
+    from .cli import convert_rm, open_output
+
+    try:
+        with open_output(to, output) as fout:
+            convert_rm(input, to, fout, **options)
+    except Exception as exc:
+        _logger.debug("Failed to convert %s", input, exc_info=True)
+        # Don't leave a truncated output file behind
+        output.unlink(missing_ok=True)
+        return BatchResult(input, output, f"{type(exc).__name__}: {exc}")
+    return BatchResult(input, output)
+
+
+def convert_batch(inputs: Iterable[Path], to: str, out_dir: Path,
+                  jobs: Optional[int] = None, **options) -> Iterable[BatchResult]:
+    """Convert `inputs` to format `to`, writing one file each into `out_dir`.
+
+    Results are yielded in order of completion. With `jobs` of 1 the files
+    are converted in the current process. Extra `options` are passed on to
+    `convert_rm`. Raises `ValueError`, before converting anything, if two
+    inputs have the same output path.
+
+    A worker process that dies, e.g. running out of memory on a large page,
+    fails only the file it was converting.
+    """
+    inputs = list(inputs)
+    pending = list(zip(inputs, output_paths(inputs, to, out_dir)))
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(pending)))
+
+    if jobs == 1:
+        for fn, output in pending:
+            yield convert_one(fn, to, output, **options)
+        return
+
+    for _ in range(POOL_RETRIES + 1):
+        pending = yield from convert_in_pool(pending, to, min(jobs, len(pending)), **options)
+        if not pending:
+            return
+    for fn, output in pending:
+        # On its own, a worker that dies can only have been converting this file
+        if (yield from convert_in_pool([(fn, output)], to, 1, **options)):
+            output.unlink(missing_ok=True)
+            yield BatchResult(fn, output, "Worker process died")
+
+
+def convert_in_pool(pending: list, to: str, workers: int, **options):
+    """Convert `(input, output)` pairs in a new pool, yielding the results.
+
+    Returns the pairs that weren't converted because a worker died, which
+    breaks the pool for every job not finished.
+    """
+    broken = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(convert_one, fn, to, output, **options): (fn, output)
+            for fn, output in pending
+        }
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except BrokenProcessPool:
+                broken.append(futures[future])
+    if broken:
+        _logger.warning("A worker process died; %d files to convert again", len(broken))
+    return broken
@@ -0,0 +1,220 @@
+"""On-disk cache of conversion results.
+
+Results are stored under a hash of the input file contents, the output
+format, the conversion options, the versions of rmc and rmscene and the
+source code of rmc itself, so a cache hit never needs to parse the input
+and changing the code (e.g. in a source checkout) invalidates old results.
+The cache is limited in size, and the least recently used results are
+evicted first.
+
+Several processes can share a cache directory: entries are written
+atomically, and the bookkeeping is protected by a lock file where the
+platform supports it. Lookups don't take the lock: hits and misses are
+appended to a log, which is added up when the statistics are read.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+from importlib.metadata import version, PackageNotFoundError
+from io import BytesIO, StringIO
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_logger = logging.getLogger(__name__)
+
+
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+
+# The log of lookups has a byte for each
+LOG_NAME = "lookups.log"
+HIT = b"h"
+MISS = b"m"
+
+
+def _package_version(name):
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def _source_hash() -> str:
+    """Return a hash of the source files of rmc."""
+    h = hashlib.sha256()
+    package_dir = Path(__file__).parent
+    for path in sorted(package_dir.rglob("*.py")):
+        h.update(str(path.relative_to(package_dir)).encode() + b"\0")
+        h.update(path.read_bytes() + b"\0")
+    return h.hexdigest()
+
+
+class ConversionCache:
+    """A size-limited cache of conversion results in `directory`.
+
+    `max_size` is the total size of cached results in bytes.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.objects_dir = self.directory / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self._versions = (f"rmc={_package_version('rmc')};rmscene={_package_version('rmscene')};"
+                          f"source={_source_hash()}")
+
+    def key(self, data: bytes, to: str, options: Optional[dict] = None) -> str:
+        """Return the cache key for converting `data` to format `to`."""
+        h = hashlib.sha256(data)
+        h.update(b"\0" + to.encode())
+        h.update(b"\0" + json.dumps(options or {}, sort_keys=True, default=str).encode())
+        h.update(b"\0" + self._versions.encode())
+        return h.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.objects_dir / key[:2] / key[2:]
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached result for `key`, or None if it is not cached."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                result = f.read()
+        except FileNotFoundError:
+            self._log(MISS)
+            return None
+        try:
+            # The modification time records when the entry was last used
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process in the meantime
+            pass
+        self._log(HIT)
+        return result
+
+    def put(self, key: str, result: bytes):
+        """Store `result` under `key`, evicting old entries if needed.
+
+        Processes storing the same result at once each count its size,
+        which only makes eviction check the real total sooner.
+        """
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(result)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        with self._locked_stats() as stats:
+            stats["size"] = stats.get("size", 0) + len(result)
+            if stats["size"] > self.max_size:
+                stats["size"] = self._evict()
+
+    def _evict(self) -> int:
+        """Remove least recently used entries until within the size limit.
+
+        Returns the new total size. Must be called with the lock held.
+        """
+        entries = []
+        for path in self.objects_dir.glob("*/*"):
+            if path.name.startswith(".tmp-"):
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        # Evict down to 90% of the limit, so not every write has to evict
+        target = self.max_size * 0.9
+        entries.sort()
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+        _logger.debug("Evicted cache entries, size now %d", total)
+        return total
+
+    def convert(self, filename: Path, to: str, fout, **options):
+        """Convert `filename` to `to`, writing to `fout`, using the cache.
+
+        `options` are passed to `convert_rm`, and are part of the cache key.
+        """
+        from .cli import convert_rm, open_input
+        from .formats import is_binary_format
+
+        with open_input(filename) as f:
+            key = self.key(f.read(), to, options)
+        result = self.get(key)
+        binary = is_binary_format(to)
+        if result is None:
+            buf = BytesIO() if binary else StringIO()
+            convert_rm(filename, to, buf, **options)
+            result = buf.getvalue() if binary else buf.getvalue().encode("utf-8")
+            self.put(key, result)
+        fout.write(result if binary else result.decode("utf-8"))
+
+    def stats(self) -> dict:
+        """Return the hit and miss counts and total size of the cache."""
+        with self._locked_stats() as stats:
+            return {"hits": 0, "misses": 0, "size": 0, **stats}
+
+    def _log(self, outcome: bytes):
+        """Record a hit or miss, without taking the lock."""
+        # Appends this small are atomic, so processes don't interleave them
+        fd = os.open(self.directory / LOG_NAME, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, outcome)
+        finally:
+            os.close(fd)
+
+    def _add_log(self, stats: dict):
+        """Add the hits and misses logged so far to `stats`, starting a new log.
+
+        Must be called with the lock held. A lookup logged by a process that
+        opened the log just before it was moved aside may go uncounted.
+        """
+        log_path = self.directory / LOG_NAME
+        reading_path = log_path.with_suffix(".reading")
+        try:
+            os.replace(log_path, reading_path)
+        except FileNotFoundError:
+            return
+        outcomes = reading_path.read_bytes()
+        reading_path.unlink()
+        stats["hits"] = stats.get("hits", 0) + outcomes.count(HIT)
+        stats["misses"] = stats.get("misses", 0) + outcomes.count(MISS)
+
+    @contextmanager
+    def _locked_stats(self):
+        """Lock the cache and yield its statistics, saving changes made."""
+        with open(self.directory / "lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            stats_path = self.directory / "stats.json"
+            try:
+                stats = json.loads(stats_path.read_text())
+            except (FileNotFoundError, ValueError):
+                stats = {}
+            original = dict(stats)
+            self._add_log(stats)
+            yield stats
+            if stats != original:
+                tmp_path = stats_path.with_suffix(".tmp")
+                tmp_path.write_text(json.dumps(stats))
+                os.replace(tmp_path, stats_path)
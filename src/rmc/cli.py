@@ -2,33 +2,109 @@
 
 import os
 import sys
-import io
 from pathlib import Path
 from contextlib import contextmanager
 import click
-from rmscene import read_tree, read_blocks, write_blocks, simple_text_document
-from .exporters.svg import tree_to_svg
-from .exporters.pdf import svg_to_pdf
-from .exporters.markdown import print_text
+from . import metrics
+from .formats import UnknownFormat, format_for_suffix, get_format, is_binary_format, load_converter
 
 import logging
 
 
+class InputPath(click.Path):
+    """An existing path, which for archives may end in a `#PAGES` selection."""
+
+    def convert(self, value, param, ctx):
+        from .archive import split_selection
+
+        path, pages = split_selection(value)
+        super().convert(str(path), param, ctx)
+        return value
+
+
 @click.command
 @click.version_option()
 @click.option('-v', '--verbose', count=True)
 @click.option("-f", "--from", "from_", metavar="FORMAT", help="Format to convert from (default: guess from filename)")
 @click.option("-t", "--to", metavar="FORMAT", help="Format to convert to (default: guess from filename)")
 @click.option("-o", "--output", type=click.Path(), help="Output filename (default: write to standard out)")
-@click.argument("input", nargs=-1, type=click.Path(exists=True))
-def cli(verbose, from_, to, output, input):
+@click.option("--batch", is_flag=True, help="Convert each input to its own file in --out-dir, in parallel")
+@click.option("--notebook", is_flag=True, help="Export the pages of xochitl notebooks to --out-dir, re-rendering only changed pages")
+@click.option("-j", "--jobs", type=int, help="Number of worker processes for --batch (default: number of CPUs)")
+@click.option("--out-dir", type=click.Path(file_okay=False), help="Output directory for --batch")
+@click.option("--inkscape", is_flag=True, help="Convert to PDF via SVG using Inkscape instead of the built-in PDF writer")
+@click.option("--dpi", type=float, help="Resolution of PNG output in pixels per inch (default: 226, the tablet's resolution)")
+@click.option("--thumbnail", type=int, metavar="WIDTH", help="Draw a quick, low-detail PNG thumbnail WIDTH pixels wide")
+@click.option("--bbox", callback=lambda ctx, param, value: parse_bbox(value), metavar="X0,Y0,X1,Y1", help="Only show this region of the page, in screen coordinates (x is 0 at the centre), in SVG, PDF and PNG output")
+@click.option("--simplify", type=float, metavar="TOLERANCE", help="Simplify strokes in SVG, PDF and PNG output, keeping within TOLERANCE screen pixels of the original")
+@click.option("--precision", type=click.IntRange(min=0), metavar="DIGITS", help="Write SVG strokes as compact paths, with coordinates rounded to DIGITS decimal places")
+@click.option("--cull-erased", is_flag=True, help="Leave out strokes hidden by later eraser strokes, and erasers with nothing left under them, in SVG, PDF and PNG output")
+@click.option("--summarize-points", is_flag=True, help="In blocks-json and tree-json output, give the number of points of each stroke and their bounding box instead of the points")
+@click.option("--cache", "cache_dir", type=click.Path(file_okay=False), help="Directory to cache conversion results in")
+@click.option("--cache-size", type=int, default=1024, show_default=True, metavar="MB", help="Maximum size of the --cache directory")
+@click.option("--profile", is_flag=True, help="Print the time spent in each phase of the conversion and other statistics")
+@click.option("--metrics", "metrics_file", type=click.Path(dir_okay=False), help="Write conversion metrics to FILE, as Prometheus text if it ends in .prom, otherwise JSON")
+@click.option("--serve", metavar="SOCKET", type=click.Path(dir_okay=False), help="Run a conversion server listening on the Unix socket SOCKET")
+@click.option("--max-pending", type=int, metavar="N", help="Number of requests --serve runs or queues before making others wait (default: twice --jobs)")
+@click.option("--request-timeout", type=float, default=60, show_default=True, metavar="SECONDS", help="Time limit for each --serve request")
+@click.option("--serve-root", type=click.Path(exists=True, file_okay=False), metavar="DIR", help="Let --serve requests give the paths of files under DIR, instead of sending their contents")
+@click.option("--index", "index_db", metavar="DB", type=click.Path(dir_okay=False), help="Update the full-text search index DB with the text and highlights of the inputs")
+@click.option("--search", metavar="QUERY", help="Search the --index DB for QUERY")
+@click.argument("input", nargs=-1, type=InputPath(exists=True))
+def cli(verbose, from_, to, output, batch, notebook, jobs, out_dir, inkscape, dpi, thumbnail, bbox, simplify, precision, cull_erased, summarize_points, cache_dir, cache_size, profile, metrics_file, serve, max_pending, request_timeout, serve_root, index_db, search, input):
     """Convert to/from reMarkable v6 files.
 
-    Available FORMATs are: `rm` (reMarkable file), `markdown`, `svg`, `pdf`,
-    `blocks`, `blocks-data`.
+    Available FORMATs are: `rm` (reMarkable file), `markdown`, `svg`, `svgz`
+    (gzipped SVG), `pdf`, `png`, `blocks`, `blocks-data`, and any added by
+    other packages through the `rmc.formats` entry point group.
 
     Formats `blocks` and `blocks-data` dump the internal structure of the `rm`
-    file, with and without detailed data values respectively.
+    file, with and without detailed data values respectively. Formats
+    `blocks-json` and `tree-json` write the blocks or the items of the scene
+    tree as newline-delimited JSON, as they are read.
+
+    Several `rm` inputs converted to `svg`, `svgz` or `pdf` become the pages
+    of one document.
+
+    `.rmdoc` and zip archives of a notebook are read directly, as their
+    pages in order. Add `#PAGES` to an archive's path to select pages by
+    number, e.g. `notes.rmdoc#3-10` or `notes.rmdoc#1,5-`.
+
+    With `--cull-erased`, strokes and ends of strokes that are completely
+    covered by later eraser strokes are left out of drawn output, along with
+    the erasers that then have nothing left to cover.
+
+    Converting `rm` files to `rm` compacts them, leaving out deleted items
+    and groups that can't be seen, and reports how much smaller they got.
+    Several files are written to `--out-dir`.
+
+    With `--batch`, each input is converted to a separate file in `--out-dir`
+    using a pool of `--jobs` worker processes. Failures are reported per file
+    without stopping the run.
+
+    With `--notebook`, each input is a notebook's `.content` file or page
+    directory. Its pages are exported to `--out-dir`, converting only pages
+    that changed since the last export there.
+
+    With `--cache`, results are stored under a hash of the input and
+    options, and unchanged inputs are not converted again.
+
+    With `--profile` or `--metrics`, the wall and CPU time of each phase
+    (parsing, text layout, anchors, drawing strokes, Inkscape) are recorded,
+    along with counts of strokes per tool, points, segments and output
+    bytes. Only conversions in this process are measured, not `--batch`
+    workers.
+
+    With `--serve`, rmc runs a server converting files sent over a Unix
+    socket by `rmc.server.Client`, using a pool of `--jobs` worker processes
+    that stay running between requests. Requests send the files' contents,
+    or with `--serve-root`, may give the paths of files under it. It stops
+    on SIGINT or SIGTERM after finishing the requests in progress.
+
+    With `--index`, the text and highlights of the inputs (rm files,
+    notebooks or xochitl directories) are added to a full-text search
+    index, reading only files that changed since the last update. Add
+    `--search` to search it, using SQLite FTS5 query syntax.
 
     """
 
@@ -39,10 +115,36 @@ def cli(verbose, from_, to, output, input):
     else:
         logging.basicConfig(level=logging.WARNING)
 
-    input = [Path(p) for p in input]
+    if serve is not None:
+        from .server import serve as run_server
+        try:
+            run_server(serve, jobs, max_pending, request_timeout,
+                       ready=lambda: click.echo(f"Listening on {serve}", err=True), root=serve_root)
+        except OSError as exc:
+            raise click.ClickException(str(exc))
+        return
+
+    from .archive import expand_inputs, is_archive, split_selection
+
+    if any(is_archive(split_selection(p)[0]) for p in input):
+        if index_db is not None or notebook:
+            raise click.UsageError("--index and --notebook don't read archives")
+
+    if index_db is not None:
+        run_index(index_db, [Path(p) for p in input], search)
+        return
+    if search is not None:
+        raise click.UsageError("--search requires --index")
+
+    try:
+        input = expand_inputs(input)
+    except ValueError as exc:
+        raise click.UsageError(str(exc))
     if output is not None:
         output = Path(output)
 
+    if from_ is None and notebook:
+        from_ = "rm"
     if from_ is None:
         if not input:
             raise click.UsageError("Must specify input filename or --from")
@@ -51,24 +153,190 @@ def cli(verbose, from_, to, output, input):
         if output is None:
             raise click.UsageError("Must specify --output or --to")
         to = guess_format(output)
-
-    if from_ == "rm":
+    if to != "rm":
+        try:
+            get_format(to)
+        except UnknownFormat as exc:
+            raise click.UsageError(str(exc))
+    if thumbnail is not None and to != "png":
+        raise click.UsageError("--thumbnail requires png output")
+    if thumbnail is not None and dpi is not None:
+        raise click.UsageError("--thumbnail sets the size of the image, so can't be used with --dpi")
+    if bbox is not None and (to not in ("svg", "svgz", "pdf", "png") or thumbnail is not None):
+        raise click.UsageError("--bbox only applies to svg, svgz, pdf and png output")
+    if precision is not None and to not in ("svg", "svgz"):
+        raise click.UsageError("--precision only applies to svg and svgz output")
+    if cull_erased and to not in ("svg", "svgz", "pdf", "png"):
+        raise click.UsageError("--cull-erased only applies to svg, svgz, pdf and png output")
+    if summarize_points and to not in ("blocks-json", "tree-json"):
+        raise click.UsageError("--summarize-points only applies to blocks-json and tree-json output")
+
+    options = dict(inkscape=inkscape, simplify=simplify, dpi=dpi, thumbnail=thumbnail, bbox=bbox,
+                   precision=precision, cull_erased=cull_erased, summarize_points=summarize_points)
+    if cache_dir is not None:
+        from .cache import ConversionCache
+        options["cache"] = ConversionCache(cache_dir, max_size=cache_size * 1024 * 1024)
+
+    collected = metrics.enable() if profile or metrics_file else None
+    try:
+        with metrics.phase("total"):
+            run_conversion(from_, to, output, batch, notebook, jobs, out_dir, input, options)
+    finally:
+        metrics.disable()
+
+    if "cache" in options:
+        logging.info("Cache statistics: %s", options["cache"].stats())
+    if collected is not None:
+        report_metrics(collected, profile, metrics_file)
+
+
+def run_conversion(from_, to, output, batch, notebook, jobs, out_dir, input, options):
+    inkscape = options["inkscape"]
+    simplify = options["simplify"]
+    bbox = options["bbox"]
+    if notebook:
+        if out_dir is None:
+            raise click.UsageError("--notebook requires --out-dir")
+        run_notebooks(input, to, Path(out_dir), jobs, **options)
+    elif from_ == "rm" and to == "rm":
+        run_compaction(input, output, None if out_dir is None else Path(out_dir))
+    elif batch:
+        if out_dir is None:
+            raise click.UsageError("--batch requires --out-dir")
+        if from_ != "rm":
+            raise click.UsageError("--batch only supports rm input files")
+        run_batch(input, to, Path(out_dir), jobs, **options)
+    elif from_ == "rm" and to in ("svg", "svgz", "pdf") and len(input) > 1:
+        if inkscape:
+            raise click.UsageError("--inkscape only supports a single input file")
+        with open_output(to, output) as fout:
+            fout = counting_output(fout)
+            convert_rm_pages(input, to, fout, simplify=simplify, bbox=bbox,
+                             precision=options["precision"], cull_erased=options["cull_erased"])
+    elif from_ == "rm":
+        if to == "png" and len(input) > 1:
+            raise click.UsageError("png only supports a single input file; use --batch for several")
         with open_output(to, output) as fout:
+            fout = counting_output(fout)
             for fn in input:
-                convert_rm(Path(fn), to, fout)
+                convert_rm(fn, to, fout, **options)
     elif from_ == "markdown":
         text = "".join(
             Path(fn).read_text() for fn in input
         )
         with open_output(to, output) as fout:
+            fout = counting_output(fout)
             convert_text(text, fout)
     else:
         raise click.UsageError("source format %s not implemented yet" % from_)
 
 
+def counting_output(fout):
+    """Wrap `fout` to count the output size if metrics are being collected."""
+    return metrics.CountingWriter(fout) if metrics.enabled() else fout
+
+
+def report_metrics(collected, profile, metrics_file):
+    if profile:
+        click.echo(collected.summary(), err=True)
+    if metrics_file:
+        text = collected.to_prometheus() if metrics_file.endswith(".prom") else collected.to_json()
+        Path(metrics_file).write_text(text)
+
+
+def run_batch(input, to, out_dir, jobs, **options):
+    from .batch import convert_batch, output_paths
+
+    try:
+        output_paths(input, to, out_dir)
+    except ValueError as exc:
+        raise click.UsageError(str(exc))
+
+    failures = 0
+    for result in convert_batch(input, to, out_dir, jobs, **options):
+        if result.error is None:
+            click.echo(f"{result.input} -> {result.output}", err=True)
+        else:
+            failures += 1
+            click.echo(f"{result.input}: FAILED: {result.error}", err=True)
+    if failures:
+        raise click.ClickException(f"{failures} of {len(input)} files failed to convert")
+
+
+def run_compaction(input, output, out_dir):
+    from .compact import compact_rm
+
+    if out_dir is not None:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        targets = [(fn, out_dir / fn.name) for fn in input]
+    elif len(input) == 1:
+        targets = [(input[0], output)]
+    else:
+        raise click.UsageError("Compacting several rm files requires --out-dir")
+    for fn, target in targets:
+        if target is not None and target.exists() and target.samefile(getattr(fn, "archive", fn)):
+            raise click.UsageError(f"Compacting {fn} would overwrite it")
+
+    total_before = total_after = 0
+    for fn, target in targets:
+        with open_input(fn) as f, open_output("rm", target) as fout:
+            result = compact_rm(f, fout)
+        total_before += result.size_before
+        total_after += result.size_after
+        click.echo(f"{fn}: {result.size_before} -> {result.size_after} bytes "
+                   f"({percent_change(result.size_before, result.size_after)}), "
+                   f"{result.items_dropped} items and {result.groups_dropped} groups dropped",
+                   err=True)
+    if len(targets) > 1:
+        click.echo(f"Total: {total_before} -> {total_after} bytes "
+                   f"({percent_change(total_before, total_after)})", err=True)
+
+
+def percent_change(before, after) -> str:
+    return f"{(after - before) / before * 100:+.1f}%" if before else "+0.0%"
+
+
+def run_index(index_db, input, query):
+    import sqlite3
+    from .search import SearchIndex
+
+    with SearchIndex(index_db) as index:
+        if input:
+            result = index.update(input)
+            click.echo(f"{len(result.indexed)} files indexed, {len(result.unchanged)} unchanged, "
+                       f"{len(result.removed)} removed", err=True)
+            for path, error in result.errors.items():
+                click.echo(f"{path}: FAILED: {error}", err=True)
+        if query is not None:
+            try:
+                hits = index.search(query)
+            except sqlite3.OperationalError as exc:
+                raise click.UsageError(f"Invalid search query: {exc}")
+            for hit in hits:
+                page = f"page {hit.page_number}" if hit.page_number else hit.page
+                click.echo(f"{hit.title or hit.document} ({page}, {hit.kind} {hit.line}): {hit.snippet}")
+
+
+def run_notebooks(input, to, out_dir, jobs, **options):
+    from .notebook import export_notebook
+
+    failures = 0
+    for path in input:
+        # Keep each notebook's pages separate if there are several
+        notebook_out_dir = out_dir if len(input) == 1 else out_dir / path.stem
+        result = export_notebook(path, to, notebook_out_dir, jobs, **options)
+        click.echo(f"{path}: {len(result.rendered)} pages rendered, "
+                   f"{len(result.reused)} unchanged, {len(result.removed)} removed", err=True)
+        for page, error in result.errors.items():
+            failures += 1
+            click.echo(f"{page}: FAILED: {error}", err=True)
+    if failures:
+        raise click.ClickException(f"{failures} pages failed to convert")
+
+
 @contextmanager
 def open_output(to, output):
-    to_binary = to in ("pdf", "rm")
+    to_binary = is_binary_format(to)
     if output is None:
         # Write to stdout
         if to_binary:
@@ -81,102 +349,95 @@ def open_output(to, output):
             yield f
 
 
+def parse_bbox(value):
+    """Parse a "x0,y0,x1,y1" bounding box option."""
+    if value is None:
+        return None
+    try:
+        x0, y0, x1, y1 = (float(v) for v in value.split(","))
+    except ValueError:
+        raise click.BadParameter("must be four numbers x0,y0,x1,y1", param_hint="--bbox")
+    if x0 >= x1 or y0 >= y1:
+        raise click.BadParameter("x0 and y0 must be less than x1 and y1", param_hint="--bbox")
+    return (x0, y0, x1, y1)
+
+
 def guess_format(p: Path):
-    # XXX could be neater
     if p.suffix == ".rm":
         return "rm"
-    if p.suffix == ".svg":
-        return "svg"
-    elif p.suffix == ".pdf":
-        return "pdf"
-    elif p.suffix == ".md" or p.suffix == ".markdown":
-        return "markdown"
-    else:
-        return "blocks"
-
-
-from rmscene import scene_items as si
-def tree_structure(item):
-    if isinstance(item, si.Group):
-        return (
-            item.node_id,
-            (
-                item.label.value,
-                item.visible.value,
-                (
-                    item.anchor_id.value if item.anchor_id else None,
-                    item.anchor_type.value if item.anchor_type else None,
-                    item.anchor_threshold.value if item.anchor_threshold else None,
-                    item.anchor_origin_x.value if item.anchor_origin_x else None,
-                )
-            ),
-            [tree_structure(child) for child in item.children.values() if child],
-        )
-    else:
-        return item
-
-
-def convert_rm(filename: Path, to, fout):
-    with open(filename, "rb") as f:
-        if to == "blocks":
-            pprint_blocks(f, fout)
-        elif to == "blocks-data":
-            pprint_blocks(f, fout, data=False)
-        elif to == "tree":
-            # Experimental dumping of tree structure
-            pprint_tree(f, fout, data=True)
-        elif to == "tree-data":
-            # Experimental dumping of tree structure
-            pprint_tree(f, fout, data=False)
-        elif to == "markdown":
-            print_text(f, fout)
-        elif to == "svg":
-            tree = read_tree(f)
-            tree_to_svg(tree, fout)
-        elif to == "pdf":
-            buf = io.StringIO()
-            tree = read_tree(f)
-            tree_to_svg(tree, buf)
-            buf.seek(0)
-            svg_to_pdf(buf, fout)
-        else:
-            raise click.UsageError("Unknown format %s" % to)
-
-
-def pprint_blocks(f, fout, data=True) -> None:
-    import pprint
-    depth = None if data else 1
-    result = read_blocks(f)
-    for el in result:
-        print(file=fout)
-        pprint.pprint(el, depth=depth, stream=fout)
+    fmt = format_for_suffix(p.suffix)
+    return fmt.name if fmt is not None else "blocks"
 
 
-def pprint_tree(f, fout, data=True) -> None:
-    tree = read_tree(f)
+def open_input(filename):
+    """Open the rm file `filename`, a path or an `ArchivePage`, for reading."""
+    if isinstance(filename, (str, os.PathLike)):
+        return open(filename, "rb")
+    return filename.open("rb")
 
-    import pprint
-    import re
 
-    def pprint_Line(self, object, stream, indent, allowance, context, level):
-        min_x = min(p.x for p in object.points)
-        min_y = min(p.y for p in object.points)
-        max_x = max(p.x for p in object.points)
-        max_y = max(p.y for p in object.points)
-        rep = re.sub(r"points=\[.*\]",
-                     f"points=[({min_x: 4.0f},{min_y: 4.0f})-({max_x: 4.0f},{max_y: 4.0f})]",
-                     repr(object))
-        stream.write(rep)
-
-    pprint.PrettyPrinter._dispatch[si.Line.__repr__] = pprint_Line
-
-    depth = None if data else 1
-    pprint.pprint(tree_structure(tree.root), stream=fout)
-    pprint.pprint(tree_structure(tree.root_text), depth=depth, stream=fout)
+def convert_rm(filename: Path, to, fout, cache=None, **options):
+    """Convert the rm file `filename` to format `to`, writing to `fout`.
 
+    `options` are passed on to the format's converter.
+    """
+    if cache is not None:
+        cache.convert(filename, to, fout, **options)
+        return
+
+    try:
+        converter = load_converter(to)
+    except UnknownFormat as exc:
+        raise click.UsageError(str(exc))
+    with open_input(filename) as f:
+        try:
+            converter(f, fout, **options)
+        except ImportError as exc:
+            # An optional dependency of the format is missing
+            raise click.ClickException(str(exc))
+
+
+def read_trees(filenames):
+    """Read the scene tree of each file in turn."""
+    from .exporters.svg import parse_tree
+
+    for filename in filenames:
+        with open_input(filename) as f:
+            yield parse_tree(f)
+
+
+def culled_trees(trees, simplify=None):
+    """Leave out the strokes hidden by erasers from each of `trees` in turn."""
+    from .erase import cull_erased_strokes
+
+    for tree in trees:
+        cull_erased_strokes(tree, simplify)
+        yield tree
+
+
+def convert_rm_pages(filenames, to, fout, simplify=None, bbox=None, precision=None,
+                     cull_erased=False):
+    """Convert `filenames` to a single multi-page SVG or PDF document."""
+    trees = read_trees(filenames)
+    if cull_erased:
+        trees = culled_trees(trees, simplify)
+    if to == "svg":
+        from .exporters.svg import trees_to_svg
+        trees_to_svg(trees, fout, simplify=simplify, bbox=bbox, precision=precision)
+    elif to == "svgz":
+        from .exporters.svg import gzip_output, trees_to_svg
+        with gzip_output(fout) as text:
+            trees_to_svg(trees, text, simplify=simplify, bbox=bbox, precision=precision)
+    elif to == "pdf":
+        from .exporters.pdf import trees_to_pdf
+        trees_to_pdf(trees, fout, simplify, bbox)
+    else:
+        raise click.UsageError("Format %s does not support multiple pages" % to)
 
 
 def convert_text(text, fout):
+    from rmscene import write_blocks, simple_text_document
+
     write_blocks(fout, simple_text_document(text))
 
 
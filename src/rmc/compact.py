@@ -0,0 +1,153 @@
+"""Rewrite rm files without the parts that no longer show.
+
+Every edit on the tablet adds blocks to a page, and deleting a stroke or
+some text only marks it deleted: the CRDT item stays in the file, with no
+value, so that other items can still refer to it as their neighbour.
+Heavily edited pages are mostly such dead items, which every later read
+still has to parse.
+
+`compact_blocks` drops
+
+- deleted scene items, relinking their neighbours so the order of the
+  rest is unchanged;
+- groups that can't be reached from the root of the scene tree, with
+  everything in them;
+- groups inside layers that have nothing left in them;
+- all but the last update of each group's attributes.
+
+The root text is kept as it is. Its characters refer to their neighbours
+by character rather than by item, so deleted text can't be dropped without
+splitting up the items around it.
+
+The scene, text and anchors read from the result are the same as from the
+original. Compacted files are meant for reading and archiving: the items
+that were dropped can no longer be used to merge edits made elsewhere.
+"""
+
+import dataclasses
+import io
+from collections import defaultdict
+from typing import NamedTuple
+
+from rmscene import CrdtId, write_blocks
+from rmscene.crdt_sequence import CrdtSequence, END_MARKER
+from rmscene.scene_stream import (
+    SceneItemBlock,
+    SceneLineItemBlock,
+    SceneTreeBlock,
+    TreeNodeBlock,
+)
+
+from .exporters.crdt import sequence_ids
+from .exporters.points import read_packed_blocks
+
+ROOT_ID = CrdtId(0, 1)
+
+
+class CompactResult(NamedTuple):
+    size_before: int
+    size_after: int
+    # Scene items dropped, including those in dropped groups
+    items_dropped: int
+    groups_dropped: int
+
+
+def compact_rm(f, fout) -> CompactResult:
+    """Write a compacted copy of the rm file `f` to the binary stream `fout`."""
+    data = f.read()
+    blocks = list(read_packed_blocks(io.BytesIO(data)))
+    blocks, stats = compact_blocks(blocks)
+    output = io.BytesIO()
+    write_blocks(output, blocks, options={"line_version": line_version(blocks)})
+    fout.write(output.getvalue())
+    return CompactResult(len(data), len(output.getvalue()), *stats)
+
+
+def line_version(blocks) -> int:
+    """Return the version the points of strokes in `blocks` were read from."""
+    for block in blocks:
+        if isinstance(block, SceneLineItemBlock) and block.item.value is not None:
+            # Version 1 points have floats where version 2 has ints
+            return 1 if block.item.value.points.speed.typecode == "d" else 2
+    return 2
+
+
+def compact_blocks(blocks: list) -> tuple[list, tuple[int, int]]:
+    """Return the blocks to keep, relinked, and the numbers of items and groups dropped."""
+    items_by_parent = defaultdict(list)
+    for block in blocks:
+        if isinstance(block, SceneItemBlock):
+            items_by_parent[block.parent_id].append(block.item)
+
+    # Find the groups that show, from the root down
+    kept_groups = set()
+
+    def visit(group_id, is_layer) -> bool:
+        """Return whether to keep the group, finding the groups to keep in it."""
+        has_content = False
+        for item in items_by_parent.get(group_id, ()):
+            if item.value is None:
+                continue
+            if isinstance(item.value, CrdtId):
+                # A group
+                if item.value not in kept_groups and visit(item.value, group_id == ROOT_ID):
+                    kept_groups.add(item.value)
+                    has_content = True
+            else:
+                has_content = True
+        return has_content or is_layer
+
+    visit(ROOT_ID, True)
+    kept_groups.add(ROOT_ID)
+
+    def keep_item(item) -> bool:
+        if item.value is None:
+            return False
+        return not isinstance(item.value, CrdtId) or item.value in kept_groups
+
+    links = {}
+    for parent_id, items in items_by_parent.items():
+        if parent_id in kept_groups:
+            links.update(relink(items, keep_item))
+
+    last_node_block = {}
+    for block in blocks:
+        if isinstance(block, TreeNodeBlock):
+            last_node_block[block.group.node_id] = block
+
+    result = []
+    seen_trees = set()
+    items_dropped = 0
+    for block in blocks:
+        if isinstance(block, SceneTreeBlock):
+            if block.tree_id not in kept_groups or block.tree_id in seen_trees:
+                continue
+            seen_trees.add(block.tree_id)
+        elif isinstance(block, TreeNodeBlock):
+            if (block.group.node_id not in kept_groups
+                    or last_node_block[block.group.node_id] is not block):
+                continue
+        elif isinstance(block, SceneItemBlock):
+            if block.item.item_id not in links or block.parent_id not in kept_groups:
+                items_dropped += 1
+                continue
+            left_id, right_id = links[block.item.item_id]
+            block = dataclasses.replace(
+                block, item=dataclasses.replace(block.item, left_id=left_id, right_id=right_id))
+        result.append(block)
+
+    groups = {block.tree_id for block in blocks if isinstance(block, SceneTreeBlock)}
+    return result, (items_dropped, len(groups - kept_groups))
+
+
+def relink(items, keep) -> dict:
+    """Return `{item_id: (left_id, right_id)}` for the items of a sequence to keep.
+
+    Each item kept is linked to its nearest kept neighbours, so the kept
+    items stay in the same order.
+    """
+    sequence = CrdtSequence(items)
+    kept = [item_id for item_id in sequence_ids(sequence) if keep(sequence._items[item_id])]
+    lefts = [END_MARKER] + kept[:-1]
+    rights = kept[1:] + [END_MARKER]
+    return {item_id: (left, right) for item_id, left, right in zip(kept, lefts, rights)}
@@ -0,0 +1,559 @@
+"""Leave out the ink that erasers hide, before drawing a page.
+
+The eraser doesn't remove anything from a page. It adds a stroke, which
+the exporters draw in white over everything drawn before it, so a page
+with a lot of erasing is mostly drawn twice: once in ink and once in white
+on top. `cull_erased_strokes` works out which strokes, or ends of strokes,
+lie entirely under later eraser strokes and leaves them out. Eraser
+strokes with no ink left under them are then left out too, as are erase
+area strokes, which are drawn with no opacity at all.
+
+The shapes compared are those the exporters draw, in screen units:
+
+- a polyline covers every point within half its width of one of its
+  lines, and at its ends and corners its caps and joins reach out a
+  little further (by up to the miter limit at sharp corners);
+- an eraser is only relied on to cover the inside of the band along each
+  of its lines, narrowed where it turns sharply, so that the test holds
+  for SVG's miter and bevel joins as well as round ones.
+
+Ink is only left out if it is covered with a pixel to spare, to allow for
+antialiasing, and more if strokes are simplified. Strokes whose style depends on the
+points before (most pens, whose width changes with pressure and speed)
+are only clipped at the end, so the rest is drawn as before; strokes of
+a constant style are clipped at either end. Erased gaps in the middle of
+a stroke are still drawn, and covered by their eraser.
+"""
+
+import dataclasses
+import logging
+import math
+from collections import defaultdict
+from typing import NamedTuple
+
+from rmscene import CrdtSequence, SceneTree
+from rmscene import scene_items as si
+
+from . import metrics
+from .exporters.points import packed_points
+from .exporters.svg import (
+    LINE_HEIGHTS,
+    SCALE,
+    STROKE_WIDTH_DIVISOR,
+    initial_anchor_pos,
+    stroke_segments,
+    text_lines,
+)
+from .exporters.writing_tools import Pen, np
+from .spatial import MITER_LIMIT, StrokeIndex, iter_strokes
+
+_logger = logging.getLogger(__name__)
+
+# Without NumPy, the lines of an eraser are looked up in grids with cells
+# of these sizes (in screen units) to find those near a point of ink
+COVER_CELL_SIZE = 8
+REACH_CELL_SIZE = 32
+
+# With NumPy, points of ink are compared with the lines of an eraser in
+# chunks of about this many pairs
+ARRAY_CHUNK_SIZE = 1 << 18
+
+
+class CullResult(NamedTuple):
+    strokes_dropped: int
+    strokes_clipped: int
+    # Eraser and erase area strokes
+    erasers_dropped: int
+
+
+class Outline(NamedTuple):
+    """The points of a stroke in screen coordinates, and how far its ink reaches."""
+    xs: list
+    ys: list
+    # How far the ink drawn around each point reaches from it, whether the
+    # point is a corner or, once clipped, an end
+    reach: list
+    # `(half_width, indices)` of each style segment
+    polylines: list
+    # From `turn_cosines`
+    turns: list
+
+
+def cull_erased_strokes(tree: SceneTree, simplify=None, pixel_size=1.0) -> CullResult:
+    """Leave out the strokes of `tree`, or their ends, that erasers hide.
+
+    Strokes that are left out are marked deleted in their groups, and
+    clipped strokes are replaced by copies with fewer points. Ink must be inside
+    an eraser's stroke by the size of a pixel of the output, `pixel_size`
+    in screen units, plus the `simplify` tolerance the page is drawn with.
+    """
+    with metrics.phase("cull"):
+        return _cull(tree, pixel_size + (simplify or 0))
+
+
+def _cull(tree: SceneTree, margin) -> CullResult:
+    entries = list(iter_strokes(tree))
+    erasers = [entry for entry in entries if entry.line.tool == si.Pen.ERASER]
+    ink = []
+    if erasers:
+        # The outlines give closer bounding boxes than the index's, which
+        # allow for the widest part of each stroke all along it
+        ink = [entry for entry in entries if entry.line.tool not in (si.Pen.ERASER, si.Pen.ERASER_AREA)]
+        outlines = {entry.order: stroke_outline(entry.line, entry.offset) for entry in ink + erasers}
+        ink = [entry._replace(bbox=outline_bbox(outlines[entry.order])) for entry in ink]
+        erasers = [entry._replace(bbox=outline_bbox(outlines[entry.order])) for entry in erasers]
+    index = StrokeIndex(ink)
+
+    # Which of the lines between consecutive points of each ink stroke are
+    # covered (or, for a dot, whether its point is)
+    covered = {}
+    for eraser in erasers:
+        cover = EraserCover(outlines[eraser.order])
+        if not cover.lines:
+            continue
+        for entry in index.query(eraser.bbox):
+            if entry.order > eraser.order:
+                break
+            outline = outlines[entry.order]
+            flags = covered.setdefault(entry.order, [False] * max(len(outline.xs) - 1, 1))
+            cover.mark(outline, flags, margin)
+
+    # The new line at the path of each stroke to change, or None to delete it
+    replacements = {}
+    strokes_dropped = strokes_clipped = 0
+    remaining = []
+    for entry in ink:
+        flags = covered.get(entry.order)
+        if flags is None or not any(flags):
+            remaining.append(entry)
+            continue
+        span = kept_span(flags, has_constant_style(entry.line))
+        if span is None:
+            replacements[entry.path] = None
+            strokes_dropped += 1
+            continue
+        start, stop = span
+        if (start, stop) != (0, len(entry.line.points)):
+            line = dataclasses.replace(entry.line, points=packed_points(entry.line.points)[start:stop])
+            replacements[entry.path] = line
+            outlines[entry.order] = stroke_outline(line, entry.offset)
+            strokes_clipped += 1
+        remaining.append(entry)
+
+    # An eraser can go if nothing drawn before it still shows near it
+    erasers_dropped = 0
+    remaining_index = StrokeIndex(remaining)
+    text_range = text_extent(tree)
+    for eraser in erasers:
+        if text_range is not None and eraser.bbox[1] <= text_range[1] and text_range[0] <= eraser.bbox[3]:
+            continue
+        reach = EraserReach(outlines[eraser.order])
+        x0, y0, x1, y1 = eraser.bbox
+        earlier = (entry for entry in remaining_index.query((x0 - margin, y0 - margin,
+                                                             x1 + margin, y1 + margin))
+                   if entry.order < eraser.order)
+        if not any(reach.meets(outlines[entry.order], margin) for entry in earlier):
+            replacements[eraser.path] = None
+            erasers_dropped += 1
+
+    # Erase area strokes draw nothing
+    for entry in entries:
+        if entry.line.tool == si.Pen.ERASER_AREA:
+            replacements[entry.path] = None
+            erasers_dropped += 1
+
+    replace_strokes(tree, replacements)
+    result = CullResult(strokes_dropped, strokes_clipped, erasers_dropped)
+    _logger.debug("Culled erased strokes: %s", result)
+    return result
+
+
+def outline_bbox(outline: Outline) -> tuple:
+    """Return the bounding box of the ink of `outline`."""
+    r = max(outline.reach)
+    return min(outline.xs) - r, min(outline.ys) - r, max(outline.xs) + r, max(outline.ys) + r
+
+
+def kept_span(flags: list, constant_style: bool):
+    """Return `(start, stop)`, the slice of the points to keep, or None for none.
+
+    `flags` say which lines between the points are covered. Covered lines
+    at the end are clipped off, and at the start too if `constant_style`.
+    """
+    uncovered = [i for i, flag in enumerate(flags) if not flag]
+    if not uncovered:
+        return None
+    start = uncovered[0] if constant_style else 0
+    return start, uncovered[-1] + 2
+
+
+def has_constant_style(line: si.Line) -> bool:
+    """Return whether the pen of `line` draws every point in the same style."""
+    pen = type(Pen.create(line.tool.value, line.color.value, line.thickness_scale / 10))
+    return all(getattr(pen, name) is getattr(Pen, name) for name in
+               ("get_segment_width", "get_segment_color", "get_segment_opacity"))
+
+
+def replace_strokes(tree: SceneTree, replacements: dict):
+    """Replace the strokes of `tree` at the paths in `replacements`.
+
+    Each stroke is replaced by the line its path maps to, or deleted if
+    that is None. The children of each group with a stroke to replace
+    are rebuilt once, as `CrdtSequence` has no way to replace an item.
+    """
+    by_group = defaultdict(dict)
+    for path, line in replacements.items():
+        by_group[path[:-1]][path[-1]] = line
+    for group_path, lines in by_group.items():
+        group = tree.root
+        for group_id in group_path:
+            group = group.children[group_id]
+        items = []
+        for item in group.children.sequence_items():
+            if item.item_id in lines:
+                line = lines[item.item_id]
+                if line is None:
+                    item = dataclasses.replace(item, value=None, deleted_length=1)
+                else:
+                    item = dataclasses.replace(item, value=line)
+            items.append(item)
+        group.children = CrdtSequence(items)
+    StrokeIndex.forget(tree)
+
+
+def text_extent(tree: SceneTree):
+    """Return the range of y-coordinates the root text could be drawn in, or None."""
+    if tree.root_text is None:
+        return None
+    ys = [ypos for _, _, _, _, ypos in text_lines(tree.root_text, initial_anchor_pos())]
+    # Lines are drawn above their y-coordinate, and may run onto the next
+    height = max(abs(h) for h in LINE_HEIGHTS.values())
+    return min(ys) - height, max(ys) + height
+
+
+def stroke_outline(line: si.Line, offset) -> Outline:
+    """Return the outline of `line` as drawn, moved by `offset`."""
+    points = packed_points(line.points)
+    dx, dy = offset
+    xs = [x + dx for x in points.x]
+    ys = [y + dy for y in points.y]
+    pen = Pen.create(line.tool.value, line.color.value, line.thickness_scale / 10)
+    cap = math.sqrt(2) if pen.stroke_linecap == "square" else 1
+    half_widths = [0.0] * len(xs)
+    polylines = []
+    for segment in stroke_segments(line, pen):
+        # Pen widths are in points, and some pens make negative ones
+        half_width = abs(segment.width) / STROKE_WIDTH_DIVISOR / SCALE / 2
+        polylines.append((half_width, segment.indices))
+        for i in segment.indices:
+            half_widths[i] = max(half_widths[i], half_width)
+    if np is not None:
+        turns = turn_cosines_array(np.array(xs), np.array(ys))
+        miter = np.where(np.isnan(turns), MITER_LIMIT,
+                         np.where(turns * MITER_LIMIT >= 1, 1 / turns, 1))
+        reach = (np.array(half_widths) * np.maximum(miter, cap)).tolist()
+        turns = turns.tolist()
+    else:
+        turns = turn_cosines(xs, ys)
+        reach = [
+            half_width * max(cap, miter_factor(turn))
+            for half_width, turn in zip(half_widths, turns)
+        ]
+    return Outline(xs, ys, reach, polylines, turns)
+
+
+def miter_factor(turn) -> float:
+    """Return how far a join reaches, relative to half the width.
+
+    `turn` is from `turn_cosines`.
+    """
+    if math.isnan(turn):
+        return MITER_LIMIT
+    return 1 / turn if turn * MITER_LIMIT >= 1 else 1
+
+
+def turn_cosines(xs, ys) -> list:
+    """Return the cosine of half the angle the line turns through at each point.
+
+    This is 1 at the ends, and NaN where either line meeting at a point has
+    no length.
+    """
+    turns = [1.0] * len(xs)
+    for i in range(1, len(xs) - 1):
+        ux, uy = xs[i] - xs[i - 1], ys[i] - ys[i - 1]
+        vx, vy = xs[i + 1] - xs[i], ys[i + 1] - ys[i]
+        lengths = math.hypot(ux, uy) * math.hypot(vx, vy)
+        if lengths == 0:
+            turns[i] = math.nan
+        else:
+            cos = max(-1.0, min(1.0, (ux * vx + uy * vy) / lengths))
+            turns[i] = math.sqrt((1 + cos) / 2)
+    return turns
+
+
+def turn_cosines_array(x, y):
+    """Return `turn_cosines` for arrays of coordinates, as an array."""
+    turns = np.ones(len(x))
+    ux, uy = np.diff(x), np.diff(y)
+    lengths = np.hypot(ux, uy)
+    product = lengths[:-1] * lengths[1:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cos = np.clip((ux[:-1] * ux[1:] + uy[:-1] * uy[1:]) / product, -1, 1)
+    turns[1:-1] = np.where(product > 0, np.sqrt((1 + cos) / 2), np.nan)
+    return turns
+
+
+class EraserLine(NamedTuple):
+    """A line of an eraser stroke, and the regions it is sure to cover.
+
+    These are the band of `half_width` either side of the line, between
+    its ends, and the points within `radius` of the line. Square caps are
+    left out, as the PNG exporter draws round ones instead.
+    """
+    ax: float
+    ay: float
+    bx: float
+    by: float
+    # Unit vector along the line
+    ux: float
+    uy: float
+    length: float
+    half_width: float
+    radius: float
+
+
+def eraser_lines(outline: Outline) -> list[EraserLine]:
+    """Return the lines of an eraser stroke with the regions they cover."""
+    xs, ys, turns = outline.xs, outline.ys, outline.turns
+    lines = []
+    for half_width, indices in outline.polylines:
+        indices = list(indices)
+        ends = (indices[0], indices[-1])
+
+        def inner(i):
+            # The disc around a point that the joins are sure to cover: a
+            # bevel cuts the corner at this distance
+            if i in ends:
+                return half_width
+            return 0 if math.isnan(turns[i]) else half_width * turns[i]
+
+        for a, b in zip(indices, indices[1:]):
+            length = math.hypot(xs[b] - xs[a], ys[b] - ys[a])
+            if length > 0:
+                lines.append(EraserLine(
+                    xs[a], ys[a], xs[b], ys[b], (xs[b] - xs[a]) / length,
+                    (ys[b] - ys[a]) / length, length, half_width, min(inner(a), inner(b))))
+    return lines
+
+
+class EraserCover:
+    """The parts of the page an eraser stroke is sure to paint over.
+
+    Lines of ink are tested against all the eraser's lines at once with
+    NumPy if it is installed, and otherwise looked up in a grid.
+    """
+
+    def __init__(self, outline: Outline):
+        self.lines = eraser_lines(outline)
+        if np is not None:
+            self.columns = np.array(self.lines, dtype=float).T.reshape(len(EraserLine._fields), -1)
+        else:
+            self.cells = defaultdict(list)
+            for k, line in enumerate(self.lines):
+                r = line.half_width
+                for cell in grid_cells((min(line.ax, line.bx) - r, min(line.ay, line.by) - r,
+                                        max(line.ax, line.bx) + r, max(line.ay, line.by) + r),
+                                       COVER_CELL_SIZE):
+                    self.cells[cell].append(k)
+
+    def mark(self, outline: Outline, flags: list, margin):
+        """Set the `flags` of the lines of `outline` (or its only point) this covers.
+
+        A line of ink is covered if the discs its ink reaches around both
+        its ends are in the same region of one of the eraser's lines.
+        Regions are numbered by the bits of `line_mask`.
+        """
+        if np is not None:
+            self._mark_array(outline, flags, margin)
+            return
+        xs, ys, reach = outline.xs, outline.ys, outline.reach
+        if len(xs) == 1:
+            flags[0] = flags[0] or any(
+                line_mask(self.lines[k], xs[0], ys[0], reach[0] + margin)
+                for k in self.cells.get(grid_cell(xs[0], ys[0], COVER_CELL_SIZE), ()))
+            return
+        # Neighbouring lines of a stroke are usually covered by the same
+        # line of the eraser, so that is tried first
+        last = None
+        for i in range(len(xs) - 1):
+            if flags[i]:
+                continue
+            x0, y0, r0 = xs[i], ys[i], reach[i] + margin
+            x1, y1, r1 = xs[i + 1], ys[i + 1], reach[i + 1] + margin
+            if last is not None and line_mask(last, x0, y0, r0) & line_mask(last, x1, y1, r1):
+                flags[i] = True
+                continue
+            for k in self.cells.get(grid_cell(x0, y0, COVER_CELL_SIZE), ()):
+                line = self.lines[k]
+                mask = line_mask(line, x0, y0, r0)
+                if mask and mask & line_mask(line, x1, y1, r1):
+                    flags[i] = True
+                    last = line
+                    break
+
+    def _mark_array(self, outline: Outline, flags: list, margin):
+        x, y = np.asarray(outline.xs), np.asarray(outline.ys)
+        r = np.asarray(outline.reach) + margin
+        columns = near_columns(self.columns, x, y, self.columns[7])
+        if columns.shape[1] == 0:
+            return
+        # Lines of the stroke in chunks, each with the point after it
+        step = max(1, ARRAY_CHUNK_SIZE // columns.shape[1])
+        for start in range(0, max(len(x) - 1, 1), step):
+            chunk = slice(start, start + step + 1)
+            mask = line_masks(columns, x[chunk, None], y[chunk, None], r[chunk, None])
+            if len(x) == 1:
+                covered = mask.any(axis=1)
+            else:
+                covered = ((mask[:-1] & mask[1:]) != 0).any(axis=1)
+            for i in np.flatnonzero(covered).tolist():
+                flags[start + i] = True
+
+
+def line_mask(line: EraserLine, x, y, r) -> int:
+    """Return which regions of `line` contain the disc of radius `r` at `(x, y)`.
+
+    Bit 1 is set if the disc is inside the line's band, and bit 2 if it is
+    within the line's radius. Both regions are convex, so a line of ink is
+    inside one if both its ends are.
+    """
+    rx, ry = x - line.ax, y - line.ay
+    along = rx * line.ux + ry * line.uy
+    across = abs(rx * line.uy - ry * line.ux)
+    mask = 0
+    if r <= along <= line.length - r and across <= line.half_width - r:
+        mask = 1
+    t = min(max(along, 0), line.length)
+    if math.hypot(along - t, across) <= line.radius - r:
+        mask |= 2
+    return mask
+
+
+def line_masks(columns, x, y, r):
+    """Return `line_mask` for the points in column arrays against lines in `columns`."""
+    ax, ay, _, _, ux, uy, length, half_width, radius = columns
+    rx, ry = x - ax, y - ay
+    along = rx * ux + ry * uy
+    across = np.abs(rx * uy - ry * ux)
+    band = (along >= r) & (along <= length - r) & (across <= half_width - r)
+    t = np.clip(along, 0, length)
+    disc = np.hypot(along - t, across) <= radius - r
+    return band.astype(np.int8) | (disc.astype(np.int8) << 1)
+
+
+class EraserReach:
+    """Everywhere an eraser stroke might paint, as capsules around its lines."""
+
+    def __init__(self, outline: Outline):
+        self.capsules = list(outline_capsules(outline))
+        if np is not None:
+            self.columns = np.array(self.capsules, dtype=float).T.reshape(5, -1)
+        else:
+            self.cells = defaultdict(list)
+            for k, (ax, ay, bx, by, r) in enumerate(self.capsules):
+                for cell in grid_cells((min(ax, bx) - r, min(ay, by) - r,
+                                        max(ax, bx) + r, max(ay, by) + r), REACH_CELL_SIZE):
+                    self.cells[cell].append(k)
+
+    def meets(self, outline: Outline, margin) -> bool:
+        """Return whether the ink of `outline` might come within `margin` of the eraser's.
+
+        The ink is taken as a disc around each point, big enough to hold
+        the line to the next point.
+        """
+        discs = outline_discs(outline)
+        if np is not None:
+            return self._meets_array(discs, margin)
+        for x, y, r in zip(*discs):
+            box = (x - r - margin, y - r - margin, x + r + margin, y + r + margin)
+            seen = set()
+            for cell in grid_cells(box, REACH_CELL_SIZE):
+                for k in self.cells.get(cell, ()):
+                    if k in seen:
+                        continue
+                    seen.add(k)
+                    ax, ay, bx, by, s = self.capsules[k]
+                    if point_distance(x, y, ax, ay, bx, by) < r + s + margin:
+                        return True
+        return False
+
+    def _meets_array(self, discs, margin) -> bool:
+        x, y, r = (np.asarray(column) for column in discs)
+        columns = near_columns(self.columns, x, y, self.columns[4] + r.max() + margin)
+        if columns.shape[1] == 0:
+            return False
+        ax, ay, bx, by, s = columns
+        step = max(1, ARRAY_CHUNK_SIZE // columns.shape[1])
+        for start in range(0, len(x), step):
+            chunk = slice(start, start + step)
+            distance = point_distances(x[chunk, None], y[chunk, None], ax, ay, bx, by)
+            if (distance < r[chunk, None] + s + margin).any():
+                return True
+        return False
+
+
+def near_columns(columns, x, y, reach):
+    """Return the `columns` of the lines within `reach` of the bounding box of `x` and `y`."""
+    ax, ay, bx, by = columns[:4]
+    near = ((np.minimum(ax, bx) - reach <= x.max()) & (np.maximum(ax, bx) + reach >= x.min())
+            & (np.minimum(ay, by) - reach <= y.max()) & (np.maximum(ay, by) + reach >= y.min()))
+    return columns[:, near]
+
+
+def outline_capsules(outline: Outline):
+    """Yield `(ax, ay, bx, by, radius)` for capsules containing all the ink of `outline`."""
+    xs, ys, reach = outline.xs, outline.ys, outline.reach
+    if len(xs) == 1:
+        yield xs[0], ys[0], xs[0], ys[0], reach[0]
+    for i in range(len(xs) - 1):
+        yield xs[i], ys[i], xs[i + 1], ys[i + 1], max(reach[i], reach[i + 1])
+
+
+def outline_discs(outline: Outline) -> tuple[list, list, list]:
+    """Return the centres and radii of discs containing all the ink of `outline`."""
+    xs, ys, reach = outline.xs, outline.ys, outline.reach
+    if len(xs) == 1:
+        return xs, ys, reach
+    radii = [
+        max(reach[i], reach[i + 1]) + math.hypot(xs[i + 1] - xs[i], ys[i + 1] - ys[i])
+        for i in range(len(xs) - 1)
+    ]
+    return xs[:-1], ys[:-1], radii
+
+
+def point_distance(px, py, ax, ay, bx, by) -> float:
+    """Return the distance from point P to the line segment AB."""
+    vx, vy = bx - ax, by - ay
+    length2 = vx * vx + vy * vy
+    t = 0 if length2 == 0 else min(max(((px - ax) * vx + (py - ay) * vy) / length2, 0), 1)
+    return math.hypot(px - ax - t * vx, py - ay - t * vy)
+
+
+def point_distances(px, py, ax, ay, bx, by):
+    """Return `point_distance` for arrays of points and segments."""
+    vx, vy = bx - ax, by - ay
+    length2 = vx * vx + vy * vy
+    t = np.clip(((px - ax) * vx + (py - ay) * vy) / np.where(length2 > 0, length2, 1), 0, 1)
+    return np.hypot(px - ax - t * vx, py - ay - t * vy)
+
+
+def grid_cell(x, y, size) -> tuple:
+    return math.floor(x / size), math.floor(y / size)
+
+
+def grid_cells(bbox, size):
+    x0, y0 = grid_cell(bbox[0], bbox[1], size)
+    x1, y1 = grid_cell(bbox[2], bbox[3], size)
+    for cy in range(y0, y1 + 1):
+        for cx in range(x0, x1 + 1):
+            yield cx, cy
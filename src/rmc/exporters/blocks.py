@@ -0,0 +1,215 @@
+"""Dump the internal structure of rm files, for debugging.
+
+The `blocks` and `tree` formats pretty-print rmscene's objects. The
+`blocks-json` and `tree-json` formats write newline-delimited JSON instead,
+one object per line, for tools such as `jq`:
+
+- `blocks-json` has an object for each block, written as soon as it is
+  read, with `"block"` giving its type;
+- `tree-json` has an object for each item of the scene tree in drawing
+  order (and one for the root text first, if there is any), with its
+  `"type"`, `"id"`, the `"parent"` group's id, its `"depth"` and its
+  `"value"`.
+
+CRDT ids are written as `"part1:part2"` and enums by name. The points of
+strokes are lists of `[x, y, speed, direction, width, pressure]`, or with
+`summarize_points`, `{"count": n, "bbox": [min_x, min_y, max_x, max_y]}`.
+"""
+
+import dataclasses
+import enum
+import json
+import pprint
+import re
+from typing import NamedTuple, Optional
+
+from rmscene import CrdtId, SceneTree, read_blocks
+from rmscene import scene_items as si
+from rmscene.crdt_sequence import CrdtSequence
+from rmscene.scene_stream import SceneLineItemBlock, build_tree
+
+from .crdt import sequence_ids
+from .points import packed_points, read_packed_blocks, read_packed_tree
+
+
+def convert_blocks(f, fout, **options):
+    pprint_blocks(f, fout)
+
+
+def convert_blocks_data(f, fout, **options):
+    pprint_blocks(f, fout, data=False)
+
+
+def convert_tree(f, fout, **options):
+    # Experimental dumping of tree structure
+    pprint_tree(f, fout, data=True)
+
+
+def convert_tree_data(f, fout, **options):
+    # Experimental dumping of tree structure
+    pprint_tree(f, fout, data=False)
+
+
+def convert_blocks_json(f, fout, summarize_points=False, **options):
+    for block in read_packed_blocks(f):
+        record = {"block": type(block).__name__}
+        record.update(to_json(block, summarize_points))
+        write_json_line(record, fout)
+
+
+def convert_tree_json(f, fout, summarize_points=False, **options):
+    blocks = read_packed_blocks(f)
+    if summarize_points:
+        # Only the summaries are kept in the tree, not the points
+        blocks = map(summarize_line_block, blocks)
+    tree = SceneTree()
+    build_tree(tree, blocks)
+    if tree.root_text is not None:
+        write_json_line({"type": "Text", "id": None, "parent": None, "depth": 0,
+                         "value": to_json(tree.root_text)}, fout)
+    for record in tree_records(tree.root):
+        write_json_line(record, fout)
+
+
+def write_json_line(record: dict, fout):
+    fout.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+class PointSummary(NamedTuple):
+    count: int
+    # (min_x, min_y, max_x, max_y), or None if there are no points
+    bbox: Optional[tuple]
+
+    @classmethod
+    def of(cls, points) -> "PointSummary":
+        points = packed_points(points)
+        return cls(len(points), points.bbox())
+
+
+def summarize_line_block(block):
+    """Replace the points of a stroke's `block` with a `PointSummary`."""
+    if isinstance(block, SceneLineItemBlock) and block.item.value is not None:
+        line = block.item.value
+        line.points = PointSummary.of(line.points)
+    return block
+
+
+def tree_records(group: si.Group, parent_id=None, depth=0):
+    """Yield the `tree-json` objects for `group` and everything in it."""
+    group_id = to_json(group.node_id)
+    value = to_json(group)
+    del value["children"]
+    yield {"type": "Group", "id": group_id, "parent": parent_id, "depth": depth, "value": value}
+    for child_id in sequence_ids(group.children):
+        child = group.children[child_id]
+        if isinstance(child, si.Group):
+            yield from tree_records(child, group_id, depth + 1)
+        elif child is not None:
+            yield {"type": type(child).__name__, "id": to_json(child_id), "parent": group_id,
+                   "depth": depth + 1, "value": to_json(child)}
+
+
+def to_json(value, summarize_points=False):
+    """Return `value`, read from an rm file, as something `json` can write."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, CrdtId):
+        return f"{value.part1}:{value.part2}"
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, si.Line):
+        return line_json(value, summarize_points)
+    if isinstance(value, CrdtSequence):
+        items = {item.item_id: item for item in value.sequence_items()}
+        return [to_json(items[item_id], summarize_points) for item_id in sequence_ids(value)]
+    if dataclasses.is_dataclass(value):
+        return {field.name: to_json(getattr(value, field.name), summarize_points)
+                for field in dataclasses.fields(value)}
+    if isinstance(value, dict):
+        return {str(to_json(k)): to_json(v, summarize_points) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(v, summarize_points) for v in value]
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+def line_json(line: si.Line, summarize_points=False) -> dict:
+    if isinstance(line.points, PointSummary):
+        points = line.points._asdict()
+    elif summarize_points:
+        points = PointSummary.of(line.points)._asdict()
+    else:
+        points = list(map(list, zip(*packed_points(line.points).columns())))
+    return {
+        "color": line.color.name,
+        "tool": line.tool.name,
+        "thickness_scale": line.thickness_scale,
+        "starting_length": line.starting_length,
+        "points": points,
+    }
+
+
+def tree_structure(item):
+    if isinstance(item, si.Group):
+        return (
+            item.node_id,
+            (
+                item.label.value,
+                item.visible.value,
+                (
+                    item.anchor_id.value if item.anchor_id else None,
+                    item.anchor_type.value if item.anchor_type else None,
+                    item.anchor_threshold.value if item.anchor_threshold else None,
+                    item.anchor_origin_x.value if item.anchor_origin_x else None,
+                )
+            ),
+            [tree_structure(child) for child in map(item.children.__getitem__,
+                                                    sequence_ids(item.children)) if child],
+        )
+    else:
+        return item
+
+
+def pprint_blocks(f, fout, data=True) -> None:
+    depth = None if data else 1
+    result = read_blocks(f)
+    for el in result:
+        print(file=fout)
+        pprint.pprint(el, depth=depth, stream=fout)
+
+
+class TreePrinter(pprint.PrettyPrinter):
+    """Pretty-prints scene trees, with the bounding box of each stroke's points."""
+
+    _dispatch = dict(pprint.PrettyPrinter._dispatch)
+
+    def format(self, object, context, maxlevels, level):
+        # The repr of the whole tree is tried first, to see if it fits on a
+        # line, so the points must be left out here too
+        if isinstance(object, si.Line):
+            return line_repr(object), True, False
+        return super().format(object, context, maxlevels, level)
+
+    def _pprint_line(self, object, stream, indent, allowance, context, level):
+        stream.write(line_repr(object))
+
+    _dispatch[si.Line.__repr__] = _pprint_line
+
+
+def line_repr(line: si.Line) -> str:
+    """Return the repr of `line`, with the bounding box of its points."""
+    bbox = packed_points(line.points).bbox()
+    if bbox is None:
+        return repr(line)
+    min_x, min_y, max_x, max_y = bbox
+    return re.sub(r"points=\[.*\]",
+                  f"points=[({min_x: 4.0f},{min_y: 4.0f})-({max_x: 4.0f},{max_y: 4.0f})]",
+                  repr(dataclasses.replace(line, points=[])))
+
+
+def pprint_tree(f, fout, data=True) -> None:
+    tree = read_packed_tree(f)
+    depth = None if data else 1
+    TreePrinter(stream=fout).pprint(tree_structure(tree.root))
+    TreePrinter(stream=fout, depth=depth).pprint(tree_structure(tree.root_text))
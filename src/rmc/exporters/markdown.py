@@ -1,14 +1,87 @@
-"""Export text content of rm files as Markdown."""
+"""Export text content of rm files as Markdown.
 
-from rmscene import read_tree
+Only the text, the groups' anchors and the highlights are needed, so the
+file is read without decoding the points of the strokes.
+"""
+
+import io
+
+from rmscene import SceneTree
 from rmscene import scene_items as si
+from rmscene.crdt_sequence import CrdtSequenceItem
+from rmscene.scene_stream import Block, SceneLineItemBlock, build_tree
+from rmscene.tagged_block_reader import TaggedBlockReader
 
 import logging
 
+from .crdt import formatted_lines_with_ids, sequence_ids
+from .. import metrics
+
+
+
+def convert_markdown(f, fout, **options):
+    print_text(f, fout)
+
+
+def read_text_tree(f) -> SceneTree:
+    """Read the scene tree from `f`, leaving out the strokes.
+
+    Strokes are added to the tree with no value, keeping their place in
+    the order of their groups' children.
+    """
+    tree = SceneTree()
+    build_tree(tree, read_text_blocks(f))
+    return tree
+
+
+def read_text_blocks(f):
+    """Yield the blocks of `f`, with only the position of the strokes."""
+    stream = TaggedBlockReader(f)
+    stream.read_header()
+    while True:
+        with stream.read_block() as block_info:
+            if block_info is None:
+                return
+            if block_info.block_type == SceneLineItemBlock.BLOCK_TYPE:
+                yield read_item_position(stream, SceneLineItemBlock)
+                skip(f, stream.bytes_remaining_in_block())
+                continue
+            block_type = Block.lookup(block_info.block_type)
+            if block_type:
+                yield block_type.from_stream(stream)
+            else:
+                skip(f, block_info.size)
+
+
+def read_item_position(stream: TaggedBlockReader, block_type):
+    """Read the parent and neighbours of a scene item, but not its value."""
+    parent_id = stream.read_id(1)
+    item_id = stream.read_id(2)
+    left_id = stream.read_id(3)
+    right_id = stream.read_id(4)
+    deleted_length = stream.read_int(5)
+    return block_type(parent_id, CrdtSequenceItem(item_id, left_id, right_id, deleted_length, None))
+
+
+def skip(f, size):
+    if f.seekable():
+        f.seek(size, io.SEEK_CUR)
+    else:
+        f.read(size)
+
+
+def walk_items(item):
+    """Yield the leaf items in `item`, in order, like `SceneTree.walk`."""
+    if isinstance(item, si.Group):
+        for child_id in sequence_ids(item.children):
+            yield from walk_items(item.children[child_id])
+    else:
+        yield item
 
 
 def print_text(f, fout):
-    tree = read_tree(f)
+    with metrics.phase("parse"):
+        tree = read_text_tree(f)
 
     # Find out what anchor characters are used
     anchor_ids = set(collect_anchor_ids(tree.root))
@@ -19,7 +92,7 @@ def print_text(f, fout):
     JOIN_TOLERANCE = 2
     print("\n\n# Highlights", file=fout)
     last_pos = 0
-    for item in tree.walk():
+    for item in walk_items(tree.root):
         if isinstance(item, si.GlyphRange):
             if item.start > last_pos + JOIN_TOLERANCE:
                 print(file=fout)
@@ -29,7 +102,7 @@ def print_text(f, fout):
 
 
 def print_root_text(root_text, fout, anchor_ids):
-    for fmt, line, ids in root_text.formatted_lines_with_ids():
+    for fmt, line, ids in formatted_lines_with_ids(root_text):
         annotated_line = annotate_anchor_ids(anchor_ids, line, ids)
         if fmt == si.TextFormat.BULLET:
             fout.write("- " + annotated_line)
@@ -47,17 +120,17 @@ def print_root_text(root_text, fout, anchor_ids):
 
 def annotate_anchor_ids(anchor_ids, line, ids):
     """Annotate appearances of `anchor_ids` in `line`."""
-    result = ""
+    parts = []
     for char, char_id in zip(line, ids):
         if char_id in anchor_ids:
-            result += f"<<{char_id.part1},{char_id.part2}>>"
-        result += char
-    return result
+            parts.append(f"<<{char_id.part1},{char_id.part2}>>")
+        parts.append(char)
+    return "".join(parts)
 
 
 def collect_anchor_ids(item):
     if isinstance(item, si.Group):
         if item.anchor_id is not None:
             yield item.anchor_id.value
-        for child in item.children.values():
-            yield from collect_anchor_ids(child)
+        for child in item.children.sequence_items():
+            yield from collect_anchor_ids(child.value)
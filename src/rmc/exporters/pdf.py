@@ -1,34 +1,522 @@
 """Convert blocks to pdf file.
 
+The PDF is written directly from the scene tree by `tree_to_pdf`. Converting
+through SVG with Inkscape (`svg_to_pdf`) is still available as a fallback.
+
 Code originally from https://github.com/lschwetlick/maxio through
 https://github.com/chemag/maxio .
 """
 
+import atexit
+import io
+import itertools
 import logging
-from tempfile import NamedTemporaryFile
+import os
+import queue
+import re
+import select as select_module
+import subprocess
+import time
+import zlib
+from typing import Iterable
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 from subprocess import check_call
 
-from .svg import rm_to_svg
+from rmscene import SceneTree
+from rmscene import scene_items as si
+
+from .svg import (
+    tree_to_svg,
+    initial_anchor_pos,
+    group_anchor,
+    parse_tree,
+    sequence_ids,
+    stroke_segments,
+    select,
+    text_lines,
+    xx,
+    yy,
+    PAGE_WIDTH_PT,
+    PAGE_HEIGHT_PT,
+    X_SHIFT,
+    STROKE_WIDTH_DIVISOR,
+)
+from .points import packed_points
+from .writing_tools import Pen
+from .. import metrics
 
 _logger = logging.getLogger(__name__)
 
 
-def rm_to_pdf(rm_path, pdf_path, debug=0):
-    """Convert `rm_path` to PDF at `pdf_path`."""
-    with NamedTemporaryFile(suffix=".svg") as f_temp:
-        rm_to_svg(rm_path, f_temp.name)
+# Base 14 fonts used for each text format, matching the styles in the SVG
+# exporter: (resource name, size in points)
+TEXT_FONTS = {
+    si.TextFormat.HEADING: ("F2", 14),
+    si.TextFormat.BOLD: ("F3", 8),
+}
+DEFAULT_TEXT_FONT = ("F1", 7)
+FONT_RESOURCES = (
+    b"<< /F1 << /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"
+    b" /F2 << /Type /Font /Subtype /Type1 /BaseFont /Times-Roman /Encoding /WinAnsiEncoding >>"
+    b" /F3 << /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >> >>"
+)
 
-        # use inkscape to convert svg to pdf
-        check_call(["inkscape", f_temp.name, "--export-filename", pdf_path])
+LINECAPS = {
+    "butt": 0,
+    "round": 1,
+    "square": 2,
+}
+
+RGB_RE = re.compile(r"rgb\((\d+),\s*(\d+),\s*(\d+)\)")
+
+
+def rm_to_pdf(rm_path, pdf_path, debug=0, inkscape=False, pool=None, simplify=None):
+    """Convert `rm_path` to PDF at `pdf_path`.
+
+    If `inkscape` is true, convert via SVG using Inkscape instead of the
+    built-in PDF writer, using the `InkscapePool` `pool` if given.
+    """
+    if inkscape:
+        svg = io.StringIO()
+        with open(rm_path, "rb") as infile:
+            tree_to_svg(parse_tree(infile), svg, simplify=simplify)
+        svg.seek(0)
+        with open(pdf_path, "wb") as outfile:
+            svg_to_pdf(svg, outfile, pool)
+        return
+
+    with open(rm_path, "rb") as infile, open(pdf_path, "wb") as outfile:
+        tree = parse_tree(infile)
+        tree_to_pdf(tree, outfile, simplify)
+
+
+def convert_pdf(f, fout, inkscape=False, simplify=None, bbox=None, cull_erased=False,
+                **options):
+    tree = parse_tree(f)
+    if cull_erased:
+        from ..erase import cull_erased_strokes
+        cull_erased_strokes(tree, simplify)
+    if inkscape:
+        buf = io.StringIO()
+        tree_to_svg(tree, buf, simplify=simplify, bbox=bbox)
+        buf.seek(0)
+        svg_to_pdf(buf, fout, shared_inkscape_pool())
+    else:
+        tree_to_pdf(tree, fout, simplify, bbox)
 
 
-def svg_to_pdf(svg_file, pdf_file):
-    """Read svg data from `svg_file` and write PDF data to `pdf_file`."""
+def svg_to_pdf(svg_file, pdf_file, pool=None):
+    """Read svg data from `svg_file` and write PDF data to `pdf_file`.
+
+    If `pool` is given, the conversion is done by one of its long-running
+    Inkscape processes, otherwise a new Inkscape process is started.
+    """
+    if pool is not None:
+        with metrics.phase("inkscape"):
+            pdf_data = pool.convert(svg_file.read())
+        pdf_file.write(pdf_data)
+        return
 
     with NamedTemporaryFile("wt", suffix=".svg") as fsvg, NamedTemporaryFile("rb", suffix=".pdf") as fpdf:
         fsvg.write(svg_file.read())
 
         # use inkscape to convert svg to pdf
-        check_call(["inkscape", fsvg.name, "--export-filename", fpdf.name])
+        with metrics.phase("inkscape"):
+            check_call(["inkscape", fsvg.name, "--export-filename", fpdf.name])
 
         pdf_file.write(fpdf.read())
+
+
+class InkscapeError(Exception):
+    """An Inkscape worker failed, exited or timed out."""
+
+
+class InkscapeWorker:
+    """An Inkscape process running in `--shell` mode.
+
+    Commands are written to its stdin one line at a time; Inkscape prints a
+    prompt on stdout when it is ready for the next one.
+    """
+
+    PROMPT = b"> "
+
+    def __init__(self, command=("inkscape",), timeout=60):
+        self.process = subprocess.Popen(
+            [*command, "--shell"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            self._wait_for_prompt(timeout)
+        except InkscapeError:
+            self.kill()
+            raise
+
+    def _wait_for_prompt(self, timeout):
+        fd = self.process.stdout.fileno()
+        deadline = time.monotonic() + timeout
+        output = b""
+        while not output.endswith(self.PROMPT):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select_module.select([fd], [], [], remaining)[0]:
+                raise InkscapeError(f"Inkscape did not respond within {timeout}s")
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                raise InkscapeError(f"Inkscape exited with code {self.process.wait()}")
+            output = output[-len(self.PROMPT):] + chunk
+
+    def export(self, svg_path, pdf_path, timeout=60):
+        """Convert the SVG file at `svg_path` to PDF at `pdf_path`."""
+        command = (f"file-open:{svg_path}; export-filename:{pdf_path}; "
+                   "export-do; file-close\n")
+        try:
+            self.process.stdin.write(command.encode())
+            self.process.stdin.flush()
+        except OSError as exc:
+            raise InkscapeError(f"Inkscape is not running: {exc}") from exc
+        self._wait_for_prompt(timeout)
+
+    def close(self, timeout=5):
+        try:
+            self.process.stdin.write(b"quit\n")
+            self.process.stdin.close()
+            self.process.wait(timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+
+
+class InkscapePool:
+    """A pool of long-running Inkscape processes to convert SVG to PDF.
+
+    Each worker pays the Inkscape startup cost once, rather than once per
+    conversion. Workers that crash or hang are replaced. Files are passed
+    through `scratch_dir`, which defaults to a directory in `/dev/shm` where
+    available so that they stay in memory.
+    """
+
+    def __init__(self, size=1, command=("inkscape",), timeout=60, scratch_dir=None):
+        self.command = tuple(command)
+        self.timeout = timeout
+        if scratch_dir is None and os.path.isdir("/dev/shm"):
+            scratch_dir = "/dev/shm"
+        self._scratch = TemporaryDirectory(prefix="rmc-", dir=scratch_dir)
+        self._counter = itertools.count()
+        self._idle = queue.Queue()
+        # Workers are started on demand, up to `size`
+        for _ in range(size):
+            self._idle.put(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def convert(self, svg_data: str) -> bytes:
+        """Convert `svg_data` to PDF, returning the PDF data."""
+        job = next(self._counter)
+        svg_path = os.path.join(self._scratch.name, f"{job}.svg")
+        pdf_path = os.path.join(self._scratch.name, f"{job}.pdf")
+        with open(svg_path, "wt") as f:
+            f.write(svg_data)
+        worker = self._idle.get()
+        try:
+            worker = self._export(worker, svg_path, pdf_path)
+            with open(pdf_path, "rb") as f:
+                return f.read()
+        except BaseException:
+            # The worker may be in the middle of a command, so it is stopped
+            # (if it isn't already) and the next job starts a new one
+            if worker is not None:
+                worker.kill()
+            worker = None
+            raise
+        finally:
+            self._idle.put(worker)
+            for path in (svg_path, pdf_path):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def _export(self, worker, svg_path, pdf_path):
+        """Export using `worker`, replacing it once if it fails.
+
+        Returns the worker that did the export.
+        """
+        for attempt in (1, 2):
+            try:
+                if worker is None:
+                    worker = InkscapeWorker(self.command, self.timeout)
+                worker.export(svg_path, pdf_path, self.timeout)
+                if not os.path.exists(pdf_path):
+                    raise InkscapeError("Inkscape did not write any output")
+                return worker
+            except (InkscapeError, OSError) as exc:
+                _logger.warning("Inkscape worker failed (attempt %d): %s", attempt, exc)
+                if worker is not None:
+                    worker.kill()
+                    worker = None
+                if attempt == 2:
+                    raise InkscapeError(f"Inkscape conversion failed: {exc}") from exc
+            except BaseException:
+                if worker is not None:
+                    worker.kill()
+                raise
+        raise AssertionError("unreachable")
+
+    def close(self):
+        """Stop all the Inkscape workers."""
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if worker is not None:
+                worker.close()
+        self._scratch.cleanup()
+
+
+_shared_pool = None
+
+
+def shared_inkscape_pool() -> InkscapePool:
+    """Return a single-worker pool shared by all conversions in this process.
+
+    It is stopped when the process exits.
+    """
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = InkscapePool()
+        atexit.register(_shared_pool.close)
+    return _shared_pool
+
+
+class PdfWriter:
+    """Minimal PDF writer, writing each page to `output` as it is added."""
+
+    def __init__(self, output):
+        self.output = output
+        self.offsets = {}
+        self.position = 0
+        self.page_ids = []
+        self._next_id = 1
+        self.catalog_id = self._new_id()
+        self.pages_id = self._new_id()
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _new_id(self):
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _write(self, data: bytes):
+        self.output.write(data)
+        self.position += len(data)
+
+    def _write_object(self, obj_id, data: bytes, stream: bytes = None):
+        self.offsets[obj_id] = self.position
+        self._write(b"%d 0 obj\n" % obj_id)
+        self._write(data)
+        if stream is not None:
+            self._write(b"\nstream\n")
+            self._write(stream)
+            self._write(b"\nendstream")
+        self._write(b"\nendobj\n")
+
+    def add_page(self, content: bytes, resources: bytes,
+                 width=PAGE_WIDTH_PT, height=PAGE_HEIGHT_PT):
+        """Add a page drawn by the operators in `content`."""
+        content_id = self._new_id()
+        compressed = zlib.compress(content)
+        self._write_object(
+            content_id,
+            b"<< /Length %d /Filter /FlateDecode >>" % len(compressed),
+            compressed,
+        )
+        page_id = self._new_id()
+        self._write_object(
+            page_id,
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %s %s] /Resources %s /Contents %d 0 R >>"
+            % (self.pages_id, _num(width).encode(), _num(height).encode(), resources, content_id),
+        )
+        self.page_ids.append(page_id)
+
+    def close(self):
+        """Write the page tree, catalog and cross-reference table."""
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in self.page_ids)
+        self._write_object(
+            self.pages_id,
+            b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.page_ids)),
+        )
+        self._write_object(
+            self.catalog_id,
+            b"<< /Type /Catalog /Pages %d 0 R >>" % self.pages_id,
+        )
+        xref_position = self.position
+        size = self._next_id
+        self._write(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+        for obj_id in range(1, size):
+            self._write(b"%010d 00000 n \n" % self.offsets[obj_id])
+        self._write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                    % (size, self.catalog_id, xref_position))
+
+
+class PageContent:
+    """Collects the drawing operators and resources for one page."""
+
+    def __init__(self):
+        self.ops = []
+        # Graphics states used for opacity, by opacity value
+        self.alphas = {}
+
+    def write(self, op: str):
+        self.ops.append(op)
+
+    def set_opacity(self, opacity):
+        opacity = min(1, max(0, opacity))
+        name = self.alphas.setdefault(opacity, f"GS{len(self.alphas)}")
+        self.write(f"/{name} gs")
+
+    def content(self) -> bytes:
+        return "\n".join(self.ops).encode("ascii")
+
+    def resources(self) -> bytes:
+        states = " ".join(
+            f"/{name} << /CA {_num(alpha)} /ca {_num(alpha)} >>"
+            for alpha, name in self.alphas.items()
+        )
+        return (b"<< /Font %s /ExtGState << %s >> >>"
+                % (FONT_RESOURCES, states.encode("ascii")))
+
+
+def tree_to_pdf(tree: SceneTree, output, simplify=None, bbox=None):
+    """Convert the scene tree to a single page PDF written to `output`.
+
+    `simplify` is the stroke simplification tolerance, and `bbox` the region
+    of the page to show, as for `tree_to_svg`.
+    """
+    trees_to_pdf([tree], output, simplify, bbox)
+
+
+def trees_to_pdf(trees: Iterable[SceneTree], output, simplify=None, bbox=None):
+    """Convert each of `trees` to a page of one PDF written to `output`.
+
+    Each page is written out before the next tree is taken from `trees`, so
+    they can be read one at a time.
+    """
+    region = None
+    if bbox is not None:
+        from ..spatial import bbox_region
+        region = bbox_region(bbox)
+    writer = PdfWriter(output)
+    for tree in trees:
+        visible = None
+        if bbox is not None:
+            from ..spatial import StrokeIndex
+            visible = StrokeIndex.for_tree(tree).visible_ids(bbox)
+        page = draw_page(tree, simplify, visible, region)
+        if region is None:
+            writer.add_page(page.content(), page.resources())
+        else:
+            writer.add_page(page.content(), page.resources(), region[2], region[3])
+    writer.close()
+
+
+def draw_page(tree: SceneTree, simplify=None, visible=None, region=None) -> PageContent:
+    """Return the PDF drawing operators for the page in `tree`.
+
+    `visible` is as for the SVG `draw_page`. If `region` is given as
+    `(left, top, width, height)` in points, the page shows only that part.
+    """
+    page = PageContent()
+
+    # Use the same coordinates as the SVG output, with y pointing down.
+    left, top, _, height = region or (0, 0, PAGE_WIDTH_PT, PAGE_HEIGHT_PT)
+    page.write(f"1 0 0 -1 {_num(X_SHIFT - left)} {_num(top + height)} cm")
+
+    anchor_pos = initial_anchor_pos()
+    if tree.root_text is not None:
+        with metrics.phase("text"):
+            draw_text(tree.root_text, page, anchor_pos)
+    _logger.debug("anchor_pos: %s", anchor_pos)
+
+    draw_group(tree.root, page, anchor_pos, simplify, visible)
+    return page
+
+
+def draw_group(item: si.Group, page: PageContent, anchor_pos, simplify=None, visible=None):
+    with metrics.phase("anchors"):
+        anchor_x, anchor_y = group_anchor(item, anchor_pos)
+    page.write(f"q 1 0 0 1 {_num(xx(anchor_x))} {_num(yy(anchor_y))} cm")
+    for child_id in sequence_ids(item.children):
+        if visible is not None and child_id not in visible:
+            continue
+        child = item.children[child_id]
+        if isinstance(child, si.Group):
+            draw_group(child, page, anchor_pos, simplify, visible)
+        elif isinstance(child, si.Line):
+            draw_stroke(child, page, simplify)
+    page.write("Q")
+
+
+def draw_stroke(item: si.Line, page: PageContent, simplify=None):
+    num_segments = 0
+    with metrics.phase("draw_stroke"):
+        pen = Pen.create(item.tool.value, item.color.value, item.thickness_scale/10)
+        page.write(f"{LINECAPS[pen.stroke_linecap]} J 1 j")
+        points = packed_points(item.points)
+        points = [f"{_num(xx(x))} {_num(yy(y))}" for x, y in zip(points.x, points.y)]
+        for segment in stroke_segments(item, pen, simplify):
+            if len(segment.indices) < 2:
+                continue
+            page.set_opacity(segment.opacity)
+            first, *rest = select(points, segment.indices)
+            path = f"{first} m {' l '.join(rest)} l"
+            page.write(f"{_rgb(segment.color)} RG {_num(segment.width / STROKE_WIDTH_DIVISOR)} w {path} S")
+            num_segments += 1
+
+    metrics.count("strokes", tool=item.tool.name)
+    metrics.count("points", len(item.points))
+    metrics.count("segments", num_segments)
+
+
+def draw_text(text: si.Text, page: PageContent, anchor_pos):
+    page.write("q 0 g")
+    page.set_opacity(1)
+    for fmt, line, ids, xpos, ypos in text_lines(text, anchor_pos):
+        line = line.strip()
+        if not line:
+            continue
+        font, size = TEXT_FONTS.get(fmt, DEFAULT_TEXT_FONT)
+        # Flip the text back the right way up
+        page.write(f"BT /{font} {size} Tf 1 0 0 -1 {_num(xx(xpos))} {_num(yy(ypos))} Tm "
+                   f"{_pdf_string(line)} Tj ET")
+    page.write("Q")
+
+
+def _num(value) -> str:
+    """Format a number compactly for PDF."""
+    return f"{value:.3f}".rstrip("0").rstrip(".")
+
+
+def _rgb(color: str) -> str:
+    """Convert an SVG "rgb(r, g, b)" color to PDF color components."""
+    match = RGB_RE.fullmatch(color)
+    if match is None:
+        _logger.warning("Unknown color: %s", color)
+        return "0 0 0"
+    return " ".join(_num(int(c) / 255) for c in match.groups())
+
+
+def _pdf_string(text: str) -> str:
+    """Escape `text` as a PDF literal string."""
+    text = text.encode("cp1252", errors="replace").decode("latin-1")
+    escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    # Content is written as ASCII, so escape anything else as octal
+    return "(" + "".join(
+        c if 32 <= ord(c) < 127 else f"\\{ord(c):03o}" for c in escaped
+    ) + ")"
@@ -0,0 +1,348 @@
+"""Rasterize scene trees to PNG images without an external renderer.
+
+Strokes are drawn with the same segments and pen styles as the SVG and PDF
+output. The coverage of each pixel by a segment is computed from its
+distance to the segment's centre line, with NumPy array operations over all
+the pixels near each stroke at once, and each segment is then blended onto
+the page with its opacity. Text is drawn with a small built-in bitmap font,
+which is enough to show where it is and roughly what it says.
+
+NumPy is required (install the `fast` extra).
+"""
+
+import logging
+import struct
+import zlib
+from functools import lru_cache
+
+from rmscene import SceneTree
+from rmscene import scene_items as si
+
+from .svg import (
+    PAGE_HEIGHT_PT,
+    PAGE_WIDTH_PT,
+    SCREEN_DPI,
+    SCREEN_WIDTH,
+    STROKE_WIDTH_DIVISOR,
+    X_SHIFT,
+    group_anchor,
+    sequence_ids,
+    initial_anchor_pos,
+    parse_tree,
+    stroke_segments,
+    text_lines,
+    xx,
+    yy,
+)
+from .pdf import DEFAULT_TEXT_FONT, RGB_RE, TEXT_FONTS
+from .points import packed_points
+from .writing_tools import Pen, np
+from .. import metrics
+
+_logger = logging.getLogger(__name__)
+
+
+# The tablet's own resolution, giving one image pixel per screen pixel
+DEFAULT_DPI = SCREEN_DPI
+
+# 5x7 glyphs for ASCII 32-126, as five columns of 7 bits each (bit 0 at the
+# top). Other characters are drawn as "?".
+FONT_GLYPHS = bytes.fromhex(
+    "0000000000" "00005f0000" "0007000700" "147f147f14" "242a7f2a12"
+    "2313086462" "3649552250" "0005030000" "001c224100" "0041221c00"
+    "142a1c2a14" "08083e0808" "0050300000" "0808080808" "0060600000"
+    "2010080402" "3e5149453e" "00427f4000" "4261514946" "2141454b31"
+    "1814127f10" "2745454539" "3c4a494930" "0171090503" "3649494936"
+    "064949291e" "0036360000" "0056360000" "0814224100" "1414141414"
+    "0041221408" "0201510906" "324979413e" "7e1111117e" "7f49494936"
+    "3e41414122" "7f4141221c" "7f49494941" "7f09090101" "3e41415132"
+    "7f0808087f" "00417f4100" "2040413f01" "7f08142241" "7f40404040"
+    "7f0204027f" "7f0408107f" "3e4141413e" "7f09090906" "3e4151215e"
+    "7f09192946" "4649494931" "01017f0101" "3f4040403f" "1f2040201f"
+    "7f2018207f" "6314081463" "0304780403" "6151494543" "007f414100"
+    "0204081020" "0041417f00" "0402010204" "4040404040" "0001020400"
+    "2054545478" "7f48444438" "3844444420" "384444487f" "3854545418"
+    "087e090102" "0814545438" "7f08040478" "00447d4000" "2040443d00"
+    "007f102844" "00417f4000" "7c0418047c" "7c08040478" "3844444438"
+    "7c14141408" "081414187c" "7c08040408" "4854545420" "043f444020"
+    "3c4040207c" "1c2040201c" "3c4030403c" "4428102844" "0c5050503c"
+    "4464544c44" "0008364100" "00007f0000" "0041360800" "0201020402"
+)
+GLYPH_WIDTH = 5
+GLYPH_HEIGHT = 7
+# Glyph rows per em: the glyphs are about as tall as capital letters
+GLYPH_ROWS_PER_EM = 10
+
+
+def rm_to_png(rm_path, png_path, dpi=DEFAULT_DPI, simplify=None, bbox=None):
+    """Convert `rm_path` to a PNG image at `png_path`."""
+    with open(rm_path, "rb") as infile, open(png_path, "wb") as outfile:
+        tree = parse_tree(infile)
+        tree_to_png(tree, outfile, dpi, simplify, bbox)
+
+
+def convert_png(f, fout, dpi=None, thumbnail=None, simplify=None, bbox=None, cull_erased=False,
+                **options):
+    if thumbnail is not None and dpi is not None:
+        raise ValueError("A thumbnail's resolution is set by its width, not dpi")
+    tree = parse_tree(f)
+    if cull_erased:
+        from ..erase import cull_erased_strokes
+        # Thumbnails move points by up to a pixel, so allow two
+        pixel_size = (2 * SCREEN_WIDTH / thumbnail if thumbnail is not None
+                      else SCREEN_DPI / (DEFAULT_DPI if dpi is None else dpi))
+        cull_erased_strokes(tree, simplify, pixel_size)
+    if thumbnail is not None:
+        from .thumbnail import tree_to_thumbnail
+        tree_to_thumbnail(tree, fout, thumbnail)
+    else:
+        tree_to_png(tree, fout, DEFAULT_DPI if dpi is None else dpi, simplify, bbox)
+
+
+def tree_to_png(tree: SceneTree, output, dpi=DEFAULT_DPI, simplify=None, bbox=None):
+    """Draw the scene tree as a PNG image written to `output`.
+
+    The image covers the page at `dpi` pixels per inch. `simplify` is the
+    stroke simplification tolerance, and `bbox` the region of the page to
+    show, as for `tree_to_svg`.
+    """
+    if np is None:
+        raise ImportError("PNG output requires NumPy; install rmc[fast]")
+    visible = None
+    region = None
+    if bbox is not None:
+        from ..spatial import StrokeIndex, bbox_region
+        visible = StrokeIndex.for_tree(tree).visible_ids(bbox)
+        region = bbox_region(bbox)
+    canvas = Canvas(dpi, region)
+    draw_page(tree, canvas, simplify, visible)
+    write_png(output, canvas.to_image(), dpi)
+
+
+class Canvas:
+    """An RGB image of the page, or of the `region` of it.
+
+    `region` is `(left, top, width, height)` in points from the page's top
+    left corner.
+    """
+
+    def __init__(self, dpi=DEFAULT_DPI, region=None):
+        self.scale = dpi / 72
+        self.left, self.top, width, height = region or (0, 0, PAGE_WIDTH_PT, PAGE_HEIGHT_PT)
+        self.width = max(int(round(width * self.scale)), 1)
+        self.height = max(int(round(height * self.scale)), 1)
+        # Flat array of pixels, so that pixels can be indexed by one number
+        self.pixels = np.ones((self.width * self.height, 3), dtype=np.float32)
+
+    def blend(self, pixels, alpha, color):
+        """Blend `color` onto the flat pixel indices `pixels` with `alpha`.
+
+        `color` is one RGB color or one for each pixel. `pixels` must not
+        contain duplicates.
+        """
+        alpha = alpha[:, None]
+        self.pixels[pixels] = self.pixels[pixels] * (1 - alpha) + np.asarray(color) * alpha
+
+    def to_image(self):
+        """Return the page as an array of 8-bit RGB values, row by row."""
+        image = (self.pixels * 255 + 0.5).astype(np.uint8)
+        return image.reshape(self.height, self.width, 3)
+
+
+def draw_page(tree: SceneTree, canvas: Canvas, simplify=None, visible=None):
+    """Draw `tree` on `canvas`; `visible` is as for the SVG `draw_page`."""
+    anchor_pos = initial_anchor_pos()
+    if tree.root_text is not None:
+        with metrics.phase("text"):
+            draw_text(tree.root_text, canvas, anchor_pos)
+    draw_group(tree.root, canvas, anchor_pos, (X_SHIFT, 0.0), simplify, visible)
+
+
+def draw_group(item: si.Group, canvas: Canvas, anchor_pos, origin, simplify=None, visible=None):
+    """Draw the group `item`, whose parent's origin is at `origin` points."""
+    with metrics.phase("anchors"):
+        anchor_x, anchor_y = group_anchor(item, anchor_pos)
+    origin = (origin[0] + xx(anchor_x), origin[1] + yy(anchor_y))
+    for child_id in sequence_ids(item.children):
+        if visible is not None and child_id not in visible:
+            continue
+        child = item.children[child_id]
+        if isinstance(child, si.Group):
+            draw_group(child, canvas, anchor_pos, origin, simplify, visible)
+        elif isinstance(child, si.Line):
+            draw_stroke(child, canvas, origin, simplify)
+
+
+def draw_stroke(item: si.Line, canvas: Canvas, origin, simplify=None):
+    """Draw the segments of `item`, offset by `origin` points."""
+    num_segments = 0
+    with metrics.phase("draw_stroke"):
+        pen = Pen.create(item.tool.value, item.color.value, item.thickness_scale/10)
+        segments = [s for s in stroke_segments(item, pen, simplify) if len(s.indices) >= 2]
+        if segments:
+            num_segments = len(segments)
+            x, y = stroke_pixels(item, canvas, origin)
+            draw_segments(x, y, segments, canvas)
+
+    metrics.count("strokes", tool=item.tool.name)
+    metrics.count("points", len(item.points))
+    metrics.count("segments", num_segments)
+
+
+def stroke_pixels(item: si.Line, canvas: Canvas, origin):
+    """Return arrays of the image x and y coordinates of the points of `item`."""
+    points = packed_points(item.points)
+    x = (origin[0] + xx(np.asarray(points.x, dtype=float)) - canvas.left) * canvas.scale
+    y = (origin[1] + yy(np.asarray(points.y, dtype=float)) - canvas.top) * canvas.scale
+    return x, y
+
+
+def draw_segments(x, y, segments, canvas: Canvas):
+    """Draw the styled `segments` of a stroke with antialiasing.
+
+    `x` and `y` are the image coordinates of the stroke's points. Each line
+    between two points is drawn with round ends, so segments join smoothly
+    whatever the pen's line cap.
+    """
+    s = canvas.scale
+    # The lines between consecutive points of each segment
+    starts = np.concatenate([np.asarray(seg.indices[:-1]) for seg in segments])
+    ends = np.concatenate([np.asarray(seg.indices[1:]) for seg in segments])
+    line_segment = np.repeat(np.arange(len(segments)), [len(seg.indices) - 1 for seg in segments])
+    radius = np.array([seg.width / STROKE_WIDTH_DIVISOR / 2 * s for seg in segments])[line_segment]
+    ax, ay, bx, by = x[starts], y[starts], x[ends], y[ends]
+
+    # Pixels within reach of each line: those whose centres are less than
+    # half a pixel beyond the line's width
+    x0 = np.clip(np.floor(np.minimum(ax, bx) - radius), 0, canvas.width).astype(np.int64)
+    x1 = np.clip(np.ceil(np.maximum(ax, bx) + radius), 0, canvas.width).astype(np.int64)
+    y0 = np.clip(np.floor(np.minimum(ay, by) - radius), 0, canvas.height).astype(np.int64)
+    y1 = np.clip(np.ceil(np.maximum(ay, by) + radius), 0, canvas.height).astype(np.int64)
+    box_width = np.maximum(x1 - x0, 0)
+    counts = box_width * np.maximum(y1 - y0, 0)
+    line = np.repeat(np.arange(len(starts)), counts)
+    if len(line) == 0:
+        return
+    offset = np.arange(len(line)) - np.repeat(np.cumsum(counts) - counts, counts)
+    px = x0[line] + offset % box_width[line]
+    py = y0[line] + offset // box_width[line]
+
+    # Distance from each pixel centre to its line
+    dx = (bx - ax)[line]
+    dy = (by - ay)[line]
+    rx = px + 0.5 - ax[line]
+    ry = py + 0.5 - ay[line]
+    length2 = dx * dx + dy * dy
+    t = np.clip((rx * dx + ry * dy) / np.where(length2 > 0, length2, 1), 0, 1)
+    distance = np.hypot(rx - t * dx, ry - t * dy)
+
+    # Approximate coverage as the overlap of the pixel's width with the line's
+    r = radius[line]
+    coverage = np.clip(np.minimum(distance + 0.5, r) - np.maximum(distance - 0.5, -r), 0, 1)
+    keep = coverage > 0
+    if not keep.any():
+        return
+    segment = line_segment[line[keep]]
+    pixel = (py * canvas.width + px)[keep]
+    coverage = coverage[keep]
+
+    # Each segment covers a pixel by the most any of its lines does
+    key = segment * (canvas.width * canvas.height) + pixel
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+    first = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    coverage = np.maximum.reduceat(coverage[order], first)
+    segment = segment[order][first]
+    pixel = pixel[order][first]
+
+    # Blend the segments in order. Pixels covered by several segments (where
+    # they join) are blended in rounds, taking each segment in turn.
+    order = np.argsort(pixel, kind="stable")
+    pixel, segment, coverage = pixel[order], segment[order], coverage[order]
+    group_start = np.flatnonzero(np.r_[True, pixel[1:] != pixel[:-1]])
+    rank = np.arange(len(pixel)) - np.repeat(group_start, np.diff(np.r_[group_start, len(pixel)]))
+    opacity = np.array([seg.opacity for seg in segments])
+    colors = np.array([_rgb(seg.color) for seg in segments])
+    for round_ in range(rank.max() + 1):
+        this_round = rank == round_
+        seg = segment[this_round]
+        canvas.blend(pixel[this_round], coverage[this_round] * opacity[seg], colors[seg])
+
+
+def draw_text(text: si.Text, canvas: Canvas, anchor_pos):
+    for fmt, line, ids, xpos, ypos in text_lines(text, anchor_pos):
+        line = line.strip()
+        if not line:
+            continue
+        _, size = TEXT_FONTS.get(fmt, DEFAULT_TEXT_FONT)
+        draw_string(canvas, line, X_SHIFT + xx(xpos), yy(ypos), size,
+                    bold=fmt == si.TextFormat.BOLD)
+
+
+def draw_string(canvas: Canvas, line: str, x, y, size, bold=False):
+    """Draw `line` in black with its baseline starting at (`x`, `y`) points."""
+    # Lay out the glyphs as one bitmap, with a blank column between them
+    codes = np.frombuffer(line.encode("ascii", errors="replace"), dtype=np.uint8).astype(np.int64)
+    codes = np.where((codes >= 32) & (codes < 127), codes, ord("?")) - 32
+    glyphs = np.frombuffer(FONT_GLYPHS, dtype=np.uint8).reshape(-1, GLYPH_WIDTH)
+    columns = np.pad(glyphs[codes], ((0, 0), (0, 1))).ravel()
+    if bold:
+        columns = columns | np.r_[0, columns[:-1]]
+    bitmap = (columns[None, :] >> np.arange(GLYPH_HEIGHT)[:, None]) & 1
+
+    # Sample the bitmap at each image pixel's centre
+    s = canvas.scale
+    step = size / GLYPH_ROWS_PER_EM * s
+    left = (x - canvas.left) * s
+    baseline = (y - canvas.top) * s
+    top = baseline - GLYPH_HEIGHT * step
+    col0 = max(int(left), 0)
+    col1 = min(int(np.ceil(left + bitmap.shape[1] * step)), canvas.width)
+    row0 = max(int(top), 0)
+    row1 = min(int(np.ceil(baseline)), canvas.height)
+    if col0 >= col1 or row0 >= row1:
+        return
+    gx = ((np.arange(col0, col1) + 0.5 - left) / step).astype(np.int64)
+    gy = ((np.arange(row0, row1) + 0.5 - top) / step).astype(np.int64)
+    gx_ok = (gx >= 0) & (gx < bitmap.shape[1])
+    gy_ok = (gy >= 0) & (gy < GLYPH_HEIGHT)
+    ink = bitmap[np.clip(gy, 0, GLYPH_HEIGHT - 1)[:, None],
+                 np.clip(gx, 0, bitmap.shape[1] - 1)[None, :]].astype(bool)
+    ink &= gy_ok[:, None] & gx_ok[None, :]
+    rows, cols = np.nonzero(ink)
+    pixels = (rows + row0) * canvas.width + cols + col0
+    canvas.blend(pixels, np.ones(len(pixels)), (0.0, 0.0, 0.0))
+
+
+def write_png(output, image, dpi=None, level=6):
+    """Write the 8-bit RGB `image` array as a PNG file.
+
+    `level` is the zlib compression level.
+    """
+    height, width, _ = image.shape
+    # Each row starts with a filter type byte; 0 is no filter
+    raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    raw[:, 1:] = image.reshape(height, -1)
+
+    def chunk(kind: bytes, data: bytes):
+        output.write(struct.pack(">I", len(data)) + kind + data +
+                     struct.pack(">I", zlib.crc32(kind + data)))
+
+    output.write(b"\x89PNG\r\n\x1a\n")
+    chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+    if dpi is not None:
+        # Pixels per metre
+        ppm = int(round(dpi / 0.0254))
+        chunk(b"pHYs", struct.pack(">IIB", ppm, ppm, 1))
+    chunk(b"IDAT", zlib.compress(raw.tobytes(), level))
+    chunk(b"IEND", b"")
+
+
+@lru_cache(maxsize=256)
+def _rgb(color: str) -> tuple:
+    """Convert an SVG "rgb(r, g, b)" color to components from 0 to 1."""
+    match = RGB_RE.fullmatch(color)
+    if match is None:
+        _logger.warning("Unknown color: %s", color)
+        return (0.0, 0.0, 0.0)
+    return tuple(int(c) / 255 for c in match.groups())
@@ -4,22 +4,33 @@ Code originally from https://github.com/lschwetlick/maxio through
 https://github.com/chemag/maxio .
 """
 
+import gzip
+import hashlib
+import io
+import json
 import logging
 import string
+import sys
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 
-from typing import Iterable
+from typing import Iterable, Iterator, NamedTuple, Sequence
 
 from rmscene import scene_items as si
 from rmscene import (
-    read_tree,
     SceneTree,
     CrdtId,
 )
 
+from .crdt import formatted_lines_with_ids, sequence_ids
+from .points import PointArray, packed_points, read_packed_tree
 from .writing_tools import (
     Pen,
+    np,
 )
+from .. import metrics
 
 _logger = logging.getLogger(__name__)
 
@@ -35,6 +46,14 @@ PAGE_HEIGHT_PT = SCREEN_HEIGHT * SCALE
 X_SHIFT = PAGE_WIDTH_PT // 2
 
 
+# Strokes with at least this many points are styled with NumPy array
+# operations, if it is installed
+VECTORIZE_MIN_POINTS = 128
+
+# Pen widths are divided by this to give the stroke width in points
+STROKE_WIDTH_DIVISOR = 5
+
+
 def xx(screen_x):
     return screen_x * SCALE #+ X_SHIFT
 
@@ -67,7 +86,7 @@ LINE_HEIGHTS = {
 # <div style="border: 1px solid grey; margin: 2em; float: left;">
 # <svg xmlns="http://www.w3.org/2000/svg" height="$height" width="$width">
 SVG_HEADER = string.Template("""
-<svg xmlns="http://www.w3.org/2000/svg" height="$height" width="$width" viewbox="$viewbox">
+<svg xmlns="http://www.w3.org/2000/svg" height="$height" width="$width" viewBox="$viewbox">
     <script type="application/ecmascript"> <![CDATA[
         var visiblePage = 'p1';
         function goToPage(page) {
@@ -83,23 +102,95 @@ SVG_HEADER = string.Template("""
 def rm_to_svg(rm_path, svg_path):
     """Convert `rm_path` to SVG at `svg_path`."""
     with open(rm_path, "rb") as infile, open(svg_path, "wt") as outfile:
-        tree = read_tree(infile)
+        tree = parse_tree(infile)
         tree_to_svg(tree, outfile)
 
 
+def parse_tree(f) -> SceneTree:
+    """Read the scene tree from the rm file `f`, timing it as the "parse" phase."""
+    with metrics.phase("parse"):
+        return read_packed_tree(f)
+
+
+def convert_svg(f, fout, simplify=None, bbox=None, precision=None, fragment_cache=None,
+                cull_erased=False, **options):
+    tree = parse_tree(f)
+    if cull_erased:
+        from ..erase import cull_erased_strokes
+        cull_erased_strokes(tree, simplify)
+    tree_to_svg(tree, fout, simplify=simplify, bbox=bbox, cache=fragment_cache,
+                precision=precision)
+
+
+def convert_svgz(f, fout, **options):
+    with gzip_output(fout) as text:
+        convert_svg(f, text, **options)
+
+
+@contextmanager
+def gzip_output(fout):
+    """Give a text stream that is written gzip-compressed to the binary `fout`.
+
+    The output is compressed as it is written, not all at the end. No
+    timestamp is included, so the same SVG always gives the same bytes.
+    """
+    with gzip.GzipFile(fileobj=fout, mode="wb", mtime=0) as gz:
+        text = io.TextIOWrapper(gz, encoding="utf-8")
+        yield text
+        text.flush()
+        text.detach()
+
+
 def read_template_svg(template_path: Path) -> str:
     lines = template_path.read_text().splitlines()
     return "\n".join(lines[2:-1])
 
 
-def tree_to_svg(tree: SceneTree, output, include_template=None):
-    """Convert Blocks to SVG."""
+def tree_to_svg(tree: SceneTree, output, include_template=None, simplify=None, bbox=None,
+                cache=None, precision=None):
+    """Convert Blocks to SVG.
+
+    If `simplify` is given, stroke points are simplified to within that
+    distance in screen pixels; see `simplify_indices`.
+
+    If `precision` is given, strokes are written as compact `<path>`
+    elements with coordinates rounded to that many decimal places (see
+    `path_data`), rather than as `<polyline>` elements with three.
+
+    If `bbox` is given as `(x0, y0, x1, y1)` in screen coordinates, only
+    that region of the page is shown, and only the strokes in it are drawn
+    (see `rmc.spatial`). Text is not cropped: all of it is written, and the
+    edges of the region cut it off.
+
+    Stroke styles are written once each as CSS classes, in a `<style>`
+    element at the end of the document.
+
+    If `cache` is a `FragmentCache`, strokes and groups drawn by earlier
+    exports are taken from it, and only new or changed ones are drawn.
+    """
+    trees_to_svg([tree], output, include_template, simplify, bbox, cache, precision)
+
+
+def trees_to_svg(trees: Iterable[SceneTree], output, include_template=None, simplify=None,
+                 bbox=None, cache=None, precision=None):
+    """Convert each of `trees` to a page of one SVG document.
+
+    The pages are groups with ids `p1`, `p2`, ..., of which only the first
+    is displayed; the `goToPage` script switches between them. Each tree is
+    written out before the next is taken from `trees`, so they can be read
+    one at a time. Options are as for `tree_to_svg`.
+    """
 
     # add svg header
     # output.write('<svg xmlns="http://www.w3.org/2000/svg">\n')
-    output.write(SVG_HEADER.substitute(width=PAGE_WIDTH_PT,
-                                       height=PAGE_HEIGHT_PT,
-                                       viewbox=f"0 0 {PAGE_WIDTH_PT} {PAGE_HEIGHT_PT}") + "\n")
+    if bbox is None:
+        left, top, width, height = 0, 0, PAGE_WIDTH_PT, PAGE_HEIGHT_PT
+    else:
+        from ..spatial import bbox_region
+        left, top, width, height = bbox_region(bbox)
+    output.write(SVG_HEADER.substitute(width=width,
+                                       height=height,
+                                       viewbox=f"{left} {top} {width} {height}") + "\n")
 
     if include_template is not None:
         template = read_template_svg(include_template)
@@ -107,19 +198,42 @@ def tree_to_svg(tree: SceneTree, output, include_template=None):
         output.write(template)
         output.write('    </g>\n')
 
-    output.write(f'    <g id="p1" style="display:inline" transform="translate({X_SHIFT},0)">\n')
-    output.write('        <filter id="blurMe"><feGaussianBlur in="SourceGraphic" stdDeviation="10" /></filter>\n')
+    output.write('    <filter id="blurMe"><feGaussianBlur in="SourceGraphic" stdDeviation="10" /></filter>\n')
 
-    # These special anchor IDs are for the top and bottom of the page.
-    anchor_pos = {
-        CrdtId(0, 281474976710654): 270,
-        CrdtId(0, 281474976710655): 700,
-    }
+    styles = StyleClasses()
+    for page_number, tree in enumerate(trees, start=1):
+        visible = None
+        if bbox is not None:
+            from ..spatial import StrokeIndex
+            visible = StrokeIndex.for_tree(tree).visible_ids(bbox)
+        draw_page(tree, output, page_number, simplify, styles, visible, cache, precision)
+
+    styles.write(output)
+    # END notebook
+    output.write('</svg>\n')
+
+
+def draw_page(tree: SceneTree, output, page_number=1, simplify=None, styles=None, visible=None,
+              cache=None, precision=None):
+    """Write `tree` as the group for page `page_number`.
+
+    If `visible` is given, only the children of groups whose ids are in it
+    are drawn.
+    """
+    display = "inline" if page_number == 1 else "none"
+    output.write(f'    <g id="p{page_number}" style="display:{display}" transform="translate({X_SHIFT},0)">\n')
+
+    anchor_pos = initial_anchor_pos()
     if tree.root_text is not None:
-        draw_text(tree.root_text, output, anchor_pos)
+        with metrics.phase("text"):
+            draw_text(tree.root_text, output, anchor_pos)
     _logger.debug("anchor_pos: %s", anchor_pos)
 
-    draw_group(tree.root, output, anchor_pos)
+    # Group ids must be unique in the document, so are prefixed after the
+    # first page
+    id_prefix = "" if page_number == 1 else f"p{page_number}-"
+    draw_group(tree.root, output, anchor_pos, simplify, styles, id_prefix, visible, cache,
+               precision)
 
     # # Overlay the page with a clickable rect to flip pages
     # output.write('\n')
@@ -127,11 +241,19 @@ def tree_to_svg(tree: SceneTree, output, include_template=None):
     # output.write(f'        <rect x="0" y="0" width="{svg_doc_info.width}" height="{svg_doc_info.height}" fill-opacity="0"/>\n')
     # Closing page group
     output.write('    </g>\n')
-    # END notebook
-    output.write('</svg>\n')
 
 
-def draw_group(item: si.Group, output, anchor_pos):
+def initial_anchor_pos():
+    """Return the y-coordinates of the anchors that exist without any text."""
+    # These special anchor IDs are for the top and bottom of the page.
+    return {
+        CrdtId(0, 281474976710654): 270,
+        CrdtId(0, 281474976710655): 700,
+    }
+
+
+def group_anchor(item: si.Group, anchor_pos) -> tuple[float, float]:
+    """Return the (x, y) offset of the group `item` given by its anchor."""
     anchor_x = 0.0
     anchor_y = 0.0
     if item.anchor_id is not None:
@@ -142,64 +264,498 @@ def draw_group(item: si.Group, output, anchor_pos):
             _logger.debug("Group anchor: %s -> y=%.1f", item.anchor_id.value, anchor_y)
         else:
             _logger.warning("Group anchor: %s is unknown!", item.anchor_id.value)
-    output.write(f'    <g id="{item.node_id}" transform="translate({xx(anchor_x)}, {yy(anchor_y)})">\n')
-    for child_id in item.children:
+    return anchor_x, anchor_y
+
+
+def group_children(item: si.Group) -> list:
+    """Return the children of `item` in order."""
+    return [item.children[child_id] for child_id in sequence_ids(item.children)]
+
+
+def draw_group(item: si.Group, output, anchor_pos, simplify=None, styles=None, id_prefix="",
+               visible=None, cache=None, precision=None):
+    if cache is not None:
+        _, build = cache.group_fragment(item, anchor_pos, simplify, id_prefix, visible, precision)
+        write_fragment(build(), output, styles)
+        return
+
+    with metrics.phase("anchors"):
+        anchor_x, anchor_y = group_anchor(item, anchor_pos)
+    output.write(group_header(item, anchor_x, anchor_y, id_prefix))
+    for child_id in sequence_ids(item.children):
+        if visible is not None and child_id not in visible:
+            continue
         child = item.children[child_id]
         _logger.debug("Group child: %s %s", child_id, type(child))
         output.write(f'    <!-- child {child_id} -->\n')
         if isinstance(child, si.Group):
-            draw_group(child, output, anchor_pos)
+            draw_group(child, output, anchor_pos, simplify, styles, id_prefix, visible,
+                       precision=precision)
         elif isinstance(child, si.Line):
-            draw_stroke(child, output)
+            draw_stroke(child, output, simplify, styles, precision)
     output.write(f'    </g>\n')
 
 
-def draw_stroke(item: si.Line, output):
+def group_header(item: si.Group, anchor_x, anchor_y, id_prefix=""):
+    return f'    <g id="{id_prefix}{item.node_id}" transform="translate({xx(anchor_x)}, {yy(anchor_y)})">\n'
+
+
+class Segment(NamedTuple):
+    """Part of a stroke drawn with a single style.
+
+    `indices` are the indices in `item.points` of the points in the segment.
+    They include the last point of the previous segment, so that consecutive
+    segments join up.
+    """
+    color: str
+    width: float
+    opacity: float
+    indices: Sequence[int]
+
+
+def stroke_segments(item: si.Line, pen: Pen, simplify=None) -> Iterator[Segment]:
+    """Split the points of `item` into segments styled by `pen`.
+
+    Long strokes are styled with array operations by
+    `stroke_segments_array` when NumPy is available. Consecutive segments
+    with the same style are merged. If `simplify` is given, the points of
+    each segment are simplified with that tolerance.
+    """
+    points = packed_points(item.points)
+    if np is not None and len(points) >= VECTORIZE_MIN_POINTS:
+        segments = stroke_segments_array(points, pen)
+    else:
+        segments = stroke_segments_scalar(points, pen)
+    segments = merge_segments(segments)
+    if len(points) == 1:
+        # A dot: draw it as a line of zero length, which shows with round caps
+        segments = (segment._replace(indices=(0, 0)) for segment in segments)
+    if simplify:
+        segments = (
+            segment._replace(indices=simplify_indices(points, segment.indices, simplify))
+            for segment in segments
+        )
+    return segments
+
+
+def stroke_segments_scalar(points: PointArray, pen: Pen) -> Iterator[Segment]:
+    last_segment_width = segment_width = 0
+    for start in range(0, len(points), pen.segment_length):
+        point = points[start]
+        segment_color = pen.get_segment_color(point.speed, point.direction, point.width, point.pressure, last_segment_width)
+        segment_width = pen.get_segment_width(point.speed, point.direction, point.width, point.pressure, last_segment_width)
+        segment_opacity = pen.get_segment_opacity(point.speed, point.direction, point.width, point.pressure, last_segment_width)
+        last_segment_width = segment_width
+        # Join to previous segment
+        indices = range(max(start - 1, 0), min(start + pen.segment_length, len(points)))
+        yield Segment(segment_color, segment_width, segment_opacity, indices)
+
+
+def stroke_segments_array(points: PointArray, pen: Pen) -> Iterator[Segment]:
+    starts = range(0, len(points), pen.segment_length)
+    step = pen.segment_length
+    speed, direction, width, pressure = (
+        np.asarray(column[::step], dtype=float)
+        for column in (points.speed, points.direction, points.width, points.pressure)
+    )
+    widths = pen.get_segment_widths(speed, direction, width, pressure)
+    last_widths = np.concatenate(([0.0], widths[:-1]))
+    colors = pen.get_segment_colors(speed, direction, width, pressure, last_widths)
+    opacities = pen.get_segment_opacities(speed, direction, width, pressure, last_widths)
+    num_points = len(points)
+    length = pen.segment_length
+    for start, color, segment_width, opacity in zip(starts, colors, widths.tolist(), opacities):
+        # Join to previous segment
+        indices = range(max(start - 1, 0), min(start + length, num_points))
+        yield Segment(color, segment_width, opacity, indices)
+
+
+def merge_segments(segments: Iterable[Segment]) -> Iterator[Segment]:
+    """Merge consecutive segments that have the same style."""
+    current = None
+    for segment in segments:
+        if current is not None and segment[:3] == current[:3]:
+            current = current._replace(indices=_join_indices(current.indices, segment.indices))
+        else:
+            if current is not None:
+                yield current
+            current = segment
+    if current is not None:
+        yield current
+
+
+def _join_indices(first: Sequence[int], second: Sequence[int]) -> Sequence[int]:
+    # The second segment starts with the last point of the first
+    if (isinstance(first, range) and isinstance(second, range)
+            and first.step == second.step == 1 and second.start == first.stop - 1):
+        return range(first.start, second.stop)
+    return [*first, *second[1:]]
+
+
+def simplify_indices(points: PointArray, indices: Sequence[int], tolerance) -> Sequence[int]:
+    """Simplify a polyline using the Ramer-Douglas-Peucker algorithm.
+
+    Returns the subset of `indices` needed so that none of the other
+    `points` is further than `tolerance` (in screen pixels) from the
+    simplified line. The first and last points are always kept, so segment
+    boundaries are not changed.
+    """
+    if len(indices) < 3:
+        return indices
+    indices = list(indices)
+    keep = [False] * len(indices)
+    keep[0] = keep[-1] = True
+    tolerance_sq = tolerance * tolerance
+    xs, ys = points.x, points.y
+    stack = [(0, len(indices) - 1)]
+    while stack:
+        first, last = stack.pop()
+        x0, y0 = xs[indices[first]], ys[indices[first]]
+        dx = xs[indices[last]] - x0
+        dy = ys[indices[last]] - y0
+        length_sq = dx * dx + dy * dy
+        max_dist_sq = tolerance_sq
+        farthest = None
+        for i in range(first + 1, last):
+            x, y = xs[indices[i]], ys[indices[i]]
+            if length_sq == 0:
+                dist_sq = (x - x0) ** 2 + (y - y0) ** 2
+            else:
+                cross = dx * (y - y0) - dy * (x - x0)
+                dist_sq = cross * cross / length_sq
+            if dist_sq > max_dist_sq:
+                max_dist_sq = dist_sq
+                farthest = i
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [index for index, kept in zip(indices, keep) if kept]
+
+
+def format_points(item: si.Line) -> list[str]:
+    """Return the SVG coordinates of each point of `item`.
+
+    All the points are formatted in one go, and the segments of the stroke
+    then pick out the ones they need.
+    """
+    points = packed_points(item.points)
+    if np is not None and len(points) >= VECTORIZE_MIN_POINTS:
+        coords = np.empty(2 * len(points))
+        coords[0::2] = xx(np.asarray(points.x, dtype=float))
+        coords[1::2] = yy(np.asarray(points.y, dtype=float))
+        coords = coords.tolist()
+    else:
+        coords = [c for x, y in zip(points.x, points.y) for c in (xx(x), yy(y))]
+    return ("%.3f,%.3f \0" * len(points) % tuple(coords)).split("\0")[:-1]
+
+
+def grid_coords(item: si.Line, precision: int) -> tuple[list[int], list[int]]:
+    """Return the SVG x and y coordinates of the points of `item` as integers.
+
+    The coordinates are rounded to `precision` decimal places, and given in
+    units of that last place.
+    """
+    points = packed_points(item.points)
+    scale = 10 ** precision
+    if np is not None and len(points) >= VECTORIZE_MIN_POINTS:
+        return tuple(
+            np.rint(coord(np.asarray(column, dtype=float)) * scale).astype(np.int64).tolist()
+            for coord, column in ((xx, points.x), (yy, points.y))
+        )
+    return ([round(xx(x) * scale) for x in points.x],
+            [round(yy(y) * scale) for y in points.y])
+
+
+def path_data(xs: list[int], ys: list[int], indices: Sequence[int], precision: int) -> str:
+    """Return the `d` attribute of a path through the points at `indices`.
+
+    `xs` and `ys` are from `grid_coords`. The path moves to the first point
+    and then draws relative lines, which are shorter to write than absolute
+    coordinates. The steps are between rounded points, so rounding errors
+    don't build up along the stroke. Steps of zero are left out.
+    """
+    first, *rest = indices
+    steps = []
+    last_x, last_y = xs[first], ys[first]
+    for i in rest:
+        x, y = xs[i], ys[i]
+        if x != last_x or y != last_y:
+            steps += (x - last_x, y - last_y)
+            last_x, last_y = x, y
+    if rest and not steps:
+        # Keep a dot as a line of zero length, which is drawn with its caps
+        steps = [0, 0]
+    d = "M" + join_numbers((xs[first], ys[first]), precision)
+    return d + "l" + join_numbers(steps, precision) if steps else d
+
+
+def join_numbers(values: Iterable[int], precision: int) -> str:
+    """Write `values`, in units of `precision` decimal places, for a path.
+
+    Separators are only written where they are needed: a minus sign starts
+    a new number, as does a decimal point after a number that has one.
+    """
+    parts = []
+    last = ""
+    for value in values:
+        number = format_fixed(value, precision)
+        if last and number[0] != "-" and not (number[0] == "." and "." in last):
+            parts.append(" ")
+        parts.append(number)
+        last = number
+    return "".join(parts)
+
+
+@lru_cache(maxsize=4096)
+def format_fixed(value: int, precision: int) -> str:
+    """Format `value`, in units of `precision` decimal places, as briefly as possible.
+
+    Trailing zeros of the fraction and a leading zero before the point are
+    left out, so 1500 with precision 3 gives "1.5" and -50 gives "-.05".
+    """
+    if precision == 0:
+        return str(value)
+    sign = "-" if value < 0 else ""
+    whole, fraction = divmod(abs(value), 10 ** precision)
+    fraction = f"{fraction:0{precision}d}".rstrip("0")
+    if not fraction:
+        return f"{sign}{whole}"
+    return f"{sign}{whole or ''}.{fraction}"
+
+
+def select(values: list, indices: Sequence[int]) -> list:
+    """Return the elements of `values` at `indices`."""
+    if isinstance(indices, range) and indices.step == 1:
+        return values[indices.start:indices.stop]
+    return [values[i] for i in indices]
+
+
+def draw_stroke(item: si.Line, output, simplify=None, styles=None, precision=None):
+    """Write `item` as SVG polylines, one for each differently styled segment.
+
+    If `styles` is given, repeated styles are referenced as CSS classes from
+    it, otherwise they are all written inline. If `precision` is given,
+    paths are written instead; see `tree_to_svg`.
+    """
     _logger.debug("Writing line: %s", item)
 
+    with metrics.phase("draw_stroke"):
+        fragment = stroke_fragment(item, simplify, precision)
+        write_fragment(fragment, output, styles)
+
+    metrics.count("strokes", tool=item.tool.name)
+    metrics.count("points", len(item.points))
+    metrics.count("segments", len(fragment) - 1)
+
+
+def stroke_fragment(item: si.Line, simplify=None, precision=None) -> list:
+    """Return the fragment drawing `item`; see `write_fragment`."""
     # initiate the pen
     pen = Pen.create(item.tool.value, item.color.value, item.thickness_scale/10)
-    K = 5
+    K = STROKE_WIDTH_DIVISOR
 
     # BEGIN stroke
-    output.write(f'        <!-- Stroke tool: {item.tool.name} color: {item.color.name} thickness_scale: {item.thickness_scale} -->\n')
-    output.write('        <polyline ')
-    output.write(f'style="fill:none;stroke:{pen.stroke_color};stroke-width:{pen.stroke_width/K};opacity:{pen.stroke_opacity}" ')
-    output.write(f'stroke-linecap="{pen.stroke_linecap}" ')
-    output.write('points="')
-
-    last_xpos = -1.
-    last_ypos = -1.
-    last_segment_width = segment_width = 0
-    # Iterate through the point to form a polyline
-    for point_id, point in enumerate(item.points):
-        # align the original position
-        xpos = point.x
-        ypos = point.y
-        if point_id % pen.segment_length == 0:
-            segment_color = pen.get_segment_color(point.speed, point.direction, point.width, point.pressure, last_segment_width)
-            segment_width = pen.get_segment_width(point.speed, point.direction, point.width, point.pressure, last_segment_width)
-            segment_opacity = pen.get_segment_opacity(point.speed, point.direction, point.width, point.pressure, last_segment_width)
-            # print(segment_color, segment_width, segment_opacity, pen.stroke_linecap)
-            # UPDATE stroke
-            output.write('"/>\n')
-            output.write('        <polyline ')
-            output.write(f'style="fill:none; stroke:{segment_color} ;stroke-width:{segment_width/K:.3f};opacity:{segment_opacity}" ')
-            output.write(f'stroke-linecap="{pen.stroke_linecap}" ')
-            output.write('points="')
-            if last_xpos != -1.:
-                # Join to previous segment
-                output.write(f'{xx(last_xpos):.3f},{yy(last_ypos):.3f} ')
-        # store the last position
-        last_xpos = xpos
-        last_ypos = ypos
-        last_segment_width = segment_width
+    fragment = [f'        <!-- Stroke tool: {item.tool.name} color: {item.color.name} thickness_scale: {item.thickness_scale} -->\n']
+
+    if precision is None:
+        points = format_points(item)
+    else:
+        xs, ys = grid_coords(item, precision)
+    for segment in stroke_segments(item, pen, simplify):
+        style = (f"fill:none;stroke:{segment.color};stroke-width:{segment.width/K:.3f};"
+                 f"opacity:{segment.opacity};stroke-linecap:{pen.stroke_linecap}")
+        if precision is None:
+            fragment.append(("polyline", style, "".join(select(points, segment.indices))))
+        else:
+            fragment.append(("path", style, path_data(xs, ys, segment.indices, precision)))
+    return fragment
+
 
-        # BEGIN and END polyline segment
-        output.write(f'{xx(xpos):.3f},{yy(ypos):.3f} ')
+# The attribute holding the points of each kind of element in fragments
+POINTS_ATTRIBUTES = {"polyline": "points", "path": "d"}
 
-    # END stroke
-    output.write('" />\n')
+
+def write_fragment(fragment: list, output, styles=None):
+    """Write a fragment of SVG.
+
+    A fragment is a list of strings of SVG, and of `(element, style,
+    points)` tuples for polylines and paths. Styles are only turned into
+    attributes when written, since whether they are written inline or as
+    classes depends on what came before in the document.
+    """
+    parts = []
+    for piece in fragment:
+        if isinstance(piece, str):
+            parts.append(piece)
+        else:
+            element, style, points = piece
+            attribute = f'style="{style}"' if styles is None else styles.attribute(style)
+            parts.append(f'        <{element} {attribute} {POINTS_ATTRIBUTES[element]}="{points}"/>\n')
+    output.write("".join(parts))
+
+
+class FragmentCache:
+    """SVG fragments of strokes and groups, kept between exports.
+
+    Each stroke's fragment is stored under its id, pen and a digest of its
+    points, and each group's under its id, position and a digest of the keys
+    of its children, so anything that changes gets a new key. The digests
+    are the same in every process, so saved keys still match. Re-exporting a page
+    after a few strokes changed draws only those strokes, although every
+    stroke is still hashed. The `max_entries` most recently used fragments
+    are kept.
+
+    `save` and `load` keep the fragments in a file between runs.
+    """
+
+    # Changes whenever fragments or keys from different versions would
+    # not be interchangeable. Points are digested in the machine's byte order
+    FORMAT = f"4-{sys.byteorder}"
+
+    def __init__(self, max_entries=100_000):
+        self.fragments = OrderedDict()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        fragment = self.fragments.get(key)
+        if fragment is None:
+            self.misses += 1
+            metrics.count("fragments", result="miss")
+            return None
+        self.fragments.move_to_end(key)
+        self.hits += 1
+        metrics.count("fragments", result="hit")
+        return fragment
+
+    def put(self, key, fragment):
+        self.fragments[key] = fragment
+        self.fragments.move_to_end(key)
+        while len(self.fragments) > self.max_entries:
+            self.fragments.popitem(last=False)
+
+    def stroke_fragment(self, item_id, item: si.Line, simplify=None, precision=None):
+        """Return `(key, build)`, where `build()` returns the stroke's fragment."""
+        points = packed_points(item.points)
+        digest = _digest(column.tobytes() for column in points.columns())
+        key = (f"s{item_id}:{item.tool.value}:{item.color.value}:{item.thickness_scale}:"
+               f"{simplify}:{precision}:{len(points)}:{digest}")
+
+        def build():
+            fragment = self.get(key)
+            if fragment is None:
+                with metrics.phase("draw_stroke"):
+                    fragment = stroke_fragment(item, simplify, precision)
+                metrics.count("strokes", tool=item.tool.name)
+                metrics.count("points", len(item.points))
+                metrics.count("segments", len(fragment) - 1)
+                self.put(key, fragment)
+            return fragment
+
+        return key, build
+
+    def group_fragment(self, item: si.Group, anchor_pos, simplify=None, id_prefix="",
+                       visible=None, precision=None):
+        """Return `(key, build)`, where `build()` returns the group's fragment.
+
+        Fragments of groups whose children are filtered by `visible` are not
+        stored, though those of their strokes are.
+        """
+        with metrics.phase("anchors"):
+            anchor_x, anchor_y = group_anchor(item, anchor_pos)
+        header = group_header(item, anchor_x, anchor_y, id_prefix)
+        children = []
+        for child_id in sequence_ids(item.children):
+            if visible is not None and child_id not in visible:
+                continue
+            child = item.children[child_id]
+            if isinstance(child, si.Group):
+                child_key, child_build = self.group_fragment(
+                    child, anchor_pos, simplify, id_prefix, visible, precision)
+            elif isinstance(child, si.Line):
+                child_key, child_build = self.stroke_fragment(child_id, child, simplify, precision)
+            else:
+                child_key, child_build = "", list
+            children.append((child_id, child_key, child_build))
+        digest = _digest(child_key.encode() + b"\n" for _, child_key, _ in children)
+        key = f"g{header}:{digest}"
+
+        def build():
+            fragment = self.get(key) if visible is None else None
+            if fragment is None:
+                fragment = [header]
+                for child_id, _, child_build in children:
+                    fragment.append(f'    <!-- child {child_id} -->\n')
+                    fragment.extend(child_build())
+                fragment.append('    </g>\n')
+                if visible is None:
+                    self.put(key, fragment)
+            return fragment
+
+        return key, build
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"format": self.FORMAT, "fragments": list(self.fragments.items())}, f)
+
+    @classmethod
+    def load(cls, path, max_entries=100_000) -> "FragmentCache":
+        """Load the fragments saved in `path`, or start empty if there are none."""
+        cache = cls(max_entries)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return cache
+        if data.get("format") == cls.FORMAT:
+            for key, fragment in data["fragments"]:
+                cache.put(key, [p if isinstance(p, str) else tuple(p) for p in fragment])
+        return cache
+
+
+def _digest(parts: Iterable[bytes]) -> str:
+    # Unlike hash(), the same in every process
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class StyleClasses:
+    """Assigns CSS classes to styles that are used more than once.
+
+    The first element with a style has it written inline, since it may be
+    the only one. Later elements with the same style refer to a class
+    instead, and the classes are written at the end of the document.
+    """
+
+    def __init__(self):
+        # Class name (or None if only used once so far) for each style
+        self.classes = {}
+        self.num_classes = 0
+
+    def attribute(self, style: str) -> str:
+        """Return the SVG attribute that gives an element `style`."""
+        if style not in self.classes:
+            self.classes[style] = None
+            return f'style="{style}"'
+        name = self.classes[style]
+        if name is None:
+            name = self.classes[style] = f"s{self.num_classes}"
+            self.num_classes += 1
+        return f'class="{name}"'
+
+    def write(self, output):
+        """Write the classes as an SVG `<style>` element."""
+        classes = [(name, style) for style, name in self.classes.items() if name is not None]
+        if not classes:
+            return
+        output.write('    <style>\n')
+        for name, style in classes:
+            output.write(f'        .{name} {{ {style} }}\n')
+        output.write('    </style>\n')
 
 
 def draw_text(text: si.Text, output, anchor_pos):
@@ -220,19 +776,30 @@ def draw_text(text: si.Text, output, anchor_pos):
     </style>
     ''')
 
+    for fmt, line, ids, xpos, ypos in text_lines(text, anchor_pos):
+        cls = fmt.name.lower()
+        if line:
+            output.write(f'        <!-- Text line char_id: {ids[0]} -->\n')
+            output.write(f'        <text x="{xx(xpos)}" y="{yy(ypos)}" class="{cls}">{line.strip()}</text>\n')
+
+    output.write('    </g>\n')
+
+
+def text_lines(text: si.Text, anchor_pos):
+    """Yield `(fmt, line, ids, xpos, ypos)` for each line of `text`.
+
+    The y-coordinates of the characters are saved in `anchor_pos`, so that
+    groups anchored to them can be positioned.
+    """
     y_offset = TEXT_TOP_Y
-    for fmt, line, ids in text.formatted_lines_with_ids():
+    for fmt, line, ids in formatted_lines_with_ids(text):
         y_offset += LINE_HEIGHTS[fmt]
 
         xpos = text.pos_x
         ypos = text.pos_y + y_offset
-        cls = fmt.name.lower()
-        if line:
-            output.write(f'        <!-- Text line char_id: {ids[0]} -->\n')
-            output.write(f'        <text x="{xx(xpos)}" y="{yy(ypos)}" class="{cls}">{line.strip()}</text>\n')
 
         # Save y-coordinates of potential anchors
         for k in ids:
             anchor_pos[k] = ypos
 
-    output.write('    </g>\n')
+        yield fmt, line, ids, xpos, ypos
@@ -0,0 +1,179 @@
+"""Draw small PNG thumbnails of pages quickly.
+
+Thumbnails use the PNG rasterizer with less detail:
+
+- points closer together than an image pixel are dropped;
+- each stroke is drawn with a single style, taken from the pen at its
+  middle point, instead of one per segment, and all the strokes on the
+  page are rasterized together;
+- strokes too faint and thin to change any pixel noticeably are skipped;
+- text too small to read is drawn as grey bars.
+"""
+
+import logging
+
+from rmscene import SceneTree
+from rmscene import scene_items as si
+
+from .png import (
+    GLYPH_ROWS_PER_EM,
+    Canvas,
+    draw_segments,
+    draw_string,
+    write_png,
+)
+from .pdf import DEFAULT_TEXT_FONT, TEXT_FONTS
+from .points import packed_points
+from .svg import (
+    PAGE_WIDTH_PT,
+    STROKE_WIDTH_DIVISOR,
+    X_SHIFT,
+    Segment,
+    group_anchor,
+    group_children,
+    initial_anchor_pos,
+    text_lines,
+    xx,
+    yy,
+)
+from .writing_tools import Pen, np
+from .. import metrics
+
+_logger = logging.getLogger(__name__)
+
+
+DEFAULT_WIDTH = 200
+
+# Strokes whose opacity times width (in pixels, up to 1) is less than this
+# are not drawn
+MIN_VISIBLE_INK = 0.05
+
+# Thumbnails are small, so faster compression costs little space
+THUMBNAIL_COMPRESSION = 1
+
+# Colour of the bars standing in for unreadable text
+TEXT_BAR_COLOR = (0.6, 0.6, 0.6)
+
+
+def tree_to_thumbnail(tree: SceneTree, output, width=DEFAULT_WIDTH):
+    """Draw the scene tree as a PNG thumbnail `width` pixels wide."""
+    if np is None:
+        raise ImportError("PNG output requires NumPy; install rmc[fast]")
+    dpi = width / PAGE_WIDTH_PT * 72
+    canvas = Canvas(dpi)
+    anchor_pos = initial_anchor_pos()
+    if tree.root_text is not None:
+        with metrics.phase("text"):
+            draw_text(tree.root_text, canvas, anchor_pos)
+    strokes = []
+    collect_group(tree.root, canvas, anchor_pos, (X_SHIFT, 0.0), strokes, {})
+    with metrics.phase("draw_stroke"):
+        draw_strokes(strokes, canvas)
+    write_png(output, canvas.to_image(), dpi, level=THUMBNAIL_COMPRESSION)
+
+
+def collect_group(item: si.Group, canvas: Canvas, anchor_pos, origin, strokes, pens):
+    """Add the visible strokes in `item` to `strokes`, in drawing order.
+
+    Each is added as `(points, origin, segment)`. `pens` holds the pen for
+    each tool, colour and thickness, shared by the strokes drawn with it.
+    """
+    with metrics.phase("anchors"):
+        anchor_x, anchor_y = group_anchor(item, anchor_pos)
+    origin = (origin[0] + xx(anchor_x), origin[1] + yy(anchor_y))
+    for child in group_children(item):
+        if isinstance(child, si.Group):
+            collect_group(child, canvas, anchor_pos, origin, strokes, pens)
+        elif isinstance(child, si.Line):
+            metrics.count("strokes", tool=child.tool.name)
+            metrics.count("points", len(child.points))
+            if not child.points:
+                continue
+            key = (child.tool, child.color, child.thickness_scale)
+            pen = pens.get(key)
+            if pen is None:
+                pen = pens[key] = Pen.create(child.tool.value, child.color.value,
+                                             child.thickness_scale/10)
+            segment = stroke_style(child, pen)
+            if segment.opacity * min(segment.width / STROKE_WIDTH_DIVISOR * canvas.scale, 1) >= MIN_VISIBLE_INK:
+                strokes.append((packed_points(child.points), origin, segment))
+
+
+def draw_strokes(strokes, canvas: Canvas):
+    """Draw all the `(points, origin, segment)` strokes at once.
+
+    The points of all the strokes are moved to the image and thinned out
+    together, before any are drawn.
+    """
+    if not strokes:
+        return
+    lengths = np.array([len(points) for points, _, _ in strokes])
+    origins = np.repeat(np.array([origin for _, origin, _ in strokes]), lengths, axis=0)
+    x = np.concatenate([np.asarray(points.x, dtype=float) for points, _, _ in strokes])
+    y = np.concatenate([np.asarray(points.y, dtype=float) for points, _, _ in strokes])
+    x = (origins[:, 0] + xx(x) - canvas.left) * canvas.scale
+    y = (origins[:, 1] + yy(y) - canvas.top) * canvas.scale
+
+    starts = np.cumsum(lengths) - lengths
+    indices = pixel_indices(x, y, starts)
+    segments = []
+    for (_, _, segment), stroke_indices in zip(strokes, np.split(indices, np.searchsorted(indices, starts[1:]))):
+        if len(stroke_indices) < 2:
+            # A dot: draw it as a line of zero length
+            stroke_indices = np.repeat(stroke_indices, 2)
+        segments.append(segment._replace(indices=stroke_indices))
+    metrics.count("segments", len(segments))
+    draw_segments(x, y, segments, canvas)
+
+
+def stroke_style(item: si.Line, pen: Pen) -> Segment:
+    """Return the style of `pen` at the middle of `item`, with no points."""
+    p = item.points[len(item.points) // 2]
+    args = (p.speed, p.direction, p.width, p.pressure, pen.base_width)
+    return Segment(pen.get_segment_color(*args), pen.get_segment_width(*args),
+                   pen.get_segment_opacity(*args), [])
+
+
+def pixel_indices(x, y, starts=(0,)):
+    """Return the indices of the points that move to a different pixel.
+
+    The points are of strokes beginning at the indices `starts`. The first
+    and last points of each stroke are always kept.
+    """
+    px = np.floor(x).astype(np.int64)
+    py = np.floor(y).astype(np.int64)
+    moved = np.ones(len(px), dtype=bool)
+    moved[1:] = (px[1:] != px[:-1]) | (py[1:] != py[:-1])
+    moved[starts] = True
+    moved[np.asarray(starts[1:], dtype=np.int64) - 1] = True
+    moved[-1] = True
+    return np.flatnonzero(moved)
+
+
+def draw_text(text: si.Text, canvas: Canvas, anchor_pos):
+    for fmt, line, ids, xpos, ypos in text_lines(text, anchor_pos):
+        line = line.strip()
+        if not line:
+            continue
+        _, size = TEXT_FONTS.get(fmt, DEFAULT_TEXT_FONT)
+        x, y = X_SHIFT + xx(xpos), yy(ypos)
+        if size / GLYPH_ROWS_PER_EM * canvas.scale >= 1:
+            draw_string(canvas, line, x, y, size, bold=fmt == si.TextFormat.BOLD)
+        else:
+            draw_text_bar(canvas, len(line), x, y, size)
+
+
+def draw_text_bar(canvas: Canvas, num_chars, x, y, size):
+    """Draw a bar covering roughly where `num_chars` characters would be."""
+    s = canvas.scale
+    x -= canvas.left
+    y -= canvas.top
+    col0 = max(int(x * s), 0)
+    col1 = min(int(np.ceil((x + num_chars * size * 0.5) * s)), canvas.width)
+    row0 = max(int((y - size * 0.5) * s), 0)
+    row1 = min(max(int(np.ceil(y * s)), row0 + 1), canvas.height)
+    if col0 >= col1 or row0 >= row1:
+        return
+    rows, cols = np.mgrid[row0:row1, col0:col1]
+    pixels = (rows * canvas.width + cols).ravel()
+    canvas.blend(pixels, np.ones(len(pixels)), TEXT_BAR_COLOR)
@@ -7,6 +7,11 @@ https://github.com/chemag/maxio .
 import logging
 import math
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 _logger = logging.getLogger(__name__)
 
 
@@ -80,6 +85,39 @@ class Pen:
         value = 0 if value < 0 else value
         return value
 
+    # Array versions of the methods above, used to style all the segments of
+    # a stroke at once when NumPy is available. The arguments are arrays of
+    # the point values at the start of each segment. The default
+    # implementations call the scalar methods one segment at a time, so
+    # subclasses only need to override them for speed.
+
+    def get_segment_widths(self, speed, direction, width, pressure):
+        """Return an array of segment widths.
+
+        Each width may depend on the one before, so this has no `last_width`
+        argument.
+        """
+        if type(self).get_segment_width is Pen.get_segment_width:
+            return np.full(len(speed), self.base_width, dtype=float)
+        widths = np.empty(len(speed))
+        last_width = 0
+        for i, args in enumerate(zip(speed.tolist(), direction.tolist(),
+                                     width.tolist(), pressure.tolist())):
+            widths[i] = last_width = self.get_segment_width(*args, last_width)
+        return widths
+
+    def get_segment_colors(self, speed, direction, width, pressure, last_width):
+        """Return a list of segment colors."""
+        if type(self).get_segment_color is Pen.get_segment_color:
+            return [self.get_segment_color(0, 0, 0, 0, 0)] * len(speed)
+        return [self.get_segment_color(*args) for args in _scalars(speed, direction, width, pressure, last_width)]
+
+    def get_segment_opacities(self, speed, direction, width, pressure, last_width):
+        """Return a list of segment opacities."""
+        if type(self).get_segment_opacity is Pen.get_segment_opacity:
+            return [self.base_opacity] * len(speed)
+        return [self.get_segment_opacity(*args) for args in _scalars(speed, direction, width, pressure, last_width)]
+
     @classmethod
     def create(cls, pen_nr, color_id, width):
         # print(f'----> create(cls, pen_nr: {pen_nr}, color_id: {color_id}, width: {width})')
@@ -143,6 +181,15 @@ class Ballpoint(Pen):
         segment_color = [int(abs(intensity - 1) * 255)] * 3
         return "rgb"+str(tuple(segment_color))
 
+    def get_segment_widths(self, speed, direction, width, pressure):
+        return (0.5 + pressure / 255) + (1 * width / 4) - 0.5*((speed / 4)/50)
+
+    def get_segment_colors(self, speed, direction, width, pressure, last_width):
+        intensity = (0.1 * - ((speed / 4) / 35)) + (1.2 * pressure / 255) + 0.5
+        intensity = np.clip(intensity, 0, 1)
+        gray = (np.abs(intensity - 1) * 255).astype(int).tolist()
+        return [f"rgb({c}, {c}, {c})" for c in gray]
+
     # def get_segment_opacity(self, speed, direction, width, pressure, last_width):
     #     segment_opacity = (0.2 * - ((speed / 4) / 35)) + (0.8 * pressure / 255)
     #     segment_opacity *= segment_opacity
@@ -160,6 +207,9 @@ class Marker(Pen):
         segment_width = 0.9 * ((width / 4) - 0.4 * self.direction_to_tilt(direction)) + (0.1 * last_width)
         return segment_width
 
+    def get_segment_widths(self, speed, direction, width, pressure):
+        return _decaying_sum(0.9 * ((width / 4) - 0.4 * self.direction_to_tilt(direction)), 0.1)
+
 
 class Pencil(Pen):
     def __init__(self, base_width, base_color_id):
@@ -179,6 +229,14 @@ class Pencil(Pen):
         segment_opacity = self.cutoff(segment_opacity) - 0.1
         return segment_opacity
 
+    def get_segment_widths(self, speed, direction, width, pressure):
+        segment_width = 0.7 * ((((0.8*self.base_width) + (0.5 * pressure / 255)) * (width / 4)) - (0.25 * self.direction_to_tilt(direction)**1.8) - (0.6 * (speed / 4) / 50))
+        return np.minimum(segment_width, self.base_width * 10)
+
+    def get_segment_opacities(self, speed, direction, width, pressure, last_width):
+        segment_opacity = (0.1 * - ((speed / 4) / 35)) + (1 * pressure / 255)
+        return (np.clip(segment_opacity, 0, 1) - 0.1).tolist()
+
 
 class Mechanical_Pencil(Pen):
     def __init__(self, base_width, base_color_id):
@@ -212,6 +270,15 @@ class Brush(Pen):
 
         return "rgb"+str(tuple(segment_color))
 
+    def get_segment_widths(self, speed, direction, width, pressure):
+        return 0.7 * (((1 + (1.4 * pressure / 255)) * (width / 4)) - (0.5 * self.direction_to_tilt(direction)) - ((speed / 4) / 50))
+
+    def get_segment_colors(self, speed, direction, width, pressure, last_width):
+        intensity = ((pressure / 255) ** 1.5 - 0.2 * ((speed / 4) / 50)) * 1.5
+        rev_intensity = np.abs(np.clip(intensity, 0, 1) - 1)
+        channels = [(rev_intensity * (255 - c)).astype(int).tolist() for c in self.base_color]
+        return [f"rgb({r}, {g}, {b})" for r, g, b in zip(*channels)]
+
 
 class Highlighter(Pen):
     def __init__(self, base_width, base_color_id):
@@ -247,3 +314,28 @@ class Caligraphy(Pen):
     def get_segment_width(self, speed, direction, width, pressure, last_width):
         segment_width = 0.9 * (((1 + pressure / 255) * (width / 4)) - 0.3 * self.direction_to_tilt(direction)) + (0.1 * last_width)
         return segment_width
+
+    def get_segment_widths(self, speed, direction, width, pressure):
+        return _decaying_sum(0.9 * (((1 + pressure / 255) * (width / 4)) - 0.3 * self.direction_to_tilt(direction)), 0.1)
+
+
+def _scalars(*arrays):
+    """Iterate over the rows of `arrays` as Python scalars."""
+    return zip(*(a.tolist() for a in arrays))
+
+
+def _decaying_sum(values, factor):
+    """Return `result[i] = values[i] + factor * result[i - 1]` for all `i`.
+
+    This is the recurrence used by pens whose width depends on the last
+    width. For `abs(factor) < 1` older terms soon become negligible, so it
+    is summed in a fixed number of array operations.
+    """
+    result = values.astype(float)
+    coeff = 1.0
+    for k in range(1, len(values)):
+        coeff *= factor
+        if abs(coeff) < 1e-17:
+            break
+        result[k:] += coeff * values[:-k]
+    return result
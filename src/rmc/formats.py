@@ -0,0 +1,118 @@
+"""The formats rm files can be converted to.
+
+Each format names the function that writes it as "module:function", and the
+module is only imported when the format is used, so that starting `rmc`
+doesn't load every exporter (and NumPy) just to print some text.
+
+Other packages can add formats through the `rmc.formats` entry point group.
+The entry point's name is the format name, and it refers to a `Format`:
+
+    [project.entry-points."rmc.formats"]
+    json = "rmc_json:FORMAT"
+
+Converters are called as `converter(f, fout, **options)`, where `f` is the
+rm file opened in binary mode, `fout` the output stream, and `options` the
+conversion options from the command line (`simplify`, `bbox`, `dpi`,
+`precision` and so on). They should accept and ignore options they don't use.
+"""
+
+from importlib import import_module
+from typing import Callable, NamedTuple, Optional, Union
+
+ENTRY_POINT_GROUP = "rmc.formats"
+
+
+class Format(NamedTuple):
+    name: str
+    # The converter, or "module:function" to import it from
+    converter: Union[str, Callable]
+    # Filename suffixes of the format; the first is used for output files
+    suffixes: tuple = ()
+    # Whether the output is bytes rather than text
+    binary: bool = False
+
+
+class UnknownFormat(ValueError):
+    pass
+
+
+BUILTIN_FORMATS = {
+    fmt.name: fmt for fmt in [
+        Format("svg", "rmc.exporters.svg:convert_svg", (".svg",)),
+        Format("svgz", "rmc.exporters.svg:convert_svgz", (".svgz",), binary=True),
+        Format("pdf", "rmc.exporters.pdf:convert_pdf", (".pdf",), binary=True),
+        Format("png", "rmc.exporters.png:convert_png", (".png",), binary=True),
+        Format("markdown", "rmc.exporters.markdown:convert_markdown", (".md", ".markdown")),
+        Format("blocks", "rmc.exporters.blocks:convert_blocks", (".txt",)),
+        Format("blocks-data", "rmc.exporters.blocks:convert_blocks_data", (".txt",)),
+        Format("tree", "rmc.exporters.blocks:convert_tree", (".txt",)),
+        Format("tree-data", "rmc.exporters.blocks:convert_tree_data", (".txt",)),
+        Format("blocks-json", "rmc.exporters.blocks:convert_blocks_json", (".ndjson", ".jsonl")),
+        Format("tree-json", "rmc.exporters.blocks:convert_tree_json", (".ndjson", ".jsonl")),
+    ]
+}
+
+_plugins = None
+
+
+def plugin_formats() -> dict:
+    """Return the formats added by other packages, loading them the first time."""
+    global _plugins
+    if _plugins is None:
+        from importlib.metadata import entry_points
+
+        _plugins = {}
+        for ep in entry_points(group=ENTRY_POINT_GROUP):
+            if ep.name not in BUILTIN_FORMATS:
+                _plugins[ep.name] = ep.load()._replace(name=ep.name)
+    return _plugins
+
+
+def get_format(name: str) -> Format:
+    """Return the format called `name`.
+
+    Entry points are only looked at if `name` is not a built-in format.
+    """
+    fmt = BUILTIN_FORMATS.get(name) or plugin_formats().get(name)
+    if fmt is None:
+        raise UnknownFormat("Unknown format %s" % name)
+    return fmt
+
+
+def available_formats() -> list[str]:
+    return list(BUILTIN_FORMATS) + list(plugin_formats())
+
+
+def format_for_suffix(suffix: str) -> Optional[Format]:
+    """Return the first format with filename suffix `suffix`, if any."""
+    for fmt in BUILTIN_FORMATS.values():
+        if suffix in fmt.suffixes:
+            return fmt
+    for fmt in plugin_formats().values():
+        if suffix in fmt.suffixes:
+            return fmt
+    return None
+
+
+def load_converter(name: str) -> Callable:
+    """Import and return the converter for format `name`."""
+    converter = get_format(name).converter
+    if isinstance(converter, str):
+        module_name, _, function_name = converter.partition(":")
+        converter = getattr(import_module(module_name), function_name)
+    return converter
+
+
+def output_suffix(name: str) -> str:
+    """Return the filename suffix for output files in format `name`."""
+    try:
+        suffixes = get_format(name).suffixes
+    except UnknownFormat:
+        suffixes = ()
+    return suffixes[0] if suffixes else "." + name
+
+
+def is_binary_format(name: str) -> bool:
+    if name == "rm":
+        return True
+    return get_format(name).binary
@@ -0,0 +1,162 @@
+"""Optional timing and counting of the phases of a conversion.
+
+Collection is off by default, when `phase` and `count` do nothing, so they
+can be left in the exporters at almost no cost. `enable` starts collecting
+into a `Metrics` object, which can be written as JSON or in the Prometheus
+text format.
+"""
+
+import json
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class Metrics:
+    """Wall and CPU time per phase, and counters with optional labels."""
+
+    def __init__(self):
+        # name -> [wall seconds, cpu seconds, calls]
+        self.phases = defaultdict(lambda: [0.0, 0.0, 0])
+        # (name, sorted label items) -> value
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def phase(self, name):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            totals = self.phases[name]
+            totals[0] += time.perf_counter() - wall
+            totals[1] += time.process_time() - cpu
+            totals[2] += 1
+
+    def count(self, name, value=1, **labels):
+        self.counters[name, tuple(sorted(labels.items()))] += value
+
+    def to_dict(self) -> dict:
+        counters = {}
+        for (name, labels), value in sorted(self.counters.items()):
+            if labels:
+                counters.setdefault(name, {})[",".join(f"{k}={v}" for k, v in labels)] = value
+            else:
+                counters[name] = value
+        return {
+            "phases": {
+                name: {"wall_s": wall, "cpu_s": cpu, "calls": calls}
+                for name, (wall, cpu, calls) in self.phases.items()
+            },
+            "counters": counters,
+            "peak_memory_bytes": peak_memory(),
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self) -> str:
+        lines = [
+            "# TYPE rmc_phase_wall_seconds gauge",
+            "# TYPE rmc_phase_cpu_seconds gauge",
+            "# TYPE rmc_phase_calls gauge",
+        ]
+        for name, (wall, cpu, calls) in self.phases.items():
+            lines.append(f'rmc_phase_wall_seconds{{phase="{name}"}} {wall}')
+            lines.append(f'rmc_phase_cpu_seconds{{phase="{name}"}} {cpu}')
+            lines.append(f'rmc_phase_calls{{phase="{name}"}} {calls}')
+        last_name = None
+        for (name, labels), value in sorted(self.counters.items()):
+            if name != last_name:
+                lines.append(f"# TYPE rmc_{name}_total counter")
+                last_name = name
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"rmc_{name}_total{{{label_text}}} {value}"
+                         if labels else f"rmc_{name}_total {value}")
+        peak = peak_memory()
+        if peak is not None:
+            lines.append("# TYPE rmc_peak_memory_bytes gauge")
+            lines.append(f"rmc_peak_memory_bytes {peak}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """Return a human-readable summary."""
+        lines = [f"{'phase':<14} {'wall (ms)':>10} {'cpu (ms)':>10} {'calls':>8}"]
+        for name, (wall, cpu, calls) in self.phases.items():
+            lines.append(f"{name:<14} {wall * 1000:>10.2f} {cpu * 1000:>10.2f} {calls:>8}")
+        for name, value in self.to_dict()["counters"].items():
+            lines.append(f"{name}: {value}")
+        peak = peak_memory()
+        if peak is not None:
+            lines.append(f"peak memory: {peak / 1024 / 1024:.1f} MB")
+        return "\n".join(lines)
+
+
+def peak_memory():
+    """Return the peak resident memory of this process in bytes, if known."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+_active = None
+_no_phase = nullcontext()
+
+
+def enable() -> Metrics:
+    """Start collecting metrics, returning the object they are collected in."""
+    global _active
+    _active = Metrics()
+    return _active
+
+
+def disable():
+    global _active
+    _active = None
+
+
+def enabled() -> bool:
+    return _active is not None
+
+
+def phase(name):
+    """Context manager timing the code inside it as phase `name`."""
+    if _active is None:
+        return _no_phase
+    return _active.phase(name)
+
+
+def count(name, value=1, **labels):
+    """Add `value` to the counter `name`."""
+    if _active is not None:
+        _active.count(name, value, **labels)
+
+
+class CountingWriter:
+    """Wraps a file object, counting the bytes written to it.
+
+    Text is counted in the file's encoding (UTF-8 if it has none), so the
+    count is of the bytes it becomes.
+    """
+
+    def __init__(self, f, name="output_bytes"):
+        self._f = f
+        self._name = name
+
+    def write(self, data):
+        if isinstance(data, str) and not data.isascii():
+            count(self._name, len(data.encode(getattr(self._f, "encoding", None) or "utf-8")))
+        else:
+            count(self._name, len(data))
+        return self._f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
@@ -0,0 +1,165 @@
+"""Export whole xochitl notebooks, re-rendering only the pages that changed.
+
+A notebook is stored by xochitl as `<uuid>.content` (which gives the page
+order), `<uuid>.metadata`, and a directory `<uuid>/` holding a `<page>.rm`
+file for each page that has content.
+
+The output directory holds one file per page, named after the page id, and a
+manifest recording the size, modification time and hash of each page's `.rm`
+file when it was exported. Pages whose file is unchanged keep their earlier
+output.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from .batch import convert_batch, output_path
+
+_logger = logging.getLogger(__name__)
+
+
+MANIFEST_NAME = ".rmc-manifest.json"
+
+
+class NotebookResult(NamedTuple):
+    # Output files in page order
+    outputs: list
+    rendered: list
+    reused: list
+    removed: list
+    errors: dict
+
+
+def notebook_paths(path: Path) -> tuple[Path, Path]:
+    """Return the `.content` file and page directory for a notebook.
+
+    `path` may be any of the `.content` or `.metadata` files or the page
+    directory.
+    """
+    path = Path(path)
+    base = path.with_suffix("") if path.suffix in (".content", ".metadata") else path
+    return base.with_name(base.name + ".content"), base
+
+
+def notebook_page_ids(content_path: Path) -> list[str]:
+    """Return the ids of the pages of a notebook in order."""
+    return content_page_ids(json.loads(Path(content_path).read_text()))
+
+
+def content_page_ids(content: dict) -> list[str]:
+    """Return the ids of the pages in order, given a notebook's `.content`."""
+    if "cPages" in content:
+        # Newer format: pages are ordered by their "idx" value, and deleted
+        # pages are kept with a "deleted" marker.
+        pages = [p for p in content["cPages"]["pages"] if "deleted" not in p]
+        pages.sort(key=lambda p: p["idx"]["value"])
+        return [p["id"] for p in pages]
+    return list(content.get("pages", []))
+
+
+def _file_hash(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def export_notebook(path: Path, to: str, out_dir: Path,
+                    jobs: Optional[int] = 1, **options) -> NotebookResult:
+    """Export each page of the notebook at `path` to format `to` in `out_dir`.
+
+    Only pages that were added or changed since the last export to `out_dir`
+    with the same format and options are converted. The outputs of pages
+    that were deleted or cleared since are removed, as are those written in
+    another format. `jobs` and `options` are passed to `convert_batch`.
+    """
+    content_path, pages_dir = notebook_paths(path)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = out_dir / MANIFEST_NAME
+
+    # The cache doesn't affect the output
+    settings = {"to": to, "options": {k: v for k, v in options.items() if k != "cache"}}
+    try:
+        manifest = json.loads(manifest_path.read_text())
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+    previous_settings = manifest.get("settings") or {}
+    previous_pages = manifest.get("pages", {})
+    if json.dumps(previous_settings, sort_keys=True, default=str) != \
+            json.dumps(settings, sort_keys=True, default=str):
+        # Different format or options: nothing can be reused
+        old_pages = {}
+    else:
+        old_pages = previous_pages
+
+    page_ids = notebook_page_ids(content_path)
+    # Pages with content, which have an output
+    current = set()
+    pages = {}
+    outputs = []
+    to_render = []
+    reused = []
+    for page_id in page_ids:
+        rm_path = pages_dir / f"{page_id}.rm"
+        try:
+            st = rm_path.stat()
+        except FileNotFoundError:
+            # Blank pages have no .rm file
+            continue
+        current.add(page_id)
+        out_path = output_path(rm_path, to, out_dir)
+        outputs.append(out_path)
+        entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        old = old_pages.get(page_id)
+        if old is not None and out_path.exists():
+            if old["size"] == entry["size"] and old["mtime_ns"] == entry["mtime_ns"]:
+                pages[page_id] = old
+                reused.append(out_path)
+                continue
+            # Touched but maybe not changed: check the contents
+            entry["hash"] = _file_hash(rm_path)
+            if old.get("hash") == entry["hash"]:
+                pages[page_id] = entry
+                reused.append(out_path)
+                continue
+        pages[page_id] = entry
+        to_render.append(rm_path)
+
+    errors = {}
+    rendered = []
+    if to_render:
+        for result in convert_batch(to_render, to, out_dir, jobs, **options):
+            if result.error is None:
+                rendered.append(result.output)
+                entry = pages[result.input.stem]
+                if "hash" not in entry:
+                    entry["hash"] = _file_hash(result.input)
+            else:
+                errors[result.input] = result.error
+                # Try again next time
+                del pages[result.input.stem]
+
+    # Remove outputs of pages that were deleted or cleared, and those
+    # written in another format
+    removed = []
+    previous_to = previous_settings.get("to", to)
+    for page_id in previous_pages:
+        rm_path = pages_dir / f"{page_id}.rm"
+        out_path = output_path(rm_path, previous_to, out_dir)
+        if page_id in current and out_path == output_path(rm_path, to, out_dir):
+            continue
+        if out_path.exists():
+            out_path.unlink()
+            removed.append(out_path)
+
+    tmp_path = manifest_path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps({"settings": settings, "pages": pages},
+                                   indent=1, default=str))
+    os.replace(tmp_path, manifest_path)
+
+    _logger.info("Notebook %s: %d pages rendered, %d reused, %d removed",
+                 pages_dir.name, len(rendered), len(reused), len(removed))
+    outputs = [p for p in outputs if p.exists()]
+    return NotebookResult(outputs, rendered, reused, removed, errors)
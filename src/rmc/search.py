@@ -0,0 +1,311 @@
+"""Full-text search of the text and highlights in a library of rm files.
+
+The index is an SQLite database with an FTS5 table of the lines of typed
+text and the highlights of each page, found as for markdown export. Each
+entry records its document, page and the position of the text: the ids of
+the first and last characters of typed text, and the start and end
+offsets of highlights in the document's text.
+
+Updating the index only reads the files that changed since the last pass,
+judged by their size and modification time and, if those changed, a hash
+of their contents. The document, title and page number of unchanged files
+are still brought up to date. Files that have gone are removed from the
+index.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+
+from .notebook import notebook_page_ids, notebook_paths
+
+_logger = logging.getLogger(__name__)
+
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    document TEXT NOT NULL,
+    title TEXT,
+    page TEXT NOT NULL,
+    page_number INTEGER,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE TABLE entries (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    start TEXT,
+    end TEXT,
+    text TEXT NOT NULL
+);
+CREATE INDEX entries_file ON entries(file_id);
+CREATE VIRTUAL TABLE entries_fts USING fts5(text, content='entries', content_rowid='id');
+CREATE TRIGGER entries_insert AFTER INSERT ON entries BEGIN
+    INSERT INTO entries_fts(rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER entries_delete AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_fts(entries_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+
+# Files are committed in batches of this many
+COMMIT_EVERY = 100
+
+
+class PageFile(NamedTuple):
+    path: Path
+    # Notebook id, or the file's path for loose rm files
+    document: str
+    title: Optional[str]
+    page: str
+    # Position of the page in its notebook, from 1
+    page_number: Optional[int]
+
+
+class Entry(NamedTuple):
+    # "text" or "highlight"
+    kind: str
+    # Line number of typed text, or number of the highlight, from 1
+    line: int
+    # "part1:part2" character ids of typed text, or offsets of highlights
+    start: Optional[str]
+    end: Optional[str]
+    text: str
+
+
+class SearchHit(NamedTuple):
+    path: str
+    document: str
+    title: Optional[str]
+    page: str
+    page_number: Optional[int]
+    kind: str
+    line: int
+    start: Optional[str]
+    end: Optional[str]
+    text: str
+    # The matching part of the text, with matches in [brackets]
+    snippet: str
+
+
+class UpdateResult(NamedTuple):
+    indexed: list
+    unchanged: list
+    removed: list
+    errors: dict
+
+
+def _char_id(char_id) -> str:
+    return f"{char_id.part1}:{char_id.part2}"
+
+
+def page_entries(f) -> list[Entry]:
+    """Return the lines of text and the highlights in the rm file `f`."""
+    from rmscene import scene_items as si
+
+    from .exporters.crdt import formatted_lines_with_ids
+    from .exporters.markdown import read_text_tree, walk_items
+
+    tree = read_text_tree(f)
+    entries = []
+    if tree.root_text is not None:
+        for number, (_, line, ids) in enumerate(formatted_lines_with_ids(tree.root_text), 1):
+            text = line.strip()
+            if text:
+                entries.append(Entry("text", number, _char_id(ids[0]), _char_id(ids[-1]), text))
+    number = 0
+    for item in walk_items(tree.root):
+        if isinstance(item, si.GlyphRange) and item.text.strip():
+            number += 1
+            entries.append(Entry("highlight", number, str(item.start),
+                                 str(item.start + item.length), item.text.strip()))
+    return entries
+
+
+def _notebook_title(content_path: Path) -> Optional[str]:
+    try:
+        metadata = json.loads(content_path.with_suffix(".metadata").read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+    return metadata.get("visibleName")
+
+
+def notebook_files(path: Path) -> Iterable[PageFile]:
+    """Yield the page files of the notebook at `path`, in page order."""
+    content_path, pages_dir = notebook_paths(path)
+    title = _notebook_title(content_path)
+    for number, page_id in enumerate(notebook_page_ids(content_path), 1):
+        rm_path = pages_dir / f"{page_id}.rm"
+        if rm_path.exists():
+            yield PageFile(rm_path.resolve(), pages_dir.name, title, page_id, number)
+
+
+def library_files(paths: Iterable[Path]) -> Iterable[PageFile]:
+    """Yield the page files in `paths`.
+
+    Each path may be an rm file, a notebook's `.content` file, or a
+    directory. Directories holding `.content` files are read as a xochitl
+    library of notebooks; otherwise all the rm files under them are used.
+    """
+    for path in map(Path, paths):
+        if path.is_dir():
+            notebooks = sorted(path.glob("*.content"))
+            if notebooks:
+                for content_path in notebooks:
+                    yield from notebook_files(content_path)
+            else:
+                for rm_path in sorted(path.rglob("*.rm")):
+                    yield PageFile(rm_path.resolve(), str(rm_path.resolve()), None, rm_path.stem, None)
+        elif path.suffix in (".content", ".metadata"):
+            yield from notebook_files(path)
+        else:
+            yield PageFile(path.resolve(), str(path.resolve()), None, path.stem, None)
+
+
+def _file_hash(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+class SearchIndex:
+    """An SQLite full-text index of the rm files in a library, at `db_path`."""
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(db_path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self._create()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def _create(self):
+        """Create the tables, dropping any from another version of the schema."""
+        with self.db:
+            for (name,) in self.db.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' "
+                    "AND name NOT LIKE 'sqlite_%'").fetchall():
+                # Shadow tables of FTS tables go with them
+                self.db.execute(f'DROP TABLE IF EXISTS "{name}"')
+            self.db.executescript(SCHEMA)
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def update(self, paths: Iterable[Path]) -> UpdateResult:
+        """Index the files in `paths` that changed since they were last indexed.
+
+        Indexed files under `paths` that no longer exist are removed.
+        """
+        paths = [Path(p).resolve() for p in paths]
+        indexed, unchanged, errors = [], [], {}
+        seen = set()
+        pending = 0
+        try:
+            for page_file in library_files(paths):
+                path = str(page_file.path)
+                seen.add(path)
+                try:
+                    changed = self._update_file(page_file)
+                except Exception as exc:
+                    _logger.debug("Failed to index %s", path, exc_info=True)
+                    errors[path] = f"{type(exc).__name__}: {exc}"
+                    continue
+                (indexed if changed else unchanged).append(path)
+                if changed:
+                    pending += 1
+                    if pending >= COMMIT_EVERY:
+                        self.db.commit()
+                        pending = 0
+            removed = self._remove_missing(paths, seen)
+        finally:
+            self.db.commit()
+        _logger.info("Indexed %d files, %d unchanged, %d removed",
+                     len(indexed), len(unchanged), len(removed))
+        return UpdateResult(indexed, unchanged, removed, errors)
+
+    def _update_file(self, page_file: PageFile) -> bool:
+        """Index `page_file` if it changed, returning whether it did."""
+        path = str(page_file.path)
+        st = page_file.path.stat()
+        row = self.db.execute(
+            "SELECT id, size, mtime_ns, hash, document, title, page_number FROM files "
+            "WHERE path = ?", (path,)).fetchone()
+        file_hash = None
+        if row is not None:
+            file_id, size, mtime_ns, old_hash, *metadata = row
+            # Pages can be reordered and notebooks renamed without touching
+            # the page's file
+            if metadata != [page_file.document, page_file.title, page_file.page_number]:
+                self.db.execute(
+                    "UPDATE files SET document = ?, title = ?, page_number = ? WHERE id = ?",
+                    (page_file.document, page_file.title, page_file.page_number, file_id))
+            if (size, mtime_ns) == (st.st_size, st.st_mtime_ns):
+                return False
+            # Touched but maybe not changed: check the contents
+            file_hash = _file_hash(page_file.path)
+            if file_hash == old_hash:
+                self.db.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE id = ?",
+                                (st.st_size, st.st_mtime_ns, file_id))
+                return False
+            self.db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+        data = page_file.path.read_bytes()
+        if file_hash is None:
+            file_hash = hashlib.sha256(data).hexdigest()
+        entries = page_entries(io.BytesIO(data))
+        cursor = self.db.execute(
+            "INSERT INTO files (path, document, title, page, page_number, size, mtime_ns, hash) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, page_file.document, page_file.title, page_file.page, page_file.page_number,
+             st.st_size, st.st_mtime_ns, file_hash))
+        self.db.executemany(
+            "INSERT INTO entries (file_id, kind, line, start, end, text) VALUES (?, ?, ?, ?, ?, ?)",
+            [(cursor.lastrowid, *entry) for entry in entries])
+        return True
+
+    def _remove_missing(self, paths, seen) -> list[str]:
+        """Remove the indexed files under `paths` that were not `seen`."""
+        removed = []
+        for root in paths:
+            prefix = str(root) if root.suffix not in (".content", ".metadata") else \
+                str(notebook_paths(root)[1])
+            rows = self.db.execute(
+                "SELECT id, path FROM files WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                (prefix, _like_prefix(prefix + "/"))).fetchall()
+            for file_id, path in rows:
+                if path not in seen:
+                    self.db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+                    removed.append(path)
+        return removed
+
+    def search(self, query: str, limit=20) -> list[SearchHit]:
+        """Return the entries best matching the FTS5 `query`."""
+        rows = self.db.execute(
+            "SELECT files.path, document, title, page, page_number, kind, line, start, end, "
+            "entries.text, snippet(entries_fts, 0, '[', ']', '...', 12) "
+            "FROM entries_fts JOIN entries ON entries.id = entries_fts.rowid "
+            "JOIN files ON files.id = entries.file_id "
+            "WHERE entries_fts MATCH ? ORDER BY rank LIMIT ?",
+            (query, limit)).fetchall()
+        return [SearchHit(*row) for row in rows]
+
+
+def _like_prefix(prefix: str) -> str:
+    escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
@@ -0,0 +1,533 @@
+"""Convert files in a long-running server, reached through a Unix socket.
+
+Starting `rmc` for every file means paying for the interpreter and the
+imports each time. `serve` instead keeps a pool of worker processes, with
+the exporters already imported, behind a Unix domain socket, and `Client`
+sends it conversion requests over a persistent connection. Each worker
+keeps a `FragmentCache`, so exporting an edited page to SVG again only
+draws the strokes that changed.
+
+Each message is a JSON header and a binary body, preceded by their lengths
+as two 4-byte big-endian integers. A request header has the output format
+`to`, the conversion `options`, an optional `timeout` in seconds and either
+the `path` of the rm file to convert or, if there is no path, the file's
+contents in the body. Paths are only accepted by a server given a `root`
+directory, and only for files under it. The response header has `ok`, and on success the
+output is the body; otherwise `error` has a `code` (one of `ERROR_CODES`), the
+exception `type` and a `message`.
+
+The server limits the number of conversions waiting for or running in the
+pool to `max_pending`. Requests beyond that wait for a free slot until their
+timeout, then fail as `busy`. A conversion still running at its timeout
+can't be cancelled, so the pool is replaced: new requests go to a new pool,
+and the old one's workers are killed once its other requests have had
+their time.
+
+The socket is created readable and writable by its owner only. On SIGINT or SIGTERM the server stops accepting connections,
+finishes the requests in progress and exits.
+"""
+
+import io
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from .formats import UnknownFormat, is_binary_format, load_converter
+
+_logger = logging.getLogger(__name__)
+
+
+DEFAULT_TIMEOUT = 60
+
+# Requests and responses larger than this are refused
+MAX_MESSAGE_SIZE = 1024 * 1024 * 1024
+
+ERROR_CODES = (
+    "bad_request",
+    "busy",
+    "timeout",
+    "conversion_failed",
+    "shutting_down",
+)
+
+_LENGTHS = struct.Struct(">II")
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class ServerError(Exception):
+    """A conversion request failed; `code` is one of `ERROR_CODES`."""
+
+    def __init__(self, code, type, message):
+        super().__init__(f"{code}: {type}: {message}")
+        self.code = code
+        self.type = type
+        self.message = message
+
+
+def send_message(sock, header: dict, body: bytes = b""):
+    head = json.dumps(header).encode("utf-8")
+    sock.sendall(_LENGTHS.pack(len(head), len(body)) + head + body)
+
+
+def recv_message(sock) -> Optional[tuple[dict, bytes]]:
+    """Read a `(header, body)` message from `sock`, or None at end of stream."""
+    lengths = _recv_exactly(sock, _LENGTHS.size, eof_ok=True)
+    if lengths is None:
+        return None
+    head_length, body_length = _LENGTHS.unpack(lengths)
+    if head_length + body_length > MAX_MESSAGE_SIZE:
+        raise ProtocolError(f"Message of {head_length + body_length} bytes is too large")
+    try:
+        header = json.loads(_recv_exactly(sock, head_length))
+    except ValueError as exc:
+        raise ProtocolError(f"Invalid message header: {exc}")
+    if not isinstance(header, dict):
+        raise ProtocolError("Message header must be a JSON object")
+    return header, _recv_exactly(sock, body_length)
+
+
+def _recv_exactly(sock, length, eof_ok=False):
+    buf = bytearray()
+    while len(buf) < length:
+        chunk = sock.recv(min(length - len(buf), 1024 * 1024))
+        if not chunk:
+            if eof_ok and not buf:
+                return None
+            raise ProtocolError("Connection closed in the middle of a message")
+        buf += chunk
+    return bytes(buf)
+
+
+# Fragments of SVG drawn by this worker process, reused by later requests
+_fragment_cache = None
+
+
+def warm_up(inherited=()):
+    """Import the exporters in a worker process before the first request.
+
+    `inherited` are the server's connections when the worker was forked,
+    which it closes so that the server sees when their clients disconnect.
+    """
+    global _fragment_cache
+    for fd in inherited:
+        os.close(fd)
+    for name in ("svg", "pdf", "png", "markdown"):
+        load_converter(name)
+    from .exporters.svg import FragmentCache
+    _fragment_cache = FragmentCache()
+
+
+def run_job(path, data, to, options) -> bytes:
+    """Convert the rm file at `path`, or with contents `data`, to `to`.
+
+    This runs in the worker processes.
+    """
+    converter = load_converter(to)
+    if to in ("svg", "svgz"):
+        options = dict(options, fragment_cache=_fragment_cache)
+    binary = is_binary_format(to)
+    out = io.BytesIO() if binary else io.StringIO()
+    if path is not None:
+        with open(path, "rb") as f:
+            converter(f, out, **options)
+    else:
+        converter(io.BytesIO(data), out, **options)
+    result = out.getvalue()
+    return result if binary else result.encode("utf-8")
+
+
+class RequestError(Exception):
+    def __init__(self, code, message, type=None):
+        super().__init__(message)
+        self.code = code
+        self.type = type or code
+
+    def header(self):
+        return {"ok": False, "error": {"code": self.code, "type": self.type, "message": str(self)}}
+
+
+def parse_request(header: dict, body: bytes, root=None):
+    """Return `(path, data, to, options, timeout)` for a request.
+
+    A `path` must be of a file under the directory `root`; without a
+    `root`, requests must send the file's contents instead.
+    """
+    to = header.get("to")
+    if not isinstance(to, str) or to == "rm":
+        raise RequestError("bad_request", "Request must give the output format 'to'")
+    try:
+        is_binary_format(to)
+    except UnknownFormat as exc:
+        raise RequestError("bad_request", str(exc))
+    options = header.get("options", {})
+    if not isinstance(options, dict):
+        raise RequestError("bad_request", "'options' must be an object")
+    if options.get("bbox") is not None:
+        bbox = options["bbox"]
+        if not (isinstance(bbox, list) and len(bbox) == 4
+                and all(isinstance(v, (int, float)) for v in bbox)):
+            raise RequestError("bad_request", "'bbox' must be four numbers")
+        options["bbox"] = tuple(bbox)
+    precision = options.get("precision")
+    if precision is not None and not (isinstance(precision, int) and precision >= 0):
+        raise RequestError("bad_request", "'precision' must be a whole number of decimal places")
+    timeout = header.get("timeout")
+    if timeout is not None and not isinstance(timeout, (int, float)):
+        raise RequestError("bad_request", "'timeout' must be a number")
+    path = header.get("path")
+    if path is not None:
+        path = resolve_path(path, root)
+    return path, (None if path is not None else body), to, options, timeout
+
+
+def resolve_path(path, root) -> str:
+    """Return the real path of the requested `path`, if it is under `root`."""
+    if root is None:
+        raise RequestError("bad_request", "This server only accepts file contents, not paths")
+    if not isinstance(path, str) or not os.path.isabs(path):
+        raise RequestError("bad_request", "'path' must be absolute")
+    # Symbolic links are followed before checking, so they can't lead out
+    path = os.path.realpath(path)
+    root = os.path.realpath(root)
+    if os.path.commonpath([path, root]) != root:
+        raise RequestError("bad_request", f"'path' must be under {root}")
+    return path
+
+
+class WorkerContext:
+    """A multiprocessing context that keeps the processes it starts.
+
+    `ProcessPoolExecutor` has no public way to reach its workers, so this
+    is its `mp_context`, giving the server the handles to kill them with.
+    """
+
+    def __init__(self, context):
+        self._context = context
+        self.processes = []
+
+    def __getattr__(self, name):
+        return getattr(self._context, name)
+
+    def Process(self, *args, **kwargs):
+        process = self._context.Process(*args, **kwargs)
+        self.processes.append(process)
+        return process
+
+
+class ConversionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve conversion requests with `jobs` worker processes.
+
+    Each connection is handled in its own thread.
+    """
+
+    daemon_threads = False
+    block_on_close = True
+
+    def __init__(self, socket_path, jobs, max_pending, timeout=DEFAULT_TIMEOUT, root=None):
+        self.jobs = jobs
+        self.timeout_s = timeout
+        self.root = root
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.closing = False
+        self.connections = set()
+        # The futures submitted to each pool and not yet done
+        self.in_flight = {}
+        # Pools replaced because of a stuck worker, and not yet stopped
+        self.retired = set()
+        # The worker processes of each pool
+        self.workers = {}
+        self.lock = threading.Lock()
+        super().__init__(socket_path, ConnectionHandler)
+        try:
+            self.pool = self._start_pool()
+        except BaseException:
+            super().server_close()
+            raise
+
+    def server_bind(self):
+        # Create the socket without permissions for anyone but the owner,
+        # rather than changing them once others could already connect
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def _start_pool(self):
+        # Called with the lock held, or before there are connections
+        inherited = ()
+        if multiprocessing.get_start_method() == "fork":
+            inherited = tuple(conn.fileno() for conn in self.connections)
+        context = WorkerContext(multiprocessing.get_context())
+        pool = ProcessPoolExecutor(max_workers=self.jobs, mp_context=context,
+                                   initializer=warm_up, initargs=(inherited,))
+        self.workers[pool] = context.processes
+        # Workers are started on demand; start them all now
+        for future in [pool.submit(int) for _ in range(self.jobs)]:
+            future.result()
+        self.in_flight[pool] = set()
+        return pool
+
+    def _replace_pool(self, broken):
+        """Start a new pool if a worker of `broken` died."""
+        with self.lock:
+            if self.pool is broken:
+                _logger.warning("A worker process died; restarting the pool")
+                broken.shutdown(wait=False)
+                self.in_flight.pop(broken, None)
+                self.workers.pop(broken, None)
+                self.pool = self._start_pool()
+
+    def _retire_pool(self, stuck):
+        """Replace the pool `stuck`, one of whose workers is stuck on a request.
+
+        Its other requests have until their own timeouts to finish, after
+        which its workers are killed.
+        """
+        with self.lock:
+            if self.pool is not stuck:
+                # Already replaced
+                return
+            _logger.warning("A conversion timed out; replacing the pool")
+            self.pool = self._start_pool()
+            others = set(self.in_flight.pop(stuck))
+            self.retired.add(stuck)
+        threading.Thread(target=self._stop_pool, args=(stuck, others), daemon=True).start()
+
+    def _stop_pool(self, pool, futures):
+        # Requests already sent to `pool` are all timed out by then
+        wait(futures, timeout=self.timeout_s)
+        with self.lock:
+            if pool not in self.retired:
+                # Stopped by server_close
+                return
+            self.retired.discard(pool)
+            workers = self.workers.pop(pool, ())
+        kill_pool(pool, workers)
+
+    def convert(self, header, body) -> bytes:
+        path, data, to, options, timeout = parse_request(header, body, self.root)
+        if self.closing:
+            raise RequestError("shutting_down", "The server is shutting down")
+        timeout = self.timeout_s if timeout is None else min(timeout, self.timeout_s)
+        deadline = time.monotonic() + timeout
+        if not self.slots.acquire(timeout=timeout):
+            raise RequestError("busy", f"No free worker within {timeout}s")
+        # The slot is released when the job finishes or times out, whichever
+        # is first
+        slot = threading.Lock()
+
+        def release_slot(_=None):
+            if slot.acquire(blocking=False):
+                self.slots.release()
+
+        with self.lock:
+            pool = self.pool
+            in_flight = self.in_flight[pool]
+        try:
+            future = pool.submit(run_job, path, data, to, options)
+        except BrokenProcessPool as exc:
+            release_slot()
+            self._replace_pool(pool)
+            raise RequestError("conversion_failed", str(exc), type(exc).__name__)
+        except BaseException:
+            release_slot()
+            raise
+        in_flight.add(future)
+        future.add_done_callback(release_slot)
+        future.add_done_callback(in_flight.discard)
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0))
+        except TimeoutError:
+            if not future.cancel():
+                # Already running, and stuck in its worker
+                in_flight.discard(future)
+                release_slot()
+                self._retire_pool(pool)
+            raise RequestError("timeout", f"Conversion took longer than {timeout}s")
+        except BrokenProcessPool as exc:
+            self._replace_pool(pool)
+            raise RequestError("conversion_failed", str(exc), type(exc).__name__)
+        except Exception as exc:
+            raise RequestError("conversion_failed", str(exc) or repr(exc), type(exc).__name__)
+
+    def close_connections(self):
+        """Stop reading new requests from the open connections."""
+        with self.lock:
+            self.closing = True
+            for conn in self.connections:
+                try:
+                    conn.shutdown(socket.SHUT_RD)
+                except OSError:
+                    pass
+
+    def server_close(self):
+        # Waits for the requests in progress
+        super().server_close()
+        self.pool.shutdown()
+        with self.lock:
+            retired, self.retired = self.retired, set()
+            workers = {pool: self.workers.pop(pool, ()) for pool in retired}
+        for pool in retired:
+            kill_pool(pool, workers[pool])
+
+
+def kill_pool(pool: ProcessPoolExecutor, workers):
+    """Stop `pool`, killing its `workers` processes whatever they are doing."""
+    # There is no public way to stop a running job
+    for process in workers:
+        if process.is_alive():
+            process.kill()
+    pool.shutdown(wait=True, cancel_futures=True)
+
+
+class ConnectionHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        with server.lock:
+            if server.closing:
+                return
+            server.connections.add(self.request)
+        try:
+            while True:
+                try:
+                    message = recv_message(self.request)
+                except (ProtocolError, OSError) as exc:
+                    _logger.debug("Closing connection: %s", exc)
+                    return
+                if message is None:
+                    return
+                header, body = message
+                try:
+                    response = {"ok": True}, server.convert(header, body)
+                except RequestError as exc:
+                    _logger.info("Request failed: %s: %s", exc.code, exc)
+                    response = exc.header(), b""
+                try:
+                    send_message(self.request, *response)
+                except OSError as exc:
+                    _logger.debug("Could not send response: %s", exc)
+                    return
+        finally:
+            with server.lock:
+                server.connections.discard(self.request)
+
+
+def remove_stale_socket(socket_path):
+    """Remove the socket file left by a server that is no longer running."""
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except ConnectionRefusedError:
+        os.unlink(socket_path)
+    else:
+        raise OSError(f"A server is already listening on {socket_path}")
+    finally:
+        probe.close()
+
+
+def serve(socket_path, jobs=None, max_pending=None, timeout=DEFAULT_TIMEOUT, ready=None,
+          root=None):
+    """Serve conversion requests on `socket_path` until SIGINT or SIGTERM.
+
+    `jobs` worker processes do the conversions (by default one per CPU), and
+    at most `max_pending` requests (by default twice `jobs`) wait for or run
+    in them. Requests may give the paths of files under the directory
+    `root`; without it, they must send the files' contents. If `ready` is
+    given it is called once the server is listening.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    max_pending = max_pending or 2 * jobs
+    remove_stale_socket(socket_path)
+
+    stop = threading.Event()
+    previous = {sig: signal.signal(sig, lambda *_: stop.set())
+                for sig in (signal.SIGINT, signal.SIGTERM)}
+    server = ConversionServer(socket_path, jobs, max_pending, timeout, root)
+    try:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        _logger.info("Listening on %s with %d workers", socket_path, jobs)
+        if ready is not None:
+            ready()
+        stop.wait()
+        _logger.info("Shutting down")
+        server.shutdown()
+        server.close_connections()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+
+
+class Client:
+    """Send conversion requests to a server listening on `socket_path`.
+
+    The connection is opened on the first request and kept open. A client
+    should only be used by one thread at a time.
+    """
+
+    def __init__(self, socket_path, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def convert(self, path=None, data: bytes = None, to="svg", timeout=None, **options) -> bytes:
+        """Convert the rm file at `path`, or with contents `data`, to `to`.
+
+        Returns the output as bytes (UTF-8 encoded for text formats), or
+        raises `ServerError` if the conversion failed. `timeout` limits the
+        time the server spends on the request, in seconds.
+        """
+        if (path is None) == (data is None):
+            raise ValueError("Give one of path and data")
+        header = {"to": to, "options": options, "timeout": timeout}
+        if path is not None:
+            header["path"] = os.path.abspath(path)
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(self.timeout)
+            self.sock.connect(self.socket_path)
+        try:
+            send_message(self.sock, header, data or b"")
+            response = recv_message(self.sock)
+        except BaseException:
+            # The connection is in an unknown state
+            self.close()
+            raise
+        if response is None:
+            self.close()
+            raise ConnectionError("The server closed the connection")
+        header, body = response
+        if not header.get("ok"):
+            error = header.get("error", {})
+            raise ServerError(error.get("code"), error.get("type"), error.get("message"))
+        return body
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
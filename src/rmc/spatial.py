@@ -0,0 +1,205 @@
+"""Find the strokes of a page in a region, without drawing the whole page.
+
+A `StrokeIndex` records the bounding box of every stroke on a page, in
+screen coordinates with the offsets of the groups' anchors applied. The
+boxes are kept in a uniform grid, so that a query only looks at the strokes
+in the grid cells it overlaps. `StrokeIndex.for_tree` keeps the index of
+each tree, so exporting several regions of a page builds it only once.
+
+Screen coordinates are those of the `.rm` file: x is 0 at the centre of the
+page and increases to the right, y is 0 at the top and increases downwards.
+The page is 1404 by 1872 units.
+"""
+
+import math
+import weakref
+from collections import defaultdict
+from typing import NamedTuple, Optional
+
+from rmscene import CrdtId, SceneTree
+from rmscene import scene_items as si
+
+from .exporters.points import packed_points
+from .exporters.svg import (
+    SCALE,
+    STROKE_WIDTH_DIVISOR,
+    X_SHIFT,
+    group_anchor,
+    initial_anchor_pos,
+    sequence_ids,
+    stroke_segments,
+    text_lines,
+    xx,
+    yy,
+)
+from .exporters.writing_tools import Pen, np
+
+# Size of the grid cells in screen units
+DEFAULT_CELL_SIZE = 128
+
+# SVG's default stroke-miterlimit: sharper corners are bevelled
+MITER_LIMIT = 4
+
+# The index of each tree that `StrokeIndex.for_tree` has been asked for
+_tree_indexes = weakref.WeakKeyDictionary()
+
+
+class StrokeEntry(NamedTuple):
+    # Position in drawing order
+    order: int
+    line: si.Line
+    # The ids of the stroke and its enclosing groups in their parents'
+    # children, from the outermost group in
+    path: tuple
+    # Offset of the stroke's points from the anchors of its groups
+    offset: tuple[float, float]
+    # (x0, y0, x1, y1) in screen coordinates, including the stroke width
+    bbox: tuple[float, float, float, float]
+
+
+def anchor_positions(tree: SceneTree) -> dict:
+    """Return the y-coordinates of the anchors that groups can refer to."""
+    anchor_pos = initial_anchor_pos()
+    if tree.root_text is not None:
+        for _ in text_lines(tree.root_text, anchor_pos):
+            pass
+    return anchor_pos
+
+
+def stroke_bbox(line: si.Line, offset) -> Optional[tuple]:
+    """Return the bounding box of `line` moved by `offset`, or None if empty.
+
+    The box includes all the ink the stroke's pen draws around its points.
+    """
+    if not line.points:
+        return None
+    points = packed_points(line.points)
+    x0, y0, x1, y1 = points.bbox()
+    margin = stroke_reach(line)
+    dx, dy = offset
+    return (x0 + dx - margin, y0 + dy - margin, x1 + dx + margin, y1 + dy + margin)
+
+
+def stroke_reach(line: si.Line) -> float:
+    """Return how far from its points the ink of `line` can reach, in screen units.
+
+    This is half the widest segment's width, times the most that a square
+    cap or a mitred corner can stick out by.
+    """
+    points = packed_points(line.points)
+    pen = Pen.create(line.tool.value, line.color.value, line.thickness_scale / 10)
+    if np is not None:
+        step = pen.segment_length
+        widths = pen.get_segment_widths(*(
+            np.asarray(column[::step], dtype=float)
+            for column in (points.speed, points.direction, points.width, points.pressure)
+        )).tolist()
+    else:
+        widths = [segment.width for segment in stroke_segments(line, pen)]
+    # Pen widths are in points, and some pens make negative ones
+    half_width = max(abs(width) for width in widths) / STROKE_WIDTH_DIVISOR / SCALE / 2
+    cap = math.sqrt(2) if pen.stroke_linecap == "square" else 1
+    return half_width * max(cap, MITER_LIMIT)
+
+
+def iter_strokes(tree: SceneTree):
+    """Yield a `StrokeEntry` for each stroke of `tree`, in drawing order."""
+    anchor_pos = anchor_positions(tree)
+    order = 0
+
+    def walk(group, path, offset):
+        nonlocal order
+        anchor_x, anchor_y = group_anchor(group, anchor_pos)
+        offset = (offset[0] + anchor_x, offset[1] + anchor_y)
+        for child_id in sequence_ids(group.children):
+            child = group.children[child_id]
+            if isinstance(child, si.Group):
+                yield from walk(child, path + (child_id,), offset)
+            elif isinstance(child, si.Line):
+                bbox = stroke_bbox(child, offset)
+                if bbox is not None:
+                    yield StrokeEntry(order, child, path + (child_id,), offset, bbox)
+                    order += 1
+
+    yield from walk(tree.root, (), (0.0, 0.0))
+
+
+def intersects(a, b) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class StrokeIndex:
+    """A grid of the bounding boxes of the strokes on a page.
+
+    Build one with `from_tree`, or get the one kept for a tree with
+    `for_tree`, then find the strokes in a region with `query`.
+    """
+
+    def __init__(self, entries, cell_size=DEFAULT_CELL_SIZE):
+        self.entries = list(entries)
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        for i, entry in enumerate(self.entries):
+            for cell in self._cells(entry.bbox):
+                self.cells[cell].append(i)
+
+    @classmethod
+    def from_tree(cls, tree: SceneTree, cell_size=DEFAULT_CELL_SIZE) -> "StrokeIndex":
+        return cls(iter_strokes(tree), cell_size)
+
+    @classmethod
+    def for_tree(cls, tree: SceneTree) -> "StrokeIndex":
+        """Return the index of `tree`, building it the first time only.
+
+        The index is kept for as long as the tree is. Call `forget` after
+        changing the tree's strokes.
+        """
+        index = _tree_indexes.get(tree)
+        if index is None:
+            index = _tree_indexes[tree] = cls.from_tree(tree)
+        return index
+
+    @staticmethod
+    def forget(tree: SceneTree):
+        """Drop the index kept for `tree` by `for_tree`, if any."""
+        _tree_indexes.pop(tree, None)
+
+    def _cells(self, bbox):
+        size = self.cell_size
+        x0, y0, x1, y1 = (math.floor(v / size) for v in bbox)
+        for cy in range(y0, y1 + 1):
+            for cx in range(x0, x1 + 1):
+                yield cx, cy
+
+    def query(self, bbox) -> list[StrokeEntry]:
+        """Return the strokes whose bounding boxes meet `bbox`, in drawing order.
+
+        `bbox` is `(x0, y0, x1, y1)` in screen coordinates.
+        """
+        found = set()
+        for cell in self._cells(bbox):
+            for i in self.cells.get(cell, ()):
+                if i not in found and intersects(self.entries[i].bbox, bbox):
+                    found.add(i)
+        return [self.entries[i] for i in sorted(found)]
+
+    def visible_ids(self, bbox) -> set[CrdtId]:
+        """Return the ids of the strokes meeting `bbox` and of their groups.
+
+        The ids are those of the items in their parents' children, so drawing
+        can skip any child whose id is not in the set.
+        """
+        ids = set()
+        for entry in self.query(bbox):
+            ids.update(entry.path)
+        return ids
+
+
+def bbox_region(bbox) -> tuple[float, float, float, float]:
+    """Return `(left, top, width, height)` in points of the page for `bbox`.
+
+    This is the region in the coordinates of the SVG page, whose origin is
+    the top left corner.
+    """
+    x0, y0, x1, y1 = bbox
+    return X_SHIFT + xx(x0), yy(y0), xx(x1 - x0), yy(y1 - y0)
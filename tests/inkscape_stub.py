@@ -0,0 +1,47 @@
+"""A stand-in for `inkscape --shell`, for testing the worker protocol.
+
+It answers each command line with the `> ` prompt, as Inkscape does. The
+"PDF" it exports is its process id followed by the SVG. An SVG containing
+`CRASH` makes it exit in the middle of the export, and one containing
+`HANG` makes it stop responding. `CRASH-ONCE` crashes only if the file
+named by the `STUB_CRASH_ONCE` environment variable exists, deleting it.
+"""
+
+import os
+import sys
+import time
+
+
+def export(svg_path, pdf_path):
+    with open(svg_path) as f:
+        svg = f.read()
+    if "CRASH-ONCE" in svg:
+        marker = os.environ.get("STUB_CRASH_ONCE")
+        if marker and os.path.exists(marker):
+            os.unlink(marker)
+            os._exit(1)
+    elif "CRASH" in svg:
+        os._exit(1)
+    if "HANG" in svg:
+        time.sleep(3600)
+    with open(pdf_path, "w") as f:
+        f.write(f"{os.getpid()}\n{svg}")
+
+
+def main():
+    assert sys.argv[1:] == ["--shell"]
+    out = sys.stdout
+    out.write("> ")
+    out.flush()
+    for line in sys.stdin:
+        actions = dict(action.partition(":")[::2] for action in line.strip().split("; "))
+        if "quit" in actions:
+            return
+        if "export-do" in actions:
+            export(actions["file-open"], actions["export-filename"])
+        out.write("> ")
+        out.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import mmap
+import zipfile
+from pathlib import Path
+
+from rmc.archive import MappedFile, archive_pages, open_member
+
+DATA = Path(__file__).parent / "rm"
+
+
+def test_read_pages(tmp_path):
+    path = tmp_path / "notes.rmdoc"
+    names = ["abcd.strokes.rm", "dot.stroke.rm"]
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("doc.content", '{"pages": ["a", "blank", "b"]}')
+        archive.write(DATA / names[0], "doc/a.rm")
+        archive.write(DATA / names[1], "doc/b.rm", compress_type=zipfile.ZIP_DEFLATED)
+
+    pages = archive_pages(path)
+    assert [(page.number, page.page_id) for page in pages] == [(1, "a"), (3, "b")]
+    for page, name in zip(pages, names):
+        with page.open() as f:
+            assert f.read() == (DATA / name).read_bytes()
+    with open_member(path, "doc/a.rm") as f:
+        assert isinstance(f.raw, MappedFile)
+
+
+def test_mapped_file_reads(tmp_path):
+    path = tmp_path / "data"
+    path.write_bytes(b"0123456789")
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    f = MappedFile(mapping, 2, 6)
+    buffer = bytearray(4)
+    assert f.readinto(buffer) == 4
+    assert buffer == b"2345"
+    assert f.readinto(buffer) == 2
+    assert buffer[:2] == b"67"
+    assert f.readinto(buffer) == 0
+    f.seek(1)
+    assert f.read(2) == b"34"
+    assert f.read() == b"567"
+    f.seek(100)
+    assert f.read() == b"" and f.readinto(buffer) == 0
+    f.close()
+    assert mapping.closed
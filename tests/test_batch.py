@@ -0,0 +1,48 @@
+import multiprocessing
+import os
+from pathlib import Path
+
+import pytest
+
+from rmc import cli
+from rmc.batch import convert_batch, output_paths
+
+DATA = Path(__file__).parent / "rm"
+
+
+def test_convert_batch(tmp_path):
+    inputs = [DATA / "abcd.strokes.rm", DATA / "dot.stroke.rm"]
+    results = list(convert_batch(inputs, "svg", tmp_path, jobs=1))
+    assert [r.error for r in results] == [None, None]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["abcd.strokes.svg", "dot.stroke.svg"]
+
+
+def test_output_collision(tmp_path):
+    a = tmp_path / "a" / "page.rm"
+    b = tmp_path / "b" / "page.rm"
+    with pytest.raises(ValueError, match="page.svg"):
+        output_paths([a, b], "svg", tmp_path / "out")
+    with pytest.raises(ValueError):
+        next(convert_batch([a, b], "svg", tmp_path / "out"))
+    assert not (tmp_path / "out").exists()
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork",
+                    reason="workers must inherit the patched converter")
+def test_worker_crash_fails_one_file(tmp_path, monkeypatch):
+    convert_rm = cli.convert_rm
+
+    def crashing_convert_rm(filename, *args, **kwargs):
+        if Path(filename).name == "dot.stroke.rm":
+            os._exit(1)
+        return convert_rm(filename, *args, **kwargs)
+
+    monkeypatch.setattr(cli, "convert_rm", crashing_convert_rm)
+    inputs = [DATA / "abcd.strokes.rm", DATA / "dot.stroke.rm", DATA / "Lines_v2.rm"]
+    results = {r.input.name: r.error for r in convert_batch(inputs, "svg", tmp_path, jobs=2)}
+    assert results == {
+        "abcd.strokes.rm": None,
+        "dot.stroke.rm": "Worker process died",
+        "Lines_v2.rm": None,
+    }
+    assert not (tmp_path / "dot.stroke.svg").exists()
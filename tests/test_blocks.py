@@ -0,0 +1,83 @@
+import io
+import json
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+
+from rmscene import read_blocks
+from rmscene import scene_items as si
+
+from rmc.cli import cli
+from rmc.exporters.blocks import convert_blocks_json, convert_tree_json
+from rmc.exporters.points import read_packed_tree
+
+DATA = Path(__file__).parent / "rm"
+
+FIXTURES = sorted(p.name for p in DATA.glob("*.rm"))
+
+
+def reject_constant(name):
+    raise ValueError(f"{name} is not valid JSON")
+
+
+def json_lines(convert, name, **options) -> list[dict]:
+    """Convert `name`, checking that each line is a JSON object."""
+    output = io.StringIO()
+    with open(DATA / name, "rb") as f:
+        convert(f, output, **options)
+    text = output.getvalue()
+    assert text.endswith("\n")
+    records = [json.loads(line, parse_constant=reject_constant) for line in text.splitlines()]
+    assert all(isinstance(record, dict) for record in records)
+    return records
+
+
+@pytest.mark.parametrize("summarize_points", [False, True])
+@pytest.mark.parametrize("name", FIXTURES)
+def test_blocks_json(name, summarize_points):
+    records = json_lines(convert_blocks_json, name, summarize_points=summarize_points)
+    with open(DATA / name, "rb") as f:
+        blocks = list(read_blocks(f))
+    assert [record["block"] for record in records] == [type(block).__name__ for block in blocks]
+
+
+@pytest.mark.parametrize("summarize_points", [False, True])
+@pytest.mark.parametrize("name", FIXTURES)
+def test_tree_json(name, summarize_points):
+    records = json_lines(convert_tree_json, name, summarize_points=summarize_points)
+    with open(DATA / name, "rb") as f:
+        tree = read_packed_tree(f)
+    lines = [item for item in tree.walk() if isinstance(item, si.Line)]
+
+    # Each item's parent is a group written before it
+    groups = {}
+    for record in records:
+        if record["type"] == "Text":
+            continue
+        if record["parent"] is not None:
+            assert groups[record["parent"]] == record["depth"] - 1
+        if record["type"] == "Group":
+            groups[record["id"]] = record["depth"]
+
+    line_records = [record for record in records if record["type"] == "Line"]
+    assert len(line_records) == len(lines)
+    for record, line in zip(line_records, lines):
+        points = record["value"]["points"]
+        if summarize_points:
+            assert points["count"] == len(line.points)
+            assert points["bbox"] == (list(line.points.bbox()) if line.points else None)
+        else:
+            assert points == [[p.x, p.y, p.speed, p.direction, p.width, p.pressure]
+                              for p in line.points]
+    assert (records[0]["type"] == "Text") == (tree.root_text is not None)
+
+
+def test_summarized_json_from_cli(tmp_path):
+    output = tmp_path / "out.ndjson"
+    result = CliRunner().invoke(cli, ["-t", "tree-json", "--summarize-points",
+                                      str(DATA / "writing_tools.rm"), "-o", str(output)])
+    assert result.exit_code == 0, result.output
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert all(set(record["value"]["points"]) == {"count", "bbox"}
+               for record in records if record["type"] == "Line")
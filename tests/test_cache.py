@@ -0,0 +1,60 @@
+import io
+from pathlib import Path
+
+from rmc import cache as cache_module
+from rmc.cache import ConversionCache
+
+DATA = Path(__file__).parent / "rm"
+
+
+def test_convert_uses_cached_result(tmp_path):
+    cache = ConversionCache(tmp_path)
+    outputs = []
+    for _ in range(2):
+        output = io.StringIO()
+        cache.convert(DATA / "abcd.strokes.rm", "svg", output)
+        outputs.append(output.getvalue())
+    assert outputs[0] == outputs[1]
+    assert "<svg" in outputs[0]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+    assert stats["size"] == len(outputs[0].encode())
+
+
+def test_lookups_do_not_rewrite_stats(tmp_path):
+    cache = ConversionCache(tmp_path)
+    cache.put("ab" * 32, b"result")
+    stats_path = tmp_path / "stats.json"
+    before = stats_path.read_bytes()
+    for _ in range(3):
+        assert cache.get("ab" * 32) == b"result"
+    assert cache.get("cd" * 32) is None
+    assert stats_path.read_bytes() == before
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (3, 1)
+    # The log was added up once
+    assert cache.stats()["hits"] == 3
+
+
+def test_put_replaces_existing_entry(tmp_path):
+    cache = ConversionCache(tmp_path)
+    cache.put("ab" * 32, b"old")
+    cache.put("ab" * 32, b"new")
+    assert cache.get("ab" * 32) == b"new"
+    assert not list(tmp_path.rglob(".tmp-*"))
+
+
+def test_eviction(tmp_path):
+    cache = ConversionCache(tmp_path, max_size=100)
+    for i in range(5):
+        cache.put(f"{i:02d}" * 32, bytes(40))
+    assert cache.stats()["size"] <= 100
+    assert cache.get("04" * 32) is not None
+    assert cache.get("00" * 32) is None
+
+
+def test_key_depends_on_source(tmp_path, monkeypatch):
+    key = ConversionCache(tmp_path).key(b"data", "svg")
+    assert ConversionCache(tmp_path).key(b"data", "svg") == key
+    monkeypatch.setattr(cache_module, "_source_hash", lambda: "changed")
+    assert ConversionCache(tmp_path).key(b"data", "svg") != key
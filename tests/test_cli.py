@@ -0,0 +1,37 @@
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from rmc.cli import cli
+
+DATA = Path(__file__).parent / "rm"
+
+
+def run(*args):
+    return CliRunner().invoke(cli, [str(arg) for arg in args])
+
+
+def test_thumbnail_with_dpi_rejected(tmp_path):
+    result = run("--thumbnail", 100, "--dpi", 100, DATA / "abcd.strokes.rm",
+                 "-o", tmp_path / "out.png")
+    assert result.exit_code == 2
+    assert "--dpi" in result.output
+    assert not (tmp_path / "out.png").exists()
+
+
+def test_bbox(tmp_path):
+    whole, top = tmp_path / "whole.svg", tmp_path / "top.svg"
+    assert run(DATA / "writing_tools.rm", "-o", whole).exit_code == 0
+    result = run("--bbox", "-702,0,702,600", DATA / "writing_tools.rm", "-o", top)
+    assert result.exit_code == 0, result.output
+    # The strokes below the region are left out
+    whole_strokes = whole.read_text().count("<polyline")
+    top_strokes = top.read_text().count("<polyline")
+    assert 0 < top_strokes < whole_strokes
+
+
+def test_bbox_rejected_for_text(tmp_path):
+    result = run("--bbox", "0,0,100,100", "-t", "markdown", DATA / "abcd.text.rm",
+                 "-o", tmp_path / "out.md")
+    assert result.exit_code == 2
+    assert "--bbox" in result.output
@@ -0,0 +1,127 @@
+import dataclasses
+import io
+import re
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+from rmscene import CrdtId, LwwValue, read_blocks, read_tree, write_blocks
+from rmscene.crdt_sequence import CrdtSequenceItem, END_MARKER
+from rmscene.scene_stream import SceneItemBlock, TreeNodeBlock
+
+from rmc.compact import compact_rm, line_version, relink
+from rmc.exporters.markdown import print_text
+from rmc.exporters.points import read_packed_blocks
+from rmc.exporters.svg import convert_svg
+
+DATA = Path(__file__).parent / "rm"
+
+FIXTURES = sorted(p.name for p in DATA.glob("*.rm"))
+
+# The SVG has a comment for each item, including deleted ones, and an
+# element for each group, including those with nothing in them
+CHILD_COMMENT_RE = re.compile(r"^ *<!-- child CrdtId\(\d+, \d+\) -->\n", re.MULTILINE)
+EMPTY_GROUP_RE = re.compile(r"^ *<g id=[^>]*>\n *</g>\n", re.MULTILINE)
+
+
+def compact(data: bytes):
+    output = io.BytesIO()
+    result = compact_rm(io.BytesIO(data), output)
+    return output.getvalue(), result
+
+
+def to_svg(data: bytes) -> str:
+    """Return the SVG of `data`, without what only shows dropped items."""
+    output = io.StringIO()
+    convert_svg(io.BytesIO(data), output)
+    svg = CHILD_COMMENT_RE.sub("", output.getvalue())
+    while EMPTY_GROUP_RE.search(svg):
+        svg = EMPTY_GROUP_RE.sub("", svg)
+    return svg
+
+
+def to_markdown(data: bytes) -> str:
+    output = io.StringIO()
+    print_text(io.BytesIO(data), output)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize("name", FIXTURES)
+def test_compacted_output_is_unchanged(name):
+    data = (DATA / name).read_bytes()
+    compacted, result = compact(data)
+    assert (result.size_before, result.size_after) == (len(data), len(compacted))
+
+    # rmscene reads the result, with the same groups that can be reached
+    tree = read_tree(io.BytesIO(compacted))
+    assert tree.root_text == read_tree(io.BytesIO(data)).root_text
+    assert to_svg(compacted) == to_svg(data)
+    assert to_markdown(compacted) == to_markdown(data)
+
+
+@pytest.mark.parametrize("name", FIXTURES)
+def test_compacted_blocks(name):
+    data = (DATA / name).read_bytes()
+    compacted, result = compact(data)
+    blocks = list(read_blocks(io.BytesIO(compacted)))
+
+    assert not [b for b in blocks if isinstance(b, SceneItemBlock) and b.item.value is None]
+    node_blocks = Counter(b.group.node_id for b in blocks if isinstance(b, TreeNodeBlock))
+    assert set(node_blocks.values()) <= {1}
+
+    before = list(read_blocks(io.BytesIO(data)))
+    deleted = [b for b in before if isinstance(b, SceneItemBlock) and b.item.value is None]
+    assert result.items_dropped >= len(deleted)
+
+
+@pytest.mark.parametrize("name", FIXTURES)
+def test_compaction_is_idempotent(name):
+    compacted, _ = compact((DATA / name).read_bytes())
+    again, result = compact(compacted)
+    assert again == compacted
+    assert (result.items_dropped, result.groups_dropped) == (0, 0)
+
+
+def test_fixtures_have_something_to_drop():
+    # Otherwise the tests above don't show much
+    dropped = [compact((DATA / name).read_bytes())[1] for name in FIXTURES]
+    assert any(r.items_dropped for r in dropped)
+    assert any(r.groups_dropped for r in dropped)
+
+
+def test_superseded_node_blocks_are_dropped():
+    # The fixtures have one block per group: rename a layer after the fact
+    blocks = list(read_packed_blocks(io.BytesIO((DATA / "layers.stroke.rm").read_bytes())))
+    index, block = next((i, b) for i, b in enumerate(blocks)
+                        if isinstance(b, TreeNodeBlock) and b.group.label.value == "Layer 2")
+    renamed = dataclasses.replace(block, group=dataclasses.replace(
+        block.group, label=LwwValue(CrdtId(1, 1000), "Renamed")))
+    blocks.insert(index + 1, renamed)
+    output = io.BytesIO()
+    write_blocks(output, blocks, options={"line_version": line_version(blocks)})
+
+    compacted, _ = compact(output.getvalue())
+    node_ids = [b.group.node_id for b in read_blocks(io.BytesIO(compacted))
+                if isinstance(b, TreeNodeBlock)]
+    assert node_ids.count(block.group.node_id) == 1
+    tree = read_tree(io.BytesIO(compacted))
+    assert tree[block.group.node_id].label.value == "Renamed"
+
+
+def test_relink_keeps_order():
+    a, b, c, d, e = (CrdtId(1, n) for n in range(10, 15))
+    items = [
+        CrdtSequenceItem(a, END_MARKER, END_MARKER, 0, "a"),
+        CrdtSequenceItem(c, a, END_MARKER, 0, None),
+        CrdtSequenceItem(e, c, END_MARKER, 0, "e"),
+        # Inserted between a and c
+        CrdtSequenceItem(b, a, c, 0, None),
+        CrdtSequenceItem(d, b, c, 0, "d"),
+    ]
+    links = relink(items, lambda item: item.value is not None)
+    assert links == {
+        a: (END_MARKER, d),
+        d: (a, e),
+        e: (d, END_MARKER),
+    }
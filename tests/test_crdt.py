@@ -0,0 +1,109 @@
+import random
+from pathlib import Path
+
+import pytest
+
+from rmscene import CrdtId, read_tree
+from rmscene import scene_items as si
+from rmscene.crdt_sequence import END_MARKER, CrdtSequence, CrdtSequenceItem, toposort_items
+from rmscene.text import expand_text_items
+
+from rmc.exporters.crdt import sequence_ids
+
+DATA = Path(__file__).parent / "rm"
+
+
+def item(author, counter, left, right):
+    return CrdtSequenceItem(CrdtId(author, counter), left, right, 0, counter)
+
+
+def random_items(rng, size, concurrency):
+    """Return the items of a sequence built by inserting at random places.
+
+    With probability `concurrency`, an item is inserted between neighbours
+    taken from an earlier state of the sequence, as if by another author
+    who hadn't seen the latest changes. Inserts that would make the order
+    inconsistent, which no real history gives, are left out.
+    """
+    order = []
+    snapshots = [[]]
+    items = []
+    for counter in range(1, size + 1):
+        concurrent = rng.random() < concurrency
+        seen = rng.choice(snapshots) if concurrent else order
+        i = rng.randint(0, len(seen))
+        left = seen[i - 1] if i > 0 else END_MARKER
+        right = seen[i] if i < len(seen) else END_MARKER
+        new = item(2 if concurrent else 1, counter, left, right)
+        try:
+            order = list(toposort_items(items + [new]))
+        except AssertionError:
+            continue
+        items.append(new)
+        snapshots.append(order)
+    return items
+
+
+def check(items):
+    expected = list(toposort_items(items))
+    assert sequence_ids(CrdtSequence(items)) == expected
+    assert sequence_ids(CrdtSequence(items[::-1])) == expected
+
+
+def test_appended():
+    items = [item(1, 1, END_MARKER, END_MARKER)]
+    for counter in range(2, 20):
+        items.append(item(1, counter, items[-1].item_id, END_MARKER))
+    check(items)
+    assert sequence_ids(CrdtSequence(items)) == [i.item_id for i in items]
+
+
+def test_out_of_order():
+    rng = random.Random(0)
+    items = [item(1, 1, END_MARKER, END_MARKER)]
+    for counter in range(2, 20):
+        items.append(item(1, counter, items[-1].item_id, END_MARKER))
+    rng.shuffle(items)
+    check(items)
+
+
+def test_inserted_in_the_middle():
+    a = item(1, 1, END_MARKER, END_MARKER)
+    b = item(1, 2, a.item_id, END_MARKER)
+    c = item(1, 3, a.item_id, b.item_id)
+    check([a, b, c])
+    assert sequence_ids(CrdtSequence([a, b, c])) == [a.item_id, c.item_id, b.item_id]
+
+
+def test_concurrent_inserts_at_the_same_place():
+    a = item(1, 1, END_MARKER, END_MARKER)
+    b = item(1, 2, a.item_id, END_MARKER)
+    concurrent = [item(author, 3, a.item_id, b.item_id) for author in (3, 2, 1)]
+    check([a, b, *concurrent])
+    # Ties are broken by id, the same way by every reader
+    assert sequence_ids(CrdtSequence([a, b, *concurrent]))[1:4] == sorted(i.item_id for i in concurrent)
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("concurrency", [0, 0.3])
+def test_random_inserts(seed, concurrency):
+    rng = random.Random(seed)
+    items = random_items(rng, 40, concurrency)
+    rng.shuffle(items)
+    check(items)
+
+
+@pytest.mark.parametrize("name", sorted(p.name for p in DATA.glob("*.rm")))
+def test_fixtures(name):
+    with open(DATA / name, "rb") as f:
+        tree = read_tree(f)
+
+    def walk(group):
+        check(list(group.children.sequence_items()))
+        for child in group.children.values():
+            if isinstance(child, si.Group):
+                walk(child)
+
+    walk(tree.root)
+    if tree.root_text is not None:
+        check(list(expand_text_items(tree.root_text.items.sequence_items())))
@@ -0,0 +1,60 @@
+from pathlib import Path
+
+import pytest
+
+from rmscene import scene_items as si
+
+from rmc.erase import cull_erased_strokes
+from rmc.exporters.points import read_packed_tree
+from rmc.exporters.crdt import sequence_ids
+
+DATA = Path(__file__).parent / "rm"
+
+
+def read_tree(name):
+    with open(DATA / name, "rb") as f:
+        return read_packed_tree(f)
+
+
+def strokes(tree) -> list:
+    """Return the strokes of `tree` still drawn, in order."""
+    lines = []
+
+    def visit(group):
+        for child_id in sequence_ids(group.children):
+            child = group.children[child_id]
+            if isinstance(child, si.Group):
+                visit(child)
+            elif isinstance(child, si.Line):
+                lines.append(child)
+
+    visit(tree.root)
+    return lines
+
+
+def test_cull_erased_strokes():
+    tree = read_tree("eraser.strokes.rm")
+    before = strokes(tree)
+    result = cull_erased_strokes(tree)
+    assert result.strokes_dropped > 0
+    assert result.strokes_clipped > 0
+    after = strokes(tree)
+    assert len(after) == len(before) - result.strokes_dropped - result.erasers_dropped
+    assert sum(len(line.points) for line in after) < sum(len(line.points) for line in before)
+
+
+def test_culled_png_is_identical():
+    np = pytest.importorskip("numpy")
+    from rmc.exporters.png import Canvas, draw_page
+
+    images = []
+    for cull in (False, True):
+        tree = read_tree("eraser.strokes.rm")
+        if cull:
+            cull_erased_strokes(tree)
+        canvas = Canvas()
+        draw_page(tree, canvas)
+        images.append(canvas.to_image())
+    # Some ink is left, and looks the same
+    assert (images[0] < 128).any()
+    assert np.array_equal(*images)
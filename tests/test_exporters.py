@@ -0,0 +1,108 @@
+import io
+import os
+import re
+import subprocess
+import sys
+import zlib
+from pathlib import Path
+
+import pytest
+
+from rmc import metrics
+from rmc.exporters.pdf import PAGE_HEIGHT_PT, PAGE_WIDTH_PT, convert_pdf, rm_to_pdf, trees_to_pdf
+from rmc.exporters.points import read_packed_tree
+from rmc.exporters.svg import FragmentCache, convert_svg, parse_tree
+
+DATA = Path(__file__).parent / "rm"
+
+
+def drawn_segments(convert, path, binary=True) -> int:
+    """Return the number of stroke segments `convert` draws for the rm file `path`."""
+    collected = metrics.enable()
+    try:
+        with open(path, "rb") as f:
+            convert(f, io.BytesIO() if binary else io.StringIO())
+    finally:
+        metrics.disable()
+    return collected.counters["segments", ()]
+
+
+@pytest.mark.parametrize("name", ["single_point.stroke.rm", "dot.stroke.rm"])
+def test_pdf_draws_dots_like_svg(name):
+    svg_segments = drawn_segments(convert_svg, DATA / name, binary=False)
+    assert svg_segments == 1
+    assert drawn_segments(convert_pdf, DATA / name) == svg_segments
+
+    output = io.BytesIO()
+    with open(DATA / name, "rb") as f:
+        convert_pdf(f, output)
+    stream = re.search(rb"stream\n(.*?)\nendstream", output.getvalue(), re.S).group(1)
+    assert b" l S" in zlib.decompress(stream)
+
+
+@pytest.mark.parametrize("name", ["single_point.stroke.rm", "dot.stroke.rm"])
+def test_png_draws_dots_like_svg(name):
+    pytest.importorskip("numpy")
+    from rmc.exporters.png import Canvas, convert_png, draw_page
+
+    svg_segments = drawn_segments(convert_svg, DATA / name, binary=False)
+    assert drawn_segments(convert_png, DATA / name) == svg_segments
+
+    canvas = Canvas()
+    with open(DATA / name, "rb") as f:
+        draw_page(read_packed_tree(f), canvas)
+    assert canvas.to_image().min() < 255
+
+
+def test_saved_fragments_hit_in_another_process(tmp_path):
+    cache_path = tmp_path / "fragments.json"
+    rm_path = DATA / "writing_tools.rm"
+    # str and bytes hashes differ between processes with different seeds
+    subprocess.run(
+        [sys.executable, "-c",
+         "import io, sys\n"
+         "from rmc.exporters.svg import FragmentCache, convert_svg\n"
+         "cache = FragmentCache()\n"
+         "with open(sys.argv[1], 'rb') as f:\n"
+         "    convert_svg(f, io.StringIO(), fragment_cache=cache)\n"
+         "cache.save(sys.argv[2])\n",
+         str(rm_path), str(cache_path)],
+        env=dict(os.environ, PYTHONHASHSEED="1"), check=True)
+
+    cache = FragmentCache.load(cache_path)
+    assert cache.fragments
+    output = io.StringIO()
+    with open(rm_path, "rb") as f:
+        convert_svg(f, output, fragment_cache=cache)
+    assert (cache.hits, cache.misses) == (1, 0)
+
+    expected = io.StringIO()
+    with open(rm_path, "rb") as f:
+        convert_svg(f, expected)
+    assert output.getvalue() == expected.getvalue()
+
+
+def test_pdf_pages():
+    pypdf = pytest.importorskip("pypdf")
+    names = ["abcd.text.rm", "Lines_v2.rm", "writing_tools_with_text.rm"]
+    trees = []
+    for name in names:
+        with open(DATA / name, "rb") as f:
+            trees.append(parse_tree(f))
+    output = io.BytesIO()
+    trees_to_pdf(trees, output)
+
+    reader = pypdf.PdfReader(io.BytesIO(output.getvalue()), strict=True)
+    assert len(reader.pages) == len(names)
+    for page in reader.pages:
+        assert [float(v) for v in page.mediabox] == pytest.approx([0, 0, PAGE_WIDTH_PT, PAGE_HEIGHT_PT])
+        assert page.get_contents().get_data()
+    assert [page.extract_text().strip() for page in reader.pages] == ["abc", "", "text"]
+
+
+def test_rm_to_pdf_is_built_in(tmp_path, monkeypatch):
+    pypdf = pytest.importorskip("pypdf")
+    # Inkscape is only used when asked for
+    monkeypatch.setenv("PATH", str(tmp_path))
+    rm_to_pdf(DATA / "abcd.strokes.rm", tmp_path / "out.pdf")
+    assert len(pypdf.PdfReader(tmp_path / "out.pdf", strict=True).pages) == 1
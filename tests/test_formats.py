@@ -0,0 +1,70 @@
+import importlib.metadata
+import sys
+import types
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+
+from rmc import formats
+from rmc.cli import cli
+from rmc.formats import ENTRY_POINT_GROUP, Format
+
+DATA = Path(__file__).parent / "rm"
+
+
+def convert_size(f, fout, **options):
+    fout.write(f"{len(f.read())} bytes, simplify={options.get('simplify')}\n")
+
+
+@pytest.fixture
+def plugin(monkeypatch):
+    """Add entry points for a "size" format, and one trying to replace "svg"."""
+    module = types.ModuleType("rmc_size_plugin")
+    module.FORMAT = Format("anything", convert_size, (".size",))
+    monkeypatch.setitem(sys.modules, module.__name__, module)
+    entry_points = [
+        importlib.metadata.EntryPoint("size", "rmc_size_plugin:FORMAT", ENTRY_POINT_GROUP),
+        importlib.metadata.EntryPoint("svg", "rmc_size_plugin:FORMAT", ENTRY_POINT_GROUP),
+    ]
+
+    def fake_entry_points(group):
+        return [ep for ep in entry_points if ep.group == group]
+
+    monkeypatch.setattr(importlib.metadata, "entry_points", fake_entry_points)
+    monkeypatch.setattr(formats, "_plugins", None)
+
+
+def test_builtin_formats_do_not_load_plugins(monkeypatch):
+    monkeypatch.setattr(formats, "_plugins", None)
+    assert formats.get_format("svg").name == "svg"
+    assert formats._plugins is None
+
+
+def test_plugin_format(plugin):
+    fmt = formats.get_format("size")
+    assert fmt.name == "size"
+    assert formats.load_converter("size") is convert_size
+    assert formats.format_for_suffix(".size") is fmt
+    assert formats.available_formats()[-1] == "size"
+    # Built-in formats can't be replaced
+    assert formats.get_format("svg") is formats.BUILTIN_FORMATS["svg"]
+
+
+def test_plugin_dispatched_from_cli(plugin, tmp_path):
+    rm_file = DATA / "abcd.strokes.rm"
+    runner = CliRunner()
+    result = runner.invoke(cli, ["-t", "size", "--simplify", "2", str(rm_file),
+                                 "-o", str(tmp_path / "out.txt")])
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / "out.txt").read_text() == f"{rm_file.stat().st_size} bytes, simplify=2.0\n"
+
+    # The format is also found from the output file's suffix
+    result = runner.invoke(cli, [str(rm_file), "-o", str(tmp_path / "out.size")])
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / "out.size").read_text().startswith(f"{rm_file.stat().st_size} bytes")
+
+
+def test_unknown_format():
+    with pytest.raises(formats.UnknownFormat):
+        formats.get_format("no-such-format")
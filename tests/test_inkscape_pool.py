@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from rmc.exporters.pdf import InkscapeError, InkscapePool, InkscapeWorker
+
+STUB = (sys.executable, str(Path(__file__).parent / "inkscape_stub.py"))
+
+
+def exported_by(pdf: bytes) -> tuple[int, str]:
+    """Return the process id of the stub worker that made `pdf`, and its SVG."""
+    pid, svg = pdf.decode().split("\n", 1)
+    return int(pid), svg
+
+
+@pytest.fixture
+def pool(tmp_path):
+    with InkscapePool(command=STUB, timeout=5, scratch_dir=tmp_path) as pool:
+        yield pool
+
+
+def test_export(pool):
+    pid, svg = exported_by(pool.convert("<svg>one</svg>"))
+    assert svg == "<svg>one</svg>"
+    # The same worker takes the next job
+    assert exported_by(pool.convert("<svg>two</svg>")) == (pid, "<svg>two</svg>")
+
+
+def test_scratch_files_removed(pool, tmp_path):
+    pool.convert("<svg/>")
+    assert [p for p in tmp_path.rglob("*") if p.is_file()] == []
+
+
+def test_worker_dies_mid_job_is_retried(pool, tmp_path, monkeypatch):
+    marker = tmp_path / "crash-once"
+    monkeypatch.setenv("STUB_CRASH_ONCE", str(marker))
+    first_pid, _ = exported_by(pool.convert("<svg/>"))
+    marker.touch()
+
+    pid, svg = exported_by(pool.convert("<svg>CRASH-ONCE</svg>"))
+    assert svg == "<svg>CRASH-ONCE</svg>"
+    assert pid != first_pid
+    assert not marker.exists()
+
+
+def test_worker_keeps_dying(pool):
+    with pytest.raises(InkscapeError):
+        pool.convert("<svg>CRASH</svg>")
+    # A new worker takes the next job
+    assert exported_by(pool.convert("<svg/>"))[1] == "<svg/>"
+
+
+def test_hung_worker_is_replaced(tmp_path):
+    with InkscapePool(command=STUB, timeout=0.5, scratch_dir=tmp_path) as pool:
+        pid, _ = exported_by(pool.convert("<svg/>"))
+        start = time.monotonic()
+        with pytest.raises(InkscapeError, match="did not respond"):
+            pool.convert("<svg>HANG</svg>")
+        # Timed out on the job and on its one retry
+        assert time.monotonic() - start < 5
+        new_pid, svg = exported_by(pool.convert("<svg/>"))
+        assert svg == "<svg/>"
+        assert new_pid != pid
+
+
+def test_interrupted_worker_is_stopped(pool, monkeypatch):
+    pid, _ = exported_by(pool.convert("<svg/>"))
+    export = InkscapeWorker.export
+
+    def interrupted_export(self, svg_path, pdf_path, timeout=60):
+        # Stop waiting after sending a command, leaving its prompt unread
+        self.process.stdin.write(b"noop\n")
+        self.process.stdin.flush()
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(InkscapeWorker, "export", interrupted_export)
+    with pytest.raises(KeyboardInterrupt):
+        pool.convert("<svg/>")
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
+
+    monkeypatch.setattr(InkscapeWorker, "export", export)
+    new_pid, svg = exported_by(pool.convert("<svg>next</svg>"))
+    assert svg == "<svg>next</svg>"
+    assert new_pid != pid
+
+
+def test_missing_executable(tmp_path):
+    with InkscapePool(command=(str(tmp_path / "no-inkscape"),), scratch_dir=tmp_path) as pool:
+        with pytest.raises(InkscapeError):
+            pool.convert("<svg/>")
@@ -0,0 +1,59 @@
+import io
+from pathlib import Path
+
+import pytest
+
+from rmscene import read_tree
+from rmscene import scene_items as si
+
+from rmc.exporters.markdown import print_text, read_text_tree
+
+DATA = Path(__file__).parent / "rm"
+
+FIXTURES = sorted(p.name for p in DATA.glob("*.rm"))
+
+
+def assert_same_items(text_group, group):
+    """Check that two groups have the same children, apart from stroke values."""
+    assert text_group.node_id == group.node_id
+    assert text_group.label == group.label
+    assert text_group.visible == group.visible
+    assert text_group.anchor_id == group.anchor_id
+    text_items = list(text_group.children.sequence_items())
+    items = list(group.children.sequence_items())
+    assert [i.item_id for i in text_items] == [i.item_id for i in items]
+    for text_item, item in zip(text_items, items):
+        assert (text_item.left_id, text_item.right_id, text_item.deleted_length) == \
+            (item.left_id, item.right_id, item.deleted_length)
+        if isinstance(item.value, si.Group):
+            assert_same_items(text_item.value, item.value)
+        elif isinstance(item.value, si.Line):
+            # Strokes keep their place, without their points
+            assert text_item.value is None
+        else:
+            assert text_item.value == item.value
+
+
+@pytest.mark.parametrize("name", FIXTURES)
+def test_text_tree_matches_read_tree(name):
+    with open(DATA / name, "rb") as f:
+        text_tree = read_text_tree(f)
+    with open(DATA / name, "rb") as f:
+        tree = read_tree(f)
+    assert_same_items(text_tree.root, tree.root)
+    assert text_tree.root_text == tree.root_text
+    assert set(text_tree._node_ids) == set(tree._node_ids)
+
+
+def test_text_tree_from_unseekable_stream():
+    data = (DATA / "text_and_strokes.rm").read_bytes()
+
+    class Unseekable(io.BytesIO):
+        def seekable(self):
+            return False
+
+    out, unseekable_out = io.StringIO(), io.StringIO()
+    print_text(io.BytesIO(data), out)
+    print_text(Unseekable(data), unseekable_out)
+    assert out.getvalue().startswith("abed\n")
+    assert unseekable_out.getvalue() == out.getvalue()
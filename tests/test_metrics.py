@@ -0,0 +1,63 @@
+import io
+import json
+import re
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from rmc import metrics
+from rmc.cli import cli
+
+DATA = Path(__file__).parent / "rm"
+
+PROMETHEUS_LINE = re.compile(r'(# TYPE \w+ (gauge|counter))|(\w+(\{(\w+="[^"]*",?)*\})? \S+)')
+
+
+def run(*args):
+    result = CliRunner().invoke(cli, [str(arg) for arg in args])
+    assert result.exit_code == 0, result.output
+    return result
+
+
+def test_metrics_json(tmp_path):
+    output = tmp_path / "out.svg"
+    run("--metrics", tmp_path / "metrics.json", DATA / "writing_tools.rm", "-o", output)
+    collected = json.loads((tmp_path / "metrics.json").read_text())
+    assert {"total", "parse", "draw_stroke"} <= set(collected["phases"])
+    for phase in collected["phases"].values():
+        assert phase["calls"] >= 1 and phase["wall_s"] >= 0 and phase["cpu_s"] >= 0
+    assert collected["counters"]["output_bytes"] == output.stat().st_size
+    assert sum(collected["counters"]["strokes"].values()) > 0
+    assert collected["peak_memory_bytes"] > 1024 * 1024
+
+
+def test_metrics_prometheus(tmp_path):
+    output = tmp_path / "out.pdf"
+    run("--metrics", tmp_path / "metrics.prom", DATA / "writing_tools.rm", "-o", output)
+    lines = (tmp_path / "metrics.prom").read_text().splitlines()
+    for line in lines:
+        assert PROMETHEUS_LINE.fullmatch(line), line
+    assert f"rmc_output_bytes_total {output.stat().st_size}" in lines
+    assert 'rmc_phase_calls{phase="total"} 1' in lines
+
+
+def test_text_output_counted_in_bytes():
+    collected = metrics.enable()
+    try:
+        writer = metrics.CountingWriter(io.StringIO())
+        writer.write("abc")
+        writer.write("café ✓")
+    finally:
+        metrics.disable()
+    assert collected.counters["output_bytes", ()] == 3 + len("café ✓".encode("utf-8"))
+
+
+def test_peak_memory_units(monkeypatch):
+    class Usage:
+        ru_maxrss = 1000
+
+    monkeypatch.setattr(metrics.resource, "getrusage", lambda who: Usage)
+    monkeypatch.setattr(metrics.sys, "platform", "linux")
+    assert metrics.peak_memory() == 1000 * 1024
+    monkeypatch.setattr(metrics.sys, "platform", "darwin")
+    assert metrics.peak_memory() == 1000
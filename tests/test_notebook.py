@@ -0,0 +1,79 @@
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+from rmc.notebook import export_notebook
+
+DATA = Path(__file__).parent / "rm"
+
+
+@pytest.fixture
+def notebook(tmp_path):
+    """A notebook of three pages in a copy of the xochitl directory."""
+    content_path = tmp_path / "xochitl" / "doc.content"
+    pages_dir = tmp_path / "xochitl" / "doc"
+    pages_dir.mkdir(parents=True)
+    content_path.write_text(json.dumps({"pages": ["a", "b", "c"]}))
+    for page_id, name in zip("abc", ["abcd.strokes.rm", "dot.stroke.rm", "Lines_v2.rm"]):
+        shutil.copy(DATA / name, pages_dir / f"{page_id}.rm")
+    return content_path
+
+
+def names(paths):
+    return sorted(p.name for p in paths)
+
+
+def test_only_changed_pages_rendered(notebook, tmp_path):
+    out_dir = tmp_path / "out"
+    result = export_notebook(notebook, "svg", out_dir)
+    assert names(result.rendered) == ["a.svg", "b.svg", "c.svg"]
+    assert [p.name for p in result.outputs] == ["a.svg", "b.svg", "c.svg"]
+
+    result = export_notebook(notebook, "svg", out_dir)
+    assert result.rendered == []
+    assert names(result.reused) == ["a.svg", "b.svg", "c.svg"]
+
+    shutil.copy(DATA / "abcd.text.rm", notebook.with_suffix("") / "b.rm")
+    result = export_notebook(notebook, "svg", out_dir)
+    assert names(result.rendered) == ["b.svg"]
+
+
+def test_cleared_page_output_removed(notebook, tmp_path):
+    out_dir = tmp_path / "out"
+    export_notebook(notebook, "svg", out_dir)
+    # A page that is cleared keeps its place but loses its .rm file
+    (notebook.with_suffix("") / "b.rm").unlink()
+    result = export_notebook(notebook, "svg", out_dir)
+    assert names(result.removed) == ["b.svg"]
+    assert [p.name for p in result.outputs] == ["a.svg", "c.svg"]
+    assert not (out_dir / "b.svg").exists()
+
+
+def test_deleted_page_output_removed(notebook, tmp_path):
+    out_dir = tmp_path / "out"
+    export_notebook(notebook, "svg", out_dir)
+    notebook.write_text(json.dumps({"pages": ["c", "a"]}))
+    result = export_notebook(notebook, "svg", out_dir)
+    assert names(result.removed) == ["b.svg"]
+    assert [p.name for p in result.outputs] == ["c.svg", "a.svg"]
+
+
+def test_changed_options_rerender(notebook, tmp_path):
+    out_dir = tmp_path / "out"
+    export_notebook(notebook, "svg", out_dir)
+    result = export_notebook(notebook, "svg", out_dir, simplify=1.0)
+    assert names(result.rendered) == ["a.svg", "b.svg", "c.svg"]
+    manifest = json.loads((out_dir / ".rmc-manifest.json").read_text())
+    assert manifest["settings"] == {"to": "svg", "options": {"simplify": 1.0}}
+
+
+def test_changed_format_removes_old_outputs(notebook, tmp_path):
+    out_dir = tmp_path / "out"
+    export_notebook(notebook, "svg", out_dir)
+    result = export_notebook(notebook, "markdown", out_dir)
+    assert names(result.rendered) == ["a.md", "b.md", "c.md"]
+    assert names(result.removed) == ["a.svg", "b.svg", "c.svg"]
+    assert names(p for p in out_dir.iterdir() if not p.name.startswith(".")) == \
+        ["a.md", "b.md", "c.md"]
@@ -0,0 +1,90 @@
+import io
+import struct
+import zlib
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from rmscene import scene_items as si
+
+from rmc.exporters.png import Canvas, convert_png, draw_page
+from rmc.exporters.points import read_packed_tree
+from rmc.exporters.svg import PAGE_HEIGHT_PT, PAGE_WIDTH_PT
+from rmc.spatial import bbox_region, iter_strokes
+
+DATA = Path(__file__).parent / "rm"
+
+
+def read_tree(name):
+    with open(DATA / name, "rb") as f:
+        return read_packed_tree(f)
+
+
+def read_png(data: bytes):
+    """Return the pixels per metre and the image of an unfiltered RGB PNG."""
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    position = 8
+    chunks = {}
+    while position < len(data):
+        (length,) = struct.unpack_from(">I", data, position)
+        kind = data[position + 4:position + 8]
+        body = data[position + 8:position + 8 + length]
+        (crc,) = struct.unpack_from(">I", data, position + 8 + length)
+        assert crc == zlib.crc32(kind + body)
+        chunks[kind] = body
+        position += 12 + length
+    assert b"IEND" in chunks
+    width, height, depth, color_type = struct.unpack(">IIBB", chunks[b"IHDR"][:10])
+    assert (depth, color_type) == (8, 2)
+    raw = np.frombuffer(zlib.decompress(chunks[b"IDAT"]), dtype=np.uint8)
+    raw = raw.reshape(height, width * 3 + 1)
+    assert (raw[:, 0] == 0).all()
+    ppm = struct.unpack(">IIB", chunks[b"pHYs"])[0] if b"pHYs" in chunks else None
+    return ppm, raw[:, 1:].reshape(height, width, 3)
+
+
+@pytest.mark.parametrize("dpi", [72, 100])
+def test_png_file(dpi):
+    output = io.BytesIO()
+    with open(DATA / "abcd.strokes.rm", "rb") as f:
+        convert_png(f, output, dpi=dpi)
+    ppm, image = read_png(output.getvalue())
+    assert ppm == round(dpi / 0.0254)
+    assert image.shape == (round(PAGE_HEIGHT_PT * dpi / 72), round(PAGE_WIDTH_PT * dpi / 72), 3)
+
+    canvas = Canvas(dpi)
+    draw_page(read_tree("abcd.strokes.rm"), canvas)
+    assert np.array_equal(image, canvas.to_image())
+
+
+def pixel_box(canvas, bbox):
+    """Return the pixel columns and rows of the screen `bbox`, with a pixel to spare."""
+    left, top, width, height = bbox_region(bbox)
+    x0, y0 = int(left * canvas.scale) - 1, int(top * canvas.scale) - 1
+    x1, y1 = int((left + width) * canvas.scale) + 2, int((top + height) * canvas.scale) + 2
+    return slice(max(y0, 0), max(y1, 0)), slice(max(x0, 0), max(x1, 0))
+
+
+@pytest.mark.parametrize("name", ["abcd.strokes.rm", "writing_tools.rm", "layers.stroke.rm"])
+def test_ink_where_the_strokes_are(name):
+    tree = read_tree(name)
+    canvas = Canvas()
+    draw_page(tree, canvas)
+    ink = (canvas.to_image() < 255).any(axis=2)
+
+    covered = np.zeros_like(ink)
+    for entry in iter_strokes(tree):
+        box = pixel_box(canvas, entry.bbox)
+        covered[box] = True
+        if entry.line.tool not in (si.Pen.ERASER, si.Pen.ERASER_AREA):
+            assert ink[box].any()
+    assert ink.any()
+    assert not (ink & ~covered).any()
+
+
+def test_text_is_drawn():
+    canvas = Canvas()
+    draw_page(read_tree("abcd.text.rm"), canvas)
+    assert (canvas.to_image() < 128).any()
@@ -0,0 +1,69 @@
+import io
+from pathlib import Path
+
+import pytest
+
+from rmscene import read_blocks, read_tree, write_blocks
+from rmscene import scene_items as si
+from rmscene.scene_stream import SceneLineItemBlock
+
+from rmc.exporters.points import PointArray, packed_points, read_packed_blocks, read_packed_tree
+
+DATA = Path(__file__).parent / "rm"
+
+FIXTURES = sorted(p.name for p in DATA.glob("*.rm"))
+
+
+def lines(tree):
+    return [item for item in tree.walk() if isinstance(item, si.Line)]
+
+
+@pytest.mark.parametrize("name", FIXTURES)
+def test_packed_blocks_match_read_blocks(name):
+    with open(DATA / name, "rb") as f:
+        packed = list(read_packed_blocks(f))
+    with open(DATA / name, "rb") as f:
+        blocks = list(read_blocks(f))
+    assert [type(block) for block in packed] == [type(block) for block in blocks]
+    for packed_block, block in zip(packed, blocks):
+        if isinstance(block, SceneLineItemBlock) and block.item.value is not None:
+            assert isinstance(packed_block.item.value.points, PointArray)
+        # Points compare equal to rmscene's lists of `Point`, value for value
+        assert packed_block == block
+
+
+@pytest.mark.parametrize("name", FIXTURES)
+def test_packed_tree_matches_read_tree(name):
+    with open(DATA / name, "rb") as f:
+        packed = read_packed_tree(f)
+    with open(DATA / name, "rb") as f:
+        tree = read_tree(f)
+    assert packed.root == tree.root
+    assert packed.root_text == tree.root_text
+    assert len(lines(packed)) == len(lines(tree))
+    for packed_line, line in zip(lines(packed), lines(tree)):
+        assert list(packed_line.points) == line.points
+        assert packed_points(line.points) == packed_line.points
+
+
+# rmscene can only write points in the current format, so not files with
+# version 1 points
+@pytest.mark.parametrize("name", ["Lines_v2.rm", "eraser.strokes.rm"])
+def test_packed_blocks_write_back(name):
+    data = (DATA / name).read_bytes()
+    with open(DATA / name, "rb") as f:
+        blocks = list(read_blocks(f))
+    output = io.BytesIO()
+    write_blocks(output, list(read_packed_blocks(io.BytesIO(data))))
+    expected = io.BytesIO()
+    write_blocks(expected, blocks)
+    assert output.getvalue() == expected.getvalue()
+
+
+def test_slices_and_points():
+    points = PointArray.from_points([si.Point(x, 2 * x, 3, 4, 5, 6) for x in range(10)])
+    assert len(points) == 10
+    assert points[3] == si.Point(3, 6, 3, 4, 5, 6)
+    assert list(points[2:4]) == [points[2], points[3]]
+    assert points.bbox() == (0, 0, 9, 18)
+    assert PointArray.from_points([]).bbox() is None
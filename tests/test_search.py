@@ -0,0 +1,32 @@
+import json
+import shutil
+from pathlib import Path
+
+from rmc.search import SearchIndex
+
+DATA = Path(__file__).parent / "rm"
+
+
+def test_reordered_and_renamed_notebook(tmp_path):
+    library = tmp_path / "xochitl"
+    pages_dir = library / "doc"
+    pages_dir.mkdir(parents=True)
+    content_path = library / "doc.content"
+    metadata_path = library / "doc.metadata"
+    content_path.write_text(json.dumps({"pages": ["a", "b"]}))
+    metadata_path.write_text(json.dumps({"visibleName": "Notes"}))
+    shutil.copy(DATA / "abcd.text.rm", pages_dir / "a.rm")
+    shutil.copy(DATA / "Normal_AB.rm", pages_dir / "b.rm")
+
+    with SearchIndex(tmp_path / "index.db") as index:
+        assert len(index.update([library]).indexed) == 2
+        [hit] = index.search("abc")
+        assert (hit.document, hit.title, hit.page, hit.page_number) == ("doc", "Notes", "a", 1)
+
+        content_path.write_text(json.dumps({"pages": ["b", "a"]}))
+        metadata_path.write_text(json.dumps({"visibleName": "Old notes"}))
+        result = index.update([library])
+        assert result.indexed == []
+        assert len(result.unchanged) == 2
+        [hit] = index.search("abc")
+        assert (hit.title, hit.page, hit.page_number) == ("Old notes", "a", 2)
@@ -0,0 +1,109 @@
+import os
+import shutil
+import stat
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+
+from rmc import formats
+from rmc.formats import Format
+from rmc.server import Client, ConversionServer, ServerError
+
+DATA = Path(__file__).parent / "rm"
+
+
+def hang(f, fout, pid_file, **options):
+    Path(pid_file).write_text(str(os.getpid()))
+    time.sleep(3600)
+
+
+def is_running(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+@contextmanager
+def running_server(socket_path, root=None):
+    server = ConversionServer(str(socket_path), jobs=1, max_pending=1, timeout=1, root=root)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.close_connections()
+        server.server_close()
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    # Forked workers inherit the format
+    monkeypatch.setattr(formats, "_plugins", {"hang": Format("hang", hang, binary=True)})
+    with running_server(tmp_path / "rmc.sock", root=DATA) as server:
+        yield server
+
+
+def test_convert(server):
+    with Client(server.server_address) as client:
+        assert b"<svg" in client.convert(DATA / "abcd.strokes.rm", to="svg")
+        with pytest.raises(ServerError) as exc_info:
+            client.convert(data=b"not an rm file", to="svg")
+        assert exc_info.value.code == "conversion_failed"
+
+
+def test_hung_conversion_frees_slot_and_worker(server, tmp_path):
+    pid_file = tmp_path / "pid"
+    with Client(server.server_address) as client:
+        with pytest.raises(ServerError) as exc_info:
+            client.convert(data=b"", to="hang", timeout=0.5, pid_file=str(pid_file))
+        assert exc_info.value.code == "timeout"
+        # With one slot and one worker, this is only served if both were freed
+        assert b"<svg" in client.convert(DATA / "abcd.strokes.rm", to="svg", timeout=10)
+
+    # The stuck worker is killed once the old pool's other requests have had
+    # their time
+    pid = int(pid_file.read_text())
+    deadline = time.monotonic() + 10
+    while is_running(pid) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert not is_running(pid)
+
+
+def test_socket_is_private(server):
+    assert stat.S_IMODE(os.stat(server.server_address).st_mode) == 0o600
+
+
+def test_paths_outside_root_refused(tmp_path):
+    root = tmp_path / "root"
+    root.mkdir()
+    shutil.copy(DATA / "abcd.strokes.rm", root / "inside.rm")
+    (root / "link.rm").symlink_to(DATA / "abcd.strokes.rm")
+    with running_server(tmp_path / "rmc.sock", root=str(root)) as server:
+        with Client(server.server_address) as client:
+            assert b"<svg" in client.convert(root / "inside.rm", to="svg")
+            for path in [DATA / "abcd.strokes.rm", root / "link.rm", root / ".." / "root.rm"]:
+                with pytest.raises(ServerError) as exc_info:
+                    client.convert(path, to="svg")
+                assert exc_info.value.code == "bad_request"
+
+
+def test_paths_refused_without_root(tmp_path):
+    with running_server(tmp_path / "rmc.sock") as server:
+        with Client(server.server_address) as client:
+            with pytest.raises(ServerError) as exc_info:
+                client.convert(DATA / "abcd.strokes.rm", to="svg")
+            assert exc_info.value.code == "bad_request"
+            data = (DATA / "abcd.strokes.rm").read_bytes()
+            assert b"<svg" in client.convert(data=data, to="svg")
+
+
+def test_workers_are_tracked(server):
+    workers = server.workers[server.pool]
+    assert len(workers) == 1
+    assert all(process.is_alive() for process in workers)
@@ -0,0 +1,108 @@
+import io
+import random
+import re
+from pathlib import Path
+
+import pytest
+
+from rmscene import scene_items as si
+
+from rmc.erase import cull_erased_strokes
+from rmc.exporters.points import read_packed_tree
+from rmc.exporters.svg import tree_to_svg
+from rmc.spatial import StrokeIndex, bbox_region, intersects, iter_strokes
+
+DATA = Path(__file__).parent / "rm"
+
+FIXTURES = ["writing_tools.rm", "eraser.strokes.rm", "layers.stroke.rm", "abcd.strokes.rm"]
+
+
+def read_tree(name):
+    with open(DATA / name, "rb") as f:
+        return read_packed_tree(f)
+
+
+def drawn_ids(tree, bbox):
+    """Return the ids of the strokes drawn in the SVG of `bbox`."""
+    output = io.StringIO()
+    tree_to_svg(tree, output, bbox=bbox)
+    ids = set(re.findall(r"<!-- child (CrdtId\(\d+, \d+\)) -->", output.getvalue()))
+    return {str(entry.path[-1]) for entry in iter_strokes(tree)} & ids
+
+
+@pytest.mark.parametrize("name", FIXTURES)
+def test_query_matches_scan(name):
+    tree = read_tree(name)
+    entries = list(iter_strokes(tree))
+    index = StrokeIndex.from_tree(tree, cell_size=64)
+    rng = random.Random(0)
+    for _ in range(50):
+        x0, y0 = rng.uniform(-702, 702), rng.uniform(0, 1872)
+        bbox = (x0, y0, x0 + rng.uniform(0, 500), y0 + rng.uniform(0, 500))
+        assert index.query(bbox) == [entry for entry in entries if intersects(entry.bbox, bbox)]
+
+
+def test_bbox_export_omits_strokes_outside():
+    tree = read_tree("writing_tools.rm")
+    entries = list(iter_strokes(tree))
+    # The top half of the strokes, with some crossing the bottom edge
+    bbox = (-702, 0, 702, 600)
+    inside = {str(e.path[-1]) for e in entries if e.bbox[3] <= 600}
+    crossing = {str(e.path[-1]) for e in entries if e.bbox[1] < 600 < e.bbox[3]}
+    outside = {str(e.path[-1]) for e in entries if e.bbox[1] > 600}
+    assert inside and crossing and outside
+
+    drawn = drawn_ids(tree, bbox)
+    assert drawn == inside | crossing
+
+
+def test_bbox_keeps_wide_strokes_beyond_their_points():
+    tree = read_tree("eraser.strokes.rm")
+    entry = next(e for e in iter_strokes(tree) if e.line.tool == si.Pen.ERASER)
+    x1 = max(entry.line.points.x) + entry.offset[0]
+    # A region to the right of the stroke's points, but reached by its
+    # width, which is wider than the points' width suggests
+    assert max(entry.line.points.width) / 8 < 4
+    near = (x1 + 4, entry.bbox[1], x1 + 50, entry.bbox[3])
+    assert str(entry.path[-1]) in drawn_ids(tree, near)
+    far = (entry.bbox[2] + 1, entry.bbox[1], entry.bbox[2] + 50, entry.bbox[3])
+    assert str(entry.path[-1]) not in drawn_ids(tree, far)
+
+
+@pytest.mark.parametrize("name", ["writing_tools.rm", "eraser.strokes.rm", "Lines_v2.rm"])
+def test_stroke_bbox_contains_ink(name):
+    np = pytest.importorskip("numpy")
+    from rmc.exporters.png import Canvas, draw_page
+
+    tree = read_tree(name)
+    for entry in iter_strokes(tree):
+        # Draw the stroke alone, on a canvas reaching well beyond its box
+        x0, y0, x1, y1 = entry.bbox
+        region = bbox_region((x0 - 50, y0 - 50, x1 + 50, y1 + 50))
+        canvas = Canvas(region=region)
+        # On grey, so that erasers' white ink shows too
+        canvas.pixels[:] = 0.5
+        draw_page(tree, canvas, visible=set(entry.path))
+        ink = (canvas.to_image() != 128).any(axis=2)
+        rows, cols = np.nonzero(ink)
+        # The box in pixels, with one to spare for antialiasing
+        left, top, width, height = bbox_region(entry.bbox)
+        box_x0 = (left - canvas.left) * canvas.scale - 1
+        box_y0 = (top - canvas.top) * canvas.scale - 1
+        box_x1 = box_x0 + width * canvas.scale + 2
+        box_y1 = box_y0 + height * canvas.scale + 2
+        assert (cols + 1 >= box_x0).all() and (cols <= box_x1).all()
+        assert (rows + 1 >= box_y0).all() and (rows <= box_y1).all()
+
+
+def test_index_is_kept_with_tree():
+    tree = read_tree("eraser.strokes.rm")
+    index = StrokeIndex.for_tree(tree)
+    assert StrokeIndex.for_tree(tree) is index
+    assert StrokeIndex.for_tree(read_tree("eraser.strokes.rm")) is not index
+
+    # Culling changes the strokes, so the index is built again
+    cull_erased_strokes(tree)
+    culled = StrokeIndex.for_tree(tree)
+    assert culled is not index
+    assert [e.bbox for e in culled.entries] == [e.bbox for e in iter_strokes(tree)]
@@ -0,0 +1,186 @@
+import gzip
+import io
+import math
+import re
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import pytest
+
+from rmscene import scene_items as si
+
+from rmc.exporters import svg
+from rmc.exporters.points import PointArray, read_packed_tree
+from rmc.exporters.svg import (
+    FragmentCache,
+    Segment,
+    StyleClasses,
+    convert_svg,
+    convert_svgz,
+    merge_segments,
+    simplify_indices,
+    trees_to_svg,
+)
+
+DATA = Path(__file__).parent / "rm"
+
+
+def read_tree(name):
+    with open(DATA / name, "rb") as f:
+        return read_packed_tree(f)
+
+
+def to_svg(name, **options) -> str:
+    output = io.StringIO()
+    with open(DATA / name, "rb") as f:
+        convert_svg(f, output, **options)
+    return output.getvalue()
+
+
+def curve(count=50) -> PointArray:
+    return PointArray.from_points([
+        si.Point(10 * i, 100 * math.sin(i / 5), 0, 0, 0, 0) for i in range(count)
+    ])
+
+
+def distance_to_polyline(x, y, xs, ys) -> float:
+    distances = []
+    for ax, ay, bx, by in zip(xs, ys, xs[1:], ys[1:]):
+        vx, vy = bx - ax, by - ay
+        t = max(0, min(1, ((x - ax) * vx + (y - ay) * vy) / (vx * vx + vy * vy)))
+        distances.append(math.hypot(x - ax - t * vx, y - ay - t * vy))
+    return min(distances)
+
+
+def test_simplify_tolerance_zero_keeps_every_point():
+    points = curve()
+    assert list(simplify_indices(points, range(len(points)), 0)) == list(range(len(points)))
+
+
+@pytest.mark.parametrize("tolerance", [0.5, 2, 10])
+def test_simplify_stays_within_tolerance(tolerance):
+    points = curve()
+    kept = list(simplify_indices(points, range(len(points)), tolerance))
+    assert kept[0] == 0 and kept[-1] == len(points) - 1
+    assert len(kept) < len(points)
+    xs = [points.x[i] for i in kept]
+    ys = [points.y[i] for i in kept]
+    for i in range(len(points)):
+        assert distance_to_polyline(points.x[i], points.y[i], xs, ys) <= tolerance + 1e-9
+
+
+def test_simplify_keeps_segments():
+    plain = to_svg("writing_tools.rm")
+    simplified = to_svg("writing_tools.rm", simplify=1)
+    assert len(simplified) < len(plain)
+    assert simplified.count("<polyline") == plain.count("<polyline")
+
+
+def test_merge_segments():
+    segments = [
+        Segment("rgb(0, 0, 0)", 2.0, 1, range(0, 3)),
+        Segment("rgb(0, 0, 0)", 2.0, 1, range(2, 5)),
+        Segment("rgb(0, 0, 0)", 3.0, 1, range(4, 7)),
+        Segment("rgb(0, 0, 0)", 3.0, 1, [6, 7, 8]),
+    ]
+    assert list(merge_segments(segments)) == [
+        Segment("rgb(0, 0, 0)", 2.0, 1, range(0, 5)),
+        Segment("rgb(0, 0, 0)", 3.0, 1, [4, 5, 6, 7, 8]),
+    ]
+
+
+@pytest.mark.parametrize("name", ["writing_tools.rm", "abcd.strokes.rm"])
+def test_merged_segments_render_identically(name, monkeypatch):
+    np = pytest.importorskip("numpy")
+    from rmc.exporters.png import Canvas, draw_page
+
+    images = []
+    for merge in (True, False):
+        if not merge:
+            monkeypatch.setattr(svg, "merge_segments", lambda segments: segments)
+        canvas = Canvas()
+        draw_page(read_tree(name), canvas)
+        images.append(canvas.to_image())
+    assert np.array_equal(*images)
+
+
+def test_repeated_styles_become_classes():
+    styles = StyleClasses()
+    assert styles.attribute("stroke:red") == 'style="stroke:red"'
+    assert styles.attribute("stroke:blue") == 'style="stroke:blue"'
+    assert styles.attribute("stroke:red") == 'class="s0"'
+    assert styles.attribute("stroke:red") == 'class="s0"'
+    output = io.StringIO()
+    styles.write(output)
+    assert ".s0 { stroke:red }" in output.getvalue()
+    assert "blue" not in output.getvalue()
+
+
+def test_svg_classes_are_defined():
+    output = to_svg("writing_tools.rm")
+    used = set(re.findall(r'class="(s\d+)"', output))
+    assert used
+    defined = set(re.findall(r"\.(s\d+) \{", output))
+    assert used == defined
+
+
+@pytest.mark.parametrize("cache", [None, FragmentCache()])
+def test_page_ids_are_unique(cache):
+    names = ["Normal_A_stroke_2_layers.rm", "Normal_A_stroke_2_layers.rm", "abcd.strokes.rm"]
+    output = io.StringIO()
+    trees_to_svg((read_tree(name) for name in names), output, cache=cache)
+
+    root = ET.fromstring(output.getvalue())
+    ns = "{http://www.w3.org/2000/svg}"
+    pages = root.findall(f"{ns}g[@id]")
+    pages = [page for page in pages if re.fullmatch(r"p\d+", page.get("id"))]
+    assert [page.get("id") for page in pages] == ["p1", "p2", "p3"]
+    assert [page.get("style") for page in pages] == [
+        "display:inline", "display:none", "display:none"]
+    ids = [element.get("id") for element in root.iter() if element.get("id") is not None]
+    assert len(ids) == len(set(ids))
+    # Each page has the same groups, under its own ids
+    assert len(pages[0].findall(".//*[@id]")) == len(pages[1].findall(".//*[@id]")) > 0
+
+
+NUMBER_RE = re.compile(r"-?(?:\d+\.?\d*|\.\d+)")
+
+
+def path_points(d):
+    """Return the absolute points of a path written by `path_data`."""
+    start, _, steps = d[1:].partition("l")
+    x, y = (float(v) for v in NUMBER_RE.findall(start))
+    points = [(x, y)]
+    numbers = [float(v) for v in NUMBER_RE.findall(steps)]
+    for dx, dy in zip(numbers[::2], numbers[1::2]):
+        x, y = x + dx, y + dy
+        points.append((x, y))
+    return points
+
+
+@pytest.mark.parametrize("name", ["abcd.strokes.rm", "writing_tools.rm"])
+def test_precision_rounds_coordinates(name):
+    polylines = re.findall(r'<polyline [^>]*points="([^"]*)"', to_svg(name))
+    paths = re.findall(r'<path [^>]*d="([^"]*)"', to_svg(name, precision=1))
+    assert "<polyline" not in to_svg(name, precision=1)
+    assert len(paths) == len(polylines) > 0
+
+    for d, points in zip(paths, polylines):
+        # One decimal place at most
+        assert all(len(number.partition(".")[2]) <= 1 for number in NUMBER_RE.findall(d))
+        exact = [tuple(float(v) for v in point.split(",")) for point in points.split()]
+        rounded = path_points(d)
+        # The polyline's points are rounded to three places themselves
+        tolerance = 0.05 + 0.0005 + 1e-9
+        assert max(abs(a - b) for a, b in zip(rounded[0], exact[0])) <= tolerance
+        assert max(abs(a - b) for a, b in zip(rounded[-1], exact[-1])) <= tolerance
+        # Steps are between rounded points, so errors don't build up
+        for x, y in rounded:
+            assert min(max(abs(x - ex), abs(y - ey)) for ex, ey in exact) <= tolerance
+
+
+def test_svgz_precision():
+    output = io.BytesIO()
+    with open(DATA / "writing_tools.rm", "rb") as f:
+        convert_svgz(f, output, precision=1)
+    assert gzip.decompress(output.getvalue()).decode("utf-8") == to_svg("writing_tools.rm", precision=1)
@@ -0,0 +1,81 @@
+import io
+import struct
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from rmc.exporters import thumbnail
+from rmc.exporters.png import Canvas, draw_page
+from rmc.exporters.points import read_packed_tree
+from rmc.exporters.svg import PAGE_HEIGHT_PT, PAGE_WIDTH_PT
+
+DATA = Path(__file__).parent / "rm"
+
+
+def read_tree(name):
+    with open(DATA / name, "rb") as f:
+        return read_packed_tree(f)
+
+
+def thumbnail_image(name, monkeypatch, width=thumbnail.DEFAULT_WIDTH):
+    """Return the image of the thumbnail of `name`, as passed to write_png."""
+    images = []
+    monkeypatch.setattr(thumbnail, "write_png",
+                        lambda output, image, dpi, level: images.append(image))
+    thumbnail.tree_to_thumbnail(read_tree(name), io.BytesIO(), width)
+    return images[0]
+
+
+@pytest.mark.parametrize("width", [100, 200])
+def test_thumbnail_size(width):
+    output = io.BytesIO()
+    thumbnail.tree_to_thumbnail(read_tree("abcd.strokes.rm"), output, width)
+    data = output.getvalue()
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    assert data[12:16] == b"IHDR"
+    assert struct.unpack(">II", data[16:24]) == (width, round(PAGE_HEIGHT_PT * width / PAGE_WIDTH_PT))
+
+
+@pytest.mark.parametrize("name", ["writing_tools.rm", "Lines_v2.rm", "eraser.strokes.rm"])
+def test_ink_matches_png(name, monkeypatch):
+    image = thumbnail_image(name, monkeypatch)
+    dpi = thumbnail.DEFAULT_WIDTH / PAGE_WIDTH_PT * 72
+    canvas = Canvas(dpi)
+    draw_page(read_tree(name), canvas)
+    full = canvas.to_image()
+
+    # About as much ink as in the full image...
+    ink = (image < 200).any(axis=2)
+    full_ink = (full < 200).any(axis=2)
+    assert full_ink.sum() / 2 < ink.sum() < full_ink.sum() * 2
+    # ...and all of it at most a pixel away from ink in the full image
+    near = np.pad((full < 255).any(axis=2), 1)
+    height, width = ink.shape
+    near = np.logical_or.reduce([near[1 + dy:1 + dy + height, 1 + dx:1 + dx + width]
+                                 for dy in (-1, 0, 1) for dx in (-1, 0, 1)])
+    assert not (ink & ~near).any()
+
+
+def test_faint_strokes_are_skipped(monkeypatch):
+    monkeypatch.setattr(thumbnail, "MIN_VISIBLE_INK", 2)
+    image = thumbnail_image("writing_tools.rm", monkeypatch)
+    assert (image == 255).all()
+
+
+def test_small_text_is_drawn_as_bars(monkeypatch):
+    image = thumbnail_image("abcd.text.rm", monkeypatch)
+    bar = np.round(np.array(thumbnail.TEXT_BAR_COLOR) * 255)
+    assert (image == bar).all(axis=2).any()
+    assert not (image == 0).all(axis=2).any()
+
+    image = thumbnail_image("abcd.text.rm", monkeypatch, width=2000)
+    assert not (image == bar).all(axis=2).any()
+    assert (image == 0).all(axis=2).any()
+
+
+def test_pixel_indices_keep_stroke_ends():
+    x = np.array([0.1, 0.2, 0.3, 1.5, 1.6, 0.1, 0.2, 0.3])
+    y = np.zeros(len(x))
+    assert list(thumbnail.pixel_indices(x, y, np.array([0, 5]))) == [0, 3, 4, 5, 7]
@@ -0,0 +1,103 @@
+import random
+import re
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from rmscene import scene_items as si
+
+from rmc.exporters.points import PointArray, packed_points, read_packed_tree
+from rmc.exporters.svg import (
+    VECTORIZE_MIN_POINTS,
+    stroke_segments_array,
+    stroke_segments_scalar,
+)
+from rmc.exporters.writing_tools import Pen, _decaying_sum
+from rmc.spatial import iter_strokes
+
+DATA = Path(__file__).parent / "rm"
+
+# One of each pen: Brush, Caligraphy, Marker, Ballpoint, Fineliner, Pencil,
+# Mechanical_Pencil, Highlighter, Erase_Area and Eraser
+PEN_NUMBERS = [0, 21, 3, 2, 4, 1, 7, 5, 8, 6]
+
+
+PENS = [Pen(2.0, 0)] + [
+    Pen.create(pen_nr, color_id, 2.0) for pen_nr in PEN_NUMBERS for color_id in (0, 6)
+]
+
+
+def fixture_points() -> list[PointArray]:
+    strokes = []
+    for path in sorted(DATA.glob("*.rm")):
+        with open(path, "rb") as f:
+            strokes.extend(packed_points(entry.line.points)
+                           for entry in iter_strokes(read_packed_tree(f)))
+    return strokes
+
+
+def synthetic_points(count=VECTORIZE_MIN_POINTS * 4, seed=0) -> PointArray:
+    rng = random.Random(seed)
+    return PointArray.from_points([
+        si.Point(i * 0.5, 100 + 10 * np.sin(i / 10), rng.randint(0, 200),
+                 rng.randint(0, 255), rng.randint(1, 30), rng.randint(0, 255))
+        for i in range(count)
+    ])
+
+
+STROKES = fixture_points() + [synthetic_points()]
+
+
+def rgb(colors) -> np.ndarray:
+    return np.array([[int(c) for c in re.findall(r"\d+", color)] for color in colors])
+
+
+def scalar_styles(pen, columns):
+    widths, colors, opacities = [], [], []
+    last_width = 0
+    for args in zip(*(column.tolist() for column in columns)):
+        colors.append(pen.get_segment_color(*args, last_width))
+        opacities.append(pen.get_segment_opacity(*args, last_width))
+        widths.append(pen.get_segment_width(*args, last_width))
+        last_width = widths[-1]
+    return widths, colors, opacities
+
+
+@pytest.mark.parametrize("pen", PENS, ids=lambda pen: f"{pen.name}-{pen.base_color}")
+def test_array_styles_match_scalar(pen):
+    for points in STROKES:
+        columns = [np.asarray(column, dtype=float) for column in
+                   (points.speed, points.direction, points.width, points.pressure)]
+        widths = pen.get_segment_widths(*columns)
+        last_widths = np.concatenate(([0.0], widths[:-1]))
+        colors = pen.get_segment_colors(*columns, last_widths)
+        opacities = pen.get_segment_opacities(*columns, last_widths)
+
+        expected_widths, expected_colors, expected_opacities = scalar_styles(pen, columns)
+        assert np.allclose(widths, expected_widths)
+        assert np.allclose(opacities, expected_opacities)
+        # Channels are truncated to integers, which can tip either way
+        assert np.abs(rgb(colors) - rgb(expected_colors)).max() <= 1
+
+
+@pytest.mark.parametrize("pen", PENS, ids=lambda pen: f"{pen.name}-{pen.base_color}")
+def test_array_segments_match_scalar(pen):
+    points = synthetic_points()
+    segments = list(stroke_segments_array(points, pen))
+    expected = list(stroke_segments_scalar(points, pen))
+    assert [s.indices for s in segments] == [s.indices for s in expected]
+    assert np.allclose([s.width for s in segments], [s.width for s in expected])
+    assert np.allclose([s.opacity for s in segments], [s.opacity for s in expected])
+    assert np.abs(rgb(s.color for s in segments) - rgb(s.color for s in expected)).max() <= 1
+
+
+def test_decaying_sum():
+    values = np.array([1.0, 2.0, -3.0, 0.5, 4.0] * 10)
+    expected = []
+    last = 0
+    for value in values.tolist():
+        last = value + 0.1 * last
+        expected.append(last)
+    assert np.allclose(_decaying_sum(values, 0.1), expected)